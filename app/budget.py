@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import logging
+import math
+import re
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, TypeVar
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Для смешанного русско-английского текста BPE-токенизаторы дают ~3 символа на токен
+_CHARS_PER_TOKEN = 3.0
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    name = get_settings().budget.tokenizer_name
+    if not name:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        tok = AutoTokenizer.from_pretrained(name)
+        logger.info("Token budgeting uses tokenizer: %s", name)
+        return tok
+    except Exception:
+        logger.warning("Tokenizer %s is unavailable, falling back to char-based estimate", name, exc_info=True)
+        return None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tok = _tokenizer()
+    if tok is not None:
+        return len(tok.encode(text, add_special_tokens=False))
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    tok = _tokenizer()
+    if tok is not None:
+        ids = tok.encode(text, add_special_tokens=False)[:max_tokens]
+        return tok.decode(ids).rstrip() + "…"
+    return text[: int(max_tokens * _CHARS_PER_TOKEN)].rstrip() + "…"
+
+@dataclass
+class PackedMessage:
+    """Одно или несколько подряд идущих коротких сообщений одного автора, склеенных в один элемент."""
+    tg_msg_ids: list[int]
+    chat_id: int
+    dt: datetime
+    sender_id: int | None
+    sender_name: str | None
+    texts: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return " / ".join(self.texts)
+
+def merge_adjacent(messages: Iterable[Any], short_tokens: int, max_gap_seconds: int) -> list[PackedMessage]:
+    """
+    Склеивает соседние короткие сообщения одного автора в одном чате (реплики вида "ок", "да, завтра").
+    messages должны быть отсортированы по dt.
+    """
+    out: list[PackedMessage] = []
+    cur_tokens = 0
+    last_dt: datetime | None = None
+    for m in messages:
+        text = (m.text or "").replace("\n", " ").strip()
+        t = count_tokens(text)
+        prev = out[-1] if out else None
+        if (
+            prev is not None
+            and prev.chat_id == m.chat_id
+            and (prev.sender_id, prev.sender_name) == (m.sender_id, m.sender_name)
+            and (m.dt - last_dt).total_seconds() <= max_gap_seconds
+            and t <= short_tokens
+            and cur_tokens + t <= short_tokens * 2
+        ):
+            prev.tg_msg_ids.append(m.tg_msg_id)
+            prev.texts.append(text)
+            cur_tokens += t
+            last_dt = m.dt
+            continue
+        out.append(PackedMessage(
+            tg_msg_ids=[m.tg_msg_id],
+            chat_id=m.chat_id,
+            dt=m.dt,
+            sender_id=m.sender_id,
+            sender_name=m.sender_name,
+            texts=[text],
+        ))
+        cur_tokens = t
+        last_dt = m.dt
+    return out
+
+def pack(items: Iterable[T], cost: Callable[[T], int], max_tokens: int) -> list[list[T]]:
+    """Жадно раскладывает элементы по чанкам так, чтобы сумма cost в чанке не превышала max_tokens."""
+    chunks: list[list[T]] = []
+    current: list[T] = []
+    cur = 0
+    for it in items:
+        c = cost(it)
+        if current and cur + c > max_tokens:
+            chunks.append(current)
+            current = []
+            cur = 0
+        current.append(it)
+        cur += c
+    if current:
+        chunks.append(current)
+    return chunks
+
+def take_within_budget(items: Iterable[T], cost: Callable[[T], int], max_tokens: int) -> list[T]:
+    """Берёт элементы по порядку, пока укладываемся в бюджет (первый элемент берётся всегда)."""
+    out: list[T] = []
+    used = 0
+    for it in items:
+        c = cost(it)
+        if out and used + c > max_tokens:
+            break
+        out.append(it)
+        used += c
+    return out
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _shingles(text: str) -> frozenset[str]:
+    return frozenset(_WORD_RE.findall(text.lower()))
+
+def dedupe_near(items: Iterable[T], text_of: Callable[[T], str], threshold: float) -> list[T]:
+    """
+    Убирает почти одинаковые элементы (пересылки, повторы, цитаты): Jaccard по множеству слов >= threshold.
+    Порядок сохраняется, остаётся первый (самый релевантный) экземпляр.
+    """
+    kept: list[T] = []
+    kept_sets: list[frozenset[str]] = []
+    for it in items:
+        words = _shingles(text_of(it))
+        dup = False
+        for other in kept_sets:
+            union = len(words | other)
+            if union == 0 or len(words & other) / union >= threshold:
+                dup = True
+                break
+        if dup:
+            continue
+        kept.append(it)
+        kept_sets.append(words)
+    return kept
@@ -1,30 +1,47 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import Callable
 from datetime import datetime
 from sqlalchemy.orm import Session
 
 from app.embeddings import embed_texts
-from app.repo import messages_missing_embeddings, save_embedding
+from app.repo import count_missing_embeddings, messages_missing_embeddings, save_embeddings
 from app.config import get_settings
+from app.logging_setup import ProgressLog
 
 logger = logging.getLogger(__name__)
 
-def build_embeddings_for_period(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, batch_size: int = 128) -> dict:
+def build_embeddings_for_period(
+    db: Session,
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    batch_size: int | None = None,
+    progress: Callable[[int, int, dict], None] | None = None,
+) -> dict:
     s = get_settings()
-    missing = messages_missing_embeddings(db, chat_ids, date_from, date_to, limit=50_000)
-    logger.info("Messages missing embeddings: %d", len(missing))
+    batch_size = batch_size or s.embeddings.batch_size
+    missing = count_missing_embeddings(db, chat_ids, date_from, date_to)
+    logger.info("Messages missing embeddings: %d", missing)
     total = 0
-
-    for i in range(0, len(missing), batch_size):
-        batch = missing[i:i+batch_size]
+    after: tuple[datetime, int] | None = None
+    progress_log = ProgressLog(logger)
+
+    while True:
+        batch = messages_missing_embeddings(db, chat_ids, date_from, date_to, limit=batch_size, after=after)
+        if not batch:
+            break
+        after = (batch[-1].dt, batch[-1].id)
         texts = [m.text for m in batch]
         vecs = embed_texts(texts)
 
-        for m, v in zip(batch, vecs, strict=True):
-            save_embedding(db, m.id, v, s.embedding_model_name)
-            total += 1
+        save_embeddings(db, list(zip(batch, vecs, strict=True)), s.embeddings.model_name)
+        total += len(batch)
 
-        logger.info("Embeddings progress: %d/%d", min(i+batch_size, len(missing)), len(missing))
+        progress_log("Embeddings progress: %d/%d", total, max(missing, total))
+        if progress is not None:
+            # checkpoint не нужен: при повторном запуске берутся только сообщения с embedding_pending
+            progress(total, max(missing, total), {})
 
-    return {"embedded": total, "missing_before": len(missing)}
+    return {"embedded": total, "missing_before": missing}
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.budget import count_tokens, pack
+from app.config import get_settings
+from app.db import SessionLocal
+from app.models import ChatDailyStats, ChatDailySummary
+from app.prompts import PROMPT_VERSION
+from app.repo import load_messages
+from app.schemas import SummaryJSON
+from app.stats import day_start, full_days
+from app.summarization import reduce_summaries, reduce_summaries_stream, save_summary, summarize_messages
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_EPS = timedelta(microseconds=1)
+
+def _stale_days(db: Session, chat_ids: list[int], first: date, last: date, model: str) -> list[tuple[int, date]]:
+    """(chat_id, day) с сообщениями, для которых нет дневной сводки или она построена по другим данным/модели/промптам."""
+    s = ChatDailySummary
+    rows = db.execute(
+        select(ChatDailyStats.chat_id, ChatDailyStats.day)
+        .outerjoin(s, and_(s.chat_id == ChatDailyStats.chat_id, s.day == ChatDailyStats.day))
+        .where(and_(
+            ChatDailyStats.chat_id.in_(chat_ids),
+            ChatDailyStats.day >= first,
+            ChatDailyStats.day <= last,
+            ChatDailyStats.message_count > 0,
+        ))
+        .where(or_(
+            s.chat_id.is_(None),
+            s.model != model,
+            s.prompt_version != PROMPT_VERSION,
+            s.message_count != ChatDailyStats.message_count,
+            s.total_chars != ChatDailyStats.total_chars,
+        ))
+        .order_by(ChatDailyStats.day.asc(), ChatDailyStats.chat_id.asc())
+    ).all()
+    return [(int(r[0]), r[1]) for r in rows]
+
+def _build_day(chat_id: int, day: date) -> None:
+    # выполняется в пуле потоков — своя сессия на задачу
+    settings = get_settings()
+    db = SessionLocal()
+    try:
+        with span("summary.daily", chat=chat_id, day=day.isoformat()):
+            messages = load_messages(db, [chat_id], day_start(day), day_start(day + timedelta(days=1)) - _EPS, fresh=True)
+            summary_json = summarize_messages(messages)
+            values = dict(
+                model=settings.llm.chat_model,
+                prompt_version=PROMPT_VERSION,
+                summary_json=summary_json,
+                message_count=len(messages),
+                total_chars=sum(len(m.text) for m in messages),
+                created_at=datetime.now(timezone.utc),
+            )
+            db.execute(
+                insert(ChatDailySummary)
+                .values(chat_id=chat_id, day=day, **values)
+                .on_conflict_do_update(index_elements=["chat_id", "day"], set_=values)
+            )
+            db.commit()
+    finally:
+        db.close()
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable, *args):
+    # span'ы задач в пуле — дочерние к текущему (у каждой задачи своя копия контекста)
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _is_empty(summary_json: dict) -> bool:
+    return not any(summary_json.get(k) for k in SummaryJSON.model_fields)
+
+def _collect(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, pool: ThreadPoolExecutor,
+) -> Iterator[tuple[int, int]]:
+    """
+    Досчитывает недостающие дневные сводки и сворачивает всё в группы, укладывающиеся в один reduce.
+    Отдаёт прогресс (done, total); результат — список сводок для финального reduce (через StopIteration.value).
+    """
+    settings = get_settings()
+    first, last = full_days(date_from, date_to)
+    todo = _stale_days(db, chat_ids, first, last, settings.llm.chat_model) if first <= last else []
+    logger.info("Daily summaries: %d (chat, day) to build for %s..%s", len(todo), first, last)
+
+    done = 0
+    for fut in as_completed([_submit(pool, _build_day, cid, day) for cid, day in todo]):
+        fut.result()
+        done += 1
+        yield done, len(todo)
+
+    items: list[dict] = []
+    # неполные сутки по краям периода — обычный map по сообщениям всех чатов
+    head_end = day_start(first) - _EPS
+    if date_from <= min(head_end, date_to):
+        items.append(summarize_messages(load_messages(db, chat_ids, date_from, min(head_end, date_to))))
+    if first <= last:
+        # join с chat_daily_stats: сутки отсоединённых секций (scripts.partitions detach) в сводку не попадают
+        items += db.execute(
+            select(ChatDailySummary.summary_json)
+            .join(ChatDailyStats, and_(
+                ChatDailyStats.chat_id == ChatDailySummary.chat_id, ChatDailyStats.day == ChatDailySummary.day,
+            ))
+            .where(and_(
+                ChatDailySummary.chat_id.in_(chat_ids),
+                ChatDailySummary.day >= first,
+                ChatDailySummary.day <= last,
+            ))
+            .order_by(ChatDailySummary.day.asc(), ChatDailySummary.chat_id.asc())
+        ).scalars().all()
+        tail_start = day_start(last + timedelta(days=1))
+        if date_to >= tail_start:
+            items.append(summarize_messages(load_messages(db, chat_ids, tail_start, date_to)))
+    items = [it for it in items if not _is_empty(it)]
+
+    # иерархический reduce: пока всё не помещается в один вызов, сводим группы параллельно
+    def cost(it: dict) -> int:
+        return count_tokens(json.dumps(it, ensure_ascii=False)) + 1
+
+    while len(items) > 1:
+        groups = pack(items, cost, settings.budget.reduce_input_max_tokens)
+        if len(groups) == 1:
+            break
+        if len(groups) == len(items):
+            # каждая сводка сама по себе больше бюджета — сводим хотя бы попарно
+            groups = [items[i:i + 2] for i in range(0, len(items), 2)]
+        logger.info("Daily summaries: reducing %d items in %d groups", len(items), len(groups))
+        with span("summary.reduce_level", items=len(items), groups=len(groups)):
+            items = [f.result() for f in [_submit(pool, reduce_summaries, g) for g in groups]]
+    return items
+
+@contextmanager
+def _pool() -> Iterator[ThreadPoolExecutor]:
+    pool = ThreadPoolExecutor(max_workers=get_settings().llm.max_parallel, thread_name_prefix="daily-summary")
+    try:
+        yield pool
+    finally:
+        # при ошибке или отмене задачи не запускаем оставшиеся в очереди сутки
+        pool.shutdown(wait=True, cancel_futures=True)
+
+@span("summary.generate_by_days")
+def generate_summary_by_days(
+    db: Session,
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    progress: Callable[[int, int, dict], None] | None = None,
+) -> tuple[dict, str]:
+    """
+    Сводка за период из посуточных сводок по каждому чату: недостающие сутки строятся (параллельно, LLM_MAX_PARALLEL)
+    и сохраняются, затем всё объединяется reduce'ом. Повторный запуск за любой период и набор чатов переиспользует
+    готовые сутки. progress(done, total, {}) — по построенным суткам (checkpoint не нужен: сутки уже в БД).
+    """
+    with _pool() as pool:
+        gen = _collect(db, chat_ids, date_from, date_to, pool)
+        while True:
+            try:
+                done, total = next(gen)
+            except StopIteration as stop:
+                items = stop.value
+                break
+            if progress is not None:
+                progress(done, total + 1, {})
+
+    if len(items) <= 1:
+        summary_json = items[0] if items else SummaryJSON().model_dump()
+    else:
+        with span("summary.reduce", chunks=len(items)):
+            summary_json = reduce_summaries(items)
+    return save_summary(db, chat_ids, date_from, date_to, summary_json)
+
+def generate_summary_by_days_stream(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime,
+) -> Iterator[tuple[str, Any]]:
+    """Потоковый вариант generate_summary_by_days; события те же, что у generate_summary_stream."""
+    with span("summary.generate_by_days"):
+        with _pool() as pool:
+            gen = _collect(db, chat_ids, date_from, date_to, pool)
+            while True:
+                try:
+                    done, total = next(gen)
+                except StopIteration as stop:
+                    items = stop.value
+                    break
+                yield "map", f"{done}/{total}"
+
+        if len(items) <= 1:
+            yield "done", save_summary(db, chat_ids, date_from, date_to, items[0] if items else SummaryJSON().model_dump())
+            return
+        with span("summary.reduce", chunks=len(items)):
+            for stage, payload in reduce_summaries_stream(items):
+                if stage == "reduce":
+                    yield stage, payload
+                else:
+                    summary_json = payload
+        yield "done", save_summary(db, chat_ids, date_from, date_to, summary_json)
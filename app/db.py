@@ -1,14 +1,107 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+import time
+from functools import lru_cache
 
-from app.config import get_settings
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
-_settings = get_settings()
+from app import metrics
+from app.config import DatabaseSettings, get_settings
 
-engine = create_engine(_settings.database_url, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+class _TimedQueuePool(QueuePool):
+    """QueuePool, который считает время ожидания свободного соединения (гистограмма db_pool_wait_seconds)."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            metrics.inc("db_pool_errors_total")
+            raise
+        finally:
+            metrics.observe("db_pool_wait_seconds", time.perf_counter() - start)
+
+def is_psycopg3(bind) -> bool:
+    return bind.dialect.driver == "psycopg"
+
+def make_engine(s: DatabaseSettings, url: str | None = None) -> Engine:
+    url = make_url(url or s.url)
+    connect_args: dict = {}
+    if s.statement_timeout_ms > 0:
+        connect_args["options"] = f"-c statement_timeout={s.statement_timeout_ms}"
+    if url.get_driver_name() == "psycopg":
+        # psycopg 3: серверные prepared statements для часто повторяющихся запросов
+        connect_args["prepare_threshold"] = s.prepare_threshold if s.prepare_threshold >= 0 else None
+
+    return create_engine(
+        url,
+        poolclass=_TimedQueuePool,
+        pool_size=s.pool_size,
+        max_overflow=s.max_overflow,
+        pool_timeout=s.pool_timeout,
+        pool_recycle=s.pool_recycle,
+        pool_pre_ping=s.pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+# Движки создаются при первом обращении: импорт app.db не читает настройки и не трогает БД
+@lru_cache(maxsize=1)
+def get_engine() -> Engine:
+    return make_engine(get_settings().db)
+
+@lru_cache(maxsize=1)
+def get_replica_engine() -> Engine | None:
+    s = get_settings().db
+    if not s.replica_url:
+        return None
+    return make_engine(s, s.replica_url).execution_options(postgresql_readonly=True)
+
+# Передаётся в db.execute(..., bind_arguments=READ_REPLICA) для запросов, которые можно отдать реплике
+READ_REPLICA = {"replica": True}
+
+_last_write = 0.0
+_last_write_lock = threading.Lock()
+
+def _recent_write() -> bool:
+    with _last_write_lock:
+        return time.monotonic() - _last_write < get_settings().db.replica_read_after_write_seconds
+
+class RoutingSession(Session):
+    """
+    Сессия с маршрутизацией чтений: запросы с bind_arguments=READ_REPLICA идут в реплику (если она настроена),
+    всё остальное — в primary. Недавно писавший процесс читает из primary (read-after-write).
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, bind=None, replica: bool = False, **kw):
+        if bind is not None:
+            return bind
+        if replica and not _recent_write():
+            replica_engine = get_replica_engine()
+            if replica_engine is not None:
+                return replica_engine
+        return get_engine()
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_flush(session, flush_context) -> None:
+    session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_dml(state) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_write(session) -> None:
+    global _last_write
+    if session.info.pop("wrote", False):
+        with _last_write_lock:
+            _last_write = time.monotonic()
+
+SessionLocal = sessionmaker(class_=RoutingSession, autoflush=False, autocommit=False)
 
 def get_db():
     db = SessionLocal()
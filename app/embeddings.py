@@ -1,20 +1,62 @@
 from __future__ import annotations
 
 import logging
+import threading
+import time
 from functools import lru_cache
-from sentence_transformers import SentenceTransformer
+from typing import TYPE_CHECKING
 
+from app import metrics
 from app.config import get_settings
+from app.tracing import span
+
+# sentence_transformers/torch (или onnxruntime) импортируются при первой загрузке модели, а не при импорте модуля
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+    from app.onnx_embeddings import OnnxEncoder
 
 logger = logging.getLogger(__name__)
 
 @lru_cache(maxsize=1)
-def _model() -> SentenceTransformer:
+def _model() -> SentenceTransformer | OnnxEncoder:
     s = get_settings()
-    logger.info("Loading embedding model: %s", s.embedding_model_name)
-    return SentenceTransformer(s.embedding_model_name)
+    if s.embeddings.backend == "onnx":
+        from app.onnx_embeddings import load_encoder
+
+        return load_encoder()
+
+    from sentence_transformers import SentenceTransformer
+
+    logger.info("Loading embedding model: %s", s.embeddings.model_name)
+    return SentenceTransformer(s.embeddings.model_name)
 
 def embed_texts(texts: list[str]) -> list[list[float]]:
     m = _model()
-    vecs = m.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    with span("embeddings.encode", texts=len(texts)), metrics.timer("embedding_batch_seconds"):
+        vecs = m.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    metrics.inc("embedding_texts_total", len(texts))
     return [v.tolist() for v in vecs]
+
+def _warm_up() -> None:
+    start = time.perf_counter()
+    try:
+        embed_texts(["warm-up"])
+        logger.info("Embedding model warmed up in %.1fs", time.perf_counter() - start)
+    except Exception:
+        logger.warning("Embedding model warm-up failed", exc_info=True)
+    if get_settings().rerank.enabled:
+        from app.rerank import rerank
+
+        start = time.perf_counter()
+        try:
+            rerank("warm-up", [{"text": "warm-up"}], 1)
+            logger.info("Rerank model warmed up in %.1fs", time.perf_counter() - start)
+        except Exception:
+            logger.warning("Rerank model warm-up failed", exc_info=True)
+
+def start_warm_up() -> threading.Thread:
+    """Загружает модель (и модель переранжирования, если включена) в фоне, чтобы первый QA-запрос не ждал загрузки."""
+    t = threading.Thread(target=_warm_up, name="embedding-warm-up", daemon=True)
+    t.start()
+    return t
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+from collections.abc import Callable
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 
@@ -12,27 +14,46 @@ logger = logging.getLogger(__name__)
 
 async def sync_chats(db: Session) -> int:
     dialogs = await list_dialogs()
-    added = upsert_chats(db, dialogs)
+    added = await asyncio.to_thread(upsert_chats, db, dialogs)
     logger.info("Chats synced. New: %d, total dialogs seen: %d", added, len(dialogs))
     return added
 
-async def ingest_period(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> dict:
+async def ingest_period(
+    db: Session,
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    progress: Callable[[int, int, dict], None] | None = None,
+    checkpoint: dict | None = None,
+) -> dict:
+    """
+    progress(done, total, checkpoint) вызывается после каждого чата; checkpoint позволяет продолжить
+    прерванный сбор, пропустив уже обработанные чаты.
+    """
     if date_from.tzinfo is None:
         date_from = date_from.replace(tzinfo=timezone.utc)
     if date_to.tzinfo is None:
         date_to = date_to.replace(tzinfo=timezone.utc)
 
-    results = {"total_inserted": 0, "total_skipped": 0, "by_chat": []}
+    checkpoint = checkpoint or {}
+    results = checkpoint.get("results") or {"total_inserted": 0, "total_skipped": 0, "by_chat": []}
+    done_ids = set(checkpoint.get("done_chat_ids", []))
 
-    chats = [db.get(Chat, cid) for cid in chat_ids]
+    # запись в БД синхронная — выносим в поток, чтобы не блокировать общий event loop
+    chats = await asyncio.to_thread(lambda: [db.get(Chat, cid) for cid in chat_ids])
     chats = [c for c in chats if c is not None]
 
     for c in chats:
+        if c.id in done_ids:
+            continue
         msgs = await fetch_messages(c.tg_peer_id, date_from, date_to)
-        ins, sk = insert_messages(db, c.id, msgs)
+        ins, sk = await asyncio.to_thread(insert_messages, db, c.id, msgs)
         results["total_inserted"] += ins
         results["total_skipped"] += sk
         results["by_chat"].append({"chat": c.title, "inserted": ins, "skipped": sk, "fetched": len(msgs)})
+        done_ids.add(c.id)
+        if progress is not None:
+            progress(len(done_ids), len(chats), {"done_chat_ids": sorted(done_ids), "results": results})
 
     logger.info("Ingest done. Inserted=%d skipped=%d", results["total_inserted"], results["total_skipped"])
     return results
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, and_
+from sqlalchemy.orm import Session
+
+from app.db import SessionLocal
+from app.logging_setup import log_context
+from app.models import Job
+from app.profiling import profile
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ("ingest", "embed", "summary")
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobCancelled(Exception):
+    pass
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def submit_job(db: Session, kind: str, params: dict) -> Job:
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    job = Job(kind=kind, params=params, status="queued", created_at=_now(), checkpoint={})
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    logger.info("Job %d submitted: %s %s", job.id, kind, params)
+    return job
+
+def list_jobs(db: Session, limit: int = 50) -> list[Job]:
+    return list(db.execute(select(Job).order_by(Job.id.desc()).limit(limit)).scalars().all())
+
+def get_job(db: Session, job_id: int) -> Job | None:
+    return db.get(Job, job_id)
+
+def request_cancel(db: Session, job_id: int) -> bool:
+    job = db.get(Job, job_id)
+    if job is None or job.status not in ACTIVE_STATUSES:
+        return False
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = _now()
+    job.cancel_requested = True
+    db.commit()
+    return True
+
+def requeue_stale_jobs(db: Session, stale_after_seconds: int) -> int:
+    """
+    Задачи в статусе running без heartbeat дольше stale_after_seconds (воркер упал/перезапущен)
+    возвращаются в очередь и будут продолжены с последнего checkpoint.
+    """
+    cutoff = _now() - timedelta(seconds=stale_after_seconds)
+    stale = and_(Job.status == "running", Job.heartbeat_at < cutoff)
+    db.execute(
+        update(Job)
+        .where(and_(stale, Job.cancel_requested.is_(True)))
+        .values(status="cancelled", finished_at=_now())
+    )
+    res = db.execute(update(Job).where(stale).values(status="queued", worker_id=None))
+    db.commit()
+    if res.rowcount:
+        logger.warning("Requeued %d stale jobs", res.rowcount)
+    return int(res.rowcount or 0)
+
+def claim_next_job(db: Session, worker_id: str) -> Job | None:
+    job = db.execute(
+        select(Job)
+        .where(and_(Job.status == "queued", Job.cancel_requested.is_(False)))
+        .order_by(Job.created_at.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar_one_or_none()
+    if job is None:
+        db.rollback()
+        return None
+    now = _now()
+    job.status = "running"
+    job.worker_id = worker_id
+    job.started_at = job.started_at or now
+    job.heartbeat_at = now
+    db.commit()
+    db.refresh(job)
+    return job
+
+class JobContext:
+    """
+    Передаётся в пайплайны как progress(done, total, checkpoint).
+    Пишет прогресс в отдельной сессии (не смешивая с транзакциями самой задачи) и прерывает задачу
+    через JobCancelled, если пользователь запросил отмену.
+    """
+
+    def __init__(self, job_id: int, checkpoint: dict):
+        self.job_id = job_id
+        self.checkpoint = checkpoint
+
+    def __call__(self, done: int, total: int, checkpoint: dict | None = None, message: str = "") -> None:
+        if checkpoint:
+            self.checkpoint = {**self.checkpoint, **checkpoint}
+        db = SessionLocal()
+        try:
+            job = db.get(Job, self.job_id)
+            job.progress = done
+            job.total = total
+            job.checkpoint = self.checkpoint
+            job.heartbeat_at = _now()
+            if message:
+                job.message = message
+            cancel = job.cancel_requested
+            db.commit()
+        finally:
+            db.close()
+        if cancel:
+            raise JobCancelled()
+
+def _run_ingest(db: Session, params: dict, ctx: JobContext) -> dict:
+    from app.ingestion import ingest_period
+
+    return asyncio.run(ingest_period(
+        db,
+        params["chat_ids"],
+        datetime.fromisoformat(params["date_from"]),
+        datetime.fromisoformat(params["date_to"]),
+        progress=ctx,
+        checkpoint=ctx.checkpoint,
+    ))
+
+def _run_embed(db: Session, params: dict, ctx: JobContext) -> dict:
+    from app.build_embeddings import build_embeddings_for_period
+
+    return build_embeddings_for_period(
+        db,
+        params["chat_ids"],
+        datetime.fromisoformat(params["date_from"]),
+        datetime.fromisoformat(params["date_to"]),
+        batch_size=params.get("batch_size"),
+        progress=ctx,
+    )
+
+def _run_summary(db: Session, params: dict, ctx: JobContext) -> dict:
+    from app.daily_summaries import generate_summary_by_days
+    from app.summarization import generate_summary
+
+    if params.get("by_days"):
+        js, md = generate_summary_by_days(
+            db,
+            params["chat_ids"],
+            datetime.fromisoformat(params["date_from"]),
+            datetime.fromisoformat(params["date_to"]),
+            progress=ctx,
+        )
+        return {"summary_json": js, "summary_md": md}
+
+    js, md = generate_summary(
+        db,
+        params["chat_ids"],
+        datetime.fromisoformat(params["date_from"]),
+        datetime.fromisoformat(params["date_to"]),
+        progress=ctx,
+        checkpoint=ctx.checkpoint,
+        incremental=params.get("incremental", True),
+    )
+    return {"summary_json": js, "summary_md": md}
+
+_RUNNERS = {
+    "ingest": _run_ingest,
+    "embed": _run_embed,
+    "summary": _run_summary,
+}
+
+def _finish(job_id: int, status: str, result: dict | None = None, error: str | None = None) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = _now()
+        job.heartbeat_at = job.finished_at
+        db.commit()
+    finally:
+        db.close()
+
+def _heartbeat_loop(job_id: int, stop: threading.Event, interval: float) -> None:
+    # отдельный heartbeat, чтобы долгий шаг без progress (например, выгрузка большого чата) не считался зависшим
+    while not stop.wait(interval):
+        db = SessionLocal()
+        try:
+            db.execute(update(Job).where(Job.id == job_id).values(heartbeat_at=_now()))
+            db.commit()
+        except Exception:
+            logger.warning("Heartbeat for job %d failed", job_id, exc_info=True)
+        finally:
+            db.close()
+
+def run_job(job: Job, heartbeat_interval: float = 30.0) -> None:
+    ctx = JobContext(job.id, dict(job.checkpoint or {}))
+    stop = threading.Event()
+    hb = threading.Thread(target=_heartbeat_loop, args=(job.id, stop, heartbeat_interval), daemon=True)
+    hb.start()
+    db = SessionLocal()
+    with log_context(job_id=job.id):
+        try:
+            logger.info("Job %d started: %s %s", job.id, job.kind, job.params)
+            # params["profile"] — профилирование этой задачи, заказанное из UI; иначе решает PROFILE_JOBS
+            with profile(job.kind, f"job{job.id}", enabled=True if job.params.get("profile") else None) as prof:
+                result = _RUNNERS[job.kind](db, job.params, ctx)
+            if prof is not None and prof.path is not None:
+                result = {**result, "profile": str(prof.path)}
+            _finish(job.id, "done", result=result)
+            logger.info("Job %d done", job.id)
+        except JobCancelled:
+            db.rollback()
+            _finish(job.id, "cancelled")
+            logger.info("Job %d cancelled", job.id)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Job %d failed", job.id)
+            _finish(job.id, "failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            stop.set()
+            db.close()
+
+def run_worker(poll_interval: float = 2.0, stale_after_seconds: int = 600, once: bool = False) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info("Job worker %s started", worker_id)
+    while True:
+        db = SessionLocal()
+        try:
+            requeue_stale_jobs(db, stale_after_seconds)
+            job = claim_next_job(db, worker_id)
+        finally:
+            db.close()
+
+        if job is not None:
+            run_job(job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_LITERALS = {"None": "null", "True": "true", "False": "false", "NaN": "null", "undefined": "null"}
+_QUOTES = {'"': '"', "'": "'", "“": "”", "„": "“"}
+
+def _strip_fences(text: str) -> str:
+    m = _FENCE_RE.search(text)
+    if m:
+        return m.group(1)
+    # незакрытый fence (ответ обрезан)
+    return re.sub(r"^\s*```(?:json|JSON)?", "", text)
+
+def _last_sig(out: list[str]) -> str:
+    for ch in reversed(out):
+        if not ch.isspace():
+            return ch
+    return ""
+
+def _fix_syntax(s: str) -> str:
+    """
+    Проход с учётом строк: одинарные/«умные» кавычки -> двойные, None/True/False -> null/true/false,
+    висячие запятые перед } и ], пропущенные запятые между элементами, // комментарии.
+    """
+    out: list[str] = []
+    i, n = 0, len(s)
+    while i < n:
+        ch = s[i]
+
+        if ch in _QUOTES:
+            closer = _QUOTES[ch]
+            if _last_sig(out) in ('"', "}", "]"):
+                out.append(",")
+            buf: list[str] = []
+            j = i + 1
+            while j < n:
+                c = s[j]
+                if c == "\\" and j + 1 < n:
+                    nxt = s[j + 1]
+                    buf.append("'" if nxt == "'" else c + nxt)
+                    j += 2
+                    continue
+                if c == closer:
+                    break
+                if c == '"':
+                    buf.append('\\"')
+                elif c == "\n":
+                    buf.append("\\n")
+                else:
+                    buf.append(c)
+                j += 1
+            out.append('"')
+            out.append("".join(buf))
+            out.append('"')
+            i = j + 1
+            continue
+
+        if ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch in "{[":
+            if _last_sig(out) in ('"', "}", "]"):
+                out.append(",")
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch == "/" and s[i + 1:i + 2] == "/":
+            while i < n and s[i] != "\n":
+                i += 1
+            continue
+
+        if ch.isalpha():
+            j = i
+            while j < n and (s[j].isalnum() or s[j] == "_"):
+                j += 1
+            word = s[i:j]
+            out.append(_LITERALS.get(word, word))
+            i = j
+            continue
+
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+def _balanced(s: str) -> str:
+    """
+    Вырезает первый сбалансированный объект/массив. Если ответ обрезан — дописывает закрывающие скобки.
+    """
+    start = min((p for p in (s.find("{"), s.find("[")) if p != -1), default=-1)
+    if start == -1:
+        raise ValueError("JSON-объект не найден")
+
+    stack: list[str] = []
+    in_str = False
+    esc = False
+    for idx in range(start, len(s)):
+        c = s[idx]
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+            continue
+        if c == '"':
+            in_str = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return s[start:idx + 1]
+
+    tail = s[start:]
+    if in_str:
+        tail += '"'
+    tail = tail.rstrip().rstrip(",")
+    if tail.endswith(":"):
+        tail += "null"
+    return tail + "".join(reversed(stack))
+
+def extract_json(text: str) -> Any:
+    """
+    Локальное извлечение JSON из ответа LLM без дополнительного запроса к модели.
+    Бросает ValueError, если восстановить не удалось.
+    """
+    try:
+        return json.loads(text)
+    except Exception:
+        pass
+
+    body = _strip_fences(text)
+    start = min((p for p in (body.find("{"), body.find("[")) if p != -1), default=-1)
+    if start == -1:
+        raise ValueError("JSON-объект не найден")
+
+    candidate = _balanced(_fix_syntax(body[start:]))
+    try:
+        return json.loads(candidate, strict=False)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Не удалось локально восстановить JSON: {e}") from e
@@ -1,44 +1,211 @@
 from __future__ import annotations
 
 import json
+import logging
+import time
+from collections.abc import Iterator
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 from tenacity import retry, stop_after_attempt, wait_exponential
-from openai import OpenAI
 
+from app import metrics
+from app.budget import count_tokens
 from app.config import get_settings
+from app.json_repair import extract_json
+from app.llm_cache import get_cache, make_key
+from app.tracing import span
 
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Провайдер/модель отклонили response_format — больше не пытаемся в этом процессе
+_json_mode_unsupported = False
+
+# один клиент на процесс: переиспользует HTTP-соединения между вызовами
+@lru_cache(maxsize=1)
 def _client() -> OpenAI:
-    s = get_settings()
-    return OpenAI(base_url=s.openai_base_url, api_key=s.openai_api_key)
+    from openai import OpenAI
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8))
-def chat_completion(system: str, user: str) -> str:
     s = get_settings()
-    client = _client()
+    return OpenAI(base_url=s.llm.base_url, api_key=s.llm.api_key)
 
-    resp = client.chat.completions.create(
-        model=s.chat_model,
+def _request_kwargs(system: str, user: str, model: str, temperature: float) -> dict:
+    return dict(
+        model=model,
         messages=[
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
-        temperature=0.2,
+        temperature=temperature,
     )
 
+def _create(client: OpenAI, kwargs: dict, json_mode: bool):
+    global _json_mode_unsupported
+    from openai import BadRequestError
+
+    if json_mode and not _json_mode_unsupported:
+        try:
+            return client.chat.completions.create(response_format={"type": "json_object"}, **kwargs)
+        except BadRequestError:
+            logger.warning("Provider rejected response_format=json_object, falling back to plain completions")
+            _json_mode_unsupported = True
+    return client.chat.completions.create(**kwargs)
+
+# site — место вызова (map/reduce/repair/qa) для меток метрик llm_*
+def _count_retry(retry_state) -> None:
+    metrics.inc("llm_retries_total", site=retry_state.kwargs.get("site", "other"))
+
+def _count_tokens(site: str, prompt: int, completion: int) -> None:
+    metrics.inc("llm_tokens_total", prompt, site=site, kind="prompt")
+    metrics.inc("llm_tokens_total", completion, site=site, kind="completion")
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), before_sleep=_count_retry)
+def _chat_completion_uncached(system: str, user: str, model: str, temperature: float, json_mode: bool = False, *, site: str = "other") -> str:
+    client = _client()
+    with span("llm.request", site=site, model=model), metrics.timer("llm_request_seconds", site=site):
+        resp = _create(client, _request_kwargs(system, user, model, temperature), json_mode)
+
     text = resp.choices[0].message.content
     if not isinstance(text, str) or not text.strip():
         raise RuntimeError("LLM вернул пустой ответ.")
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        _count_tokens(site, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+    else:
+        _count_tokens(site, count_tokens(system) + count_tokens(user), count_tokens(text))
     return text
 
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=8), before_sleep=_count_retry)
+def _open_stream(system: str, user: str, model: str, temperature: float, json_mode: bool, *, site: str = "other"):
+    client = _client()
+    return _create(client, dict(_request_kwargs(system, user, model, temperature), stream=True), json_mode)
+
+def chat_completion(
+    system: str,
+    user: str,
+    temperature: float | None = None,
+    use_cache: bool = True,
+    json_mode: bool = False,
+    site: str = "other",
+) -> str:
+    """
+    use_cache=False — обойти кэш (например, для принудительной перегенерации).
+    json_mode=True — запросить structured JSON output, если провайдер это поддерживает.
+    site — метка места вызова в метриках (map/reduce/repair/qa).
+    """
+    with span("llm.chat_completion", site=site) as sp:
+        return _chat_completion(system, user, temperature, use_cache, json_mode, site, sp)
+
+def _chat_completion(system: str, user: str, temperature: float | None, use_cache: bool, json_mode: bool, site: str, sp) -> str:
+    s = get_settings()
+    if temperature is None:
+        temperature = s.llm.temperature
+    json_mode = json_mode and s.llm.json_mode
+
+    cache = get_cache() if use_cache else None
+    if cache is None:
+        return _chat_completion_uncached(system, user, s.llm.chat_model, temperature, json_mode, site=site)
+
+    key = make_key(system, user, s.llm.chat_model, temperature, json_mode)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.inc("llm_cache_hits_total", site=site)
+        sp.set(cache="hit")
+        return cached
+
+    metrics.inc("llm_cache_misses_total", site=site)
+    sp.set(cache="miss")
+    text = _chat_completion_uncached(system, user, s.llm.chat_model, temperature, json_mode, site=site)
+    cache.set(key, text)
+    return text
+
+def chat_completion_stream(
+    system: str,
+    user: str,
+    temperature: float | None = None,
+    use_cache: bool = True,
+    json_mode: bool = False,
+    site: str = "other",
+) -> Iterator[str]:
+    """
+    Потоковый вариант chat_completion: отдаёт куски текста по мере генерации.
+    При попадании в кэш весь ответ отдаётся одним куском; полный ответ после стрима сохраняется в кэш.
+    """
+    with span("llm.stream", site=site) as sp:
+        s = get_settings()
+        if temperature is None:
+            temperature = s.llm.temperature
+        json_mode = json_mode and s.llm.json_mode
+
+        cache = get_cache() if use_cache else None
+        key = make_key(system, user, s.llm.chat_model, temperature, json_mode) if cache is not None else ""
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                metrics.inc("llm_cache_hits_total", site=site)
+                sp.set(cache="hit")
+                yield cached
+                return
+            metrics.inc("llm_cache_misses_total", site=site)
+            sp.set(cache="miss")
+
+        parts: list[str] = []
+        usage = None
+        start = time.perf_counter()
+        for chunk in _open_stream(system, user, s.llm.chat_model, temperature, json_mode, site=site):
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    metrics.observe("llm_first_token_seconds", time.perf_counter() - start, site=site)
+                parts.append(delta)
+                yield delta
+        metrics.observe("llm_request_seconds", time.perf_counter() - start, site=site)
+
+        text = "".join(parts)
+        if not text.strip():
+            raise RuntimeError("LLM вернул пустой ответ.")
+        if usage is not None:
+            _count_tokens(site, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+        else:
+            # провайдер не прислал usage в стриме — оценка тем же способом, что и бюджеты контекста
+            _count_tokens(site, count_tokens(system) + count_tokens(user), count_tokens(text))
+        if cache is not None:
+            cache.set(key, text)
+
 @retry(stop=stop_after_attempt(2), wait=wait_exponential(multiplier=1, min=1, max=4))
+@span("llm.repair_json")
 def repair_json(bad_text: str) -> str:
     system = "Ты исправляешь JSON. Верни только валидный JSON без markdown."
     user = f"Исправь в валидный JSON:\n{bad_text}"
-    return chat_completion(system, user)
+    return chat_completion(system, user, json_mode=True, site="repair")
 
 def parse_json_strict(text: str) -> dict:
+    """
+    json.loads -> локальное восстановление (fences, баланс скобок, синтаксис) -> LLM repair_json
+    только в крайнем случае.
+    """
     try:
         return json.loads(text)
     except Exception:
-        fixed = repair_json(text)
+        pass
+
+    try:
+        data = extract_json(text)
+        metrics.inc("llm_json_local_repairs_total")
+        return data
+    except ValueError:
+        pass
+
+    logger.warning("Local JSON repair failed, falling back to LLM repair_json")
+    metrics.inc("llm_json_repair_calls_total")
+    fixed = repair_json(text)
+    try:
         return json.loads(fixed)
+    except Exception:
+        return extract_json(fixed)
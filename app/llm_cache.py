@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Protocol
+
+from app import metrics
+from app.config import DATA_DIR, get_settings
+
+logger = logging.getLogger(__name__)
+
+class LLMCache(Protocol):
+    def get(self, key: str) -> str | None: ...
+    def set(self, key: str, value: str) -> None: ...
+    def clear(self) -> None: ...
+
+def make_key(system: str, user: str, model: str, temperature: float, json_mode: bool = False) -> str:
+    payload = json.dumps(
+        {"system": system, "user": user, "model": model, "temperature": temperature, "json_mode": json_mode},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SQLiteLLMCache:
+    """
+    Кэш ответов LLM в SQLite-файле под DATA_DIR.
+    TTL проверяется при чтении, вытеснение (просроченные + самые старые сверх max_entries)
+    выполняется периодически при записи.
+    """
+
+    _EVICT_EVERY = 100
+
+    def __init__(self, path: Path, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created ON llm_cache(created_at)")
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds:
+            return None
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def _evict(self) -> None:
+        if self.ttl_seconds > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+@lru_cache(maxsize=1)
+def get_cache() -> LLMCache | None:
+    s = get_settings()
+    if not s.llm.cache_enabled:
+        return None
+    path = DATA_DIR / "llm_cache.sqlite3"
+    logger.info("LLM response cache: %s (ttl=%ds, max_entries=%d)", path, s.llm.cache_ttl_seconds, s.llm.cache_max_entries)
+    return SQLiteLLMCache(path, s.llm.cache_ttl_seconds, s.llm.cache_max_entries)
+
+def cache_stats() -> dict[str, float]:
+    hits = metrics.get("llm_cache_hits_total")
+    misses = metrics.get("llm_cache_misses_total")
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": (hits / total) if total else 0.0}
@@ -1,25 +1,107 @@
 from __future__ import annotations
 
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
-from app.config import LOG_DIR
+from app.config import LOG_DIR, get_settings
+from app.tracing import current_trace_id
+
+# Идентификаторы текущей задачи/запроса: попадают в каждую запись лога (в JSON — отдельными полями)
+_job_id: ContextVar[int | None] = ContextVar("log_job_id", default=None)
+_request_id: ContextVar[str | None] = ContextVar("log_request_id", default=None)
+
+_listener: QueueListener | None = None
+
+@contextmanager
+def log_context(job_id: int | None = None, request_id: str | None = None) -> Iterator[str]:
+    """Помечает записи лога внутри блока job_id/request_id (request_id по умолчанию генерируется). Отдаёт request_id."""
+    request_id = request_id or uuid.uuid4().hex[:12]
+    tokens = [_request_id.set(request_id)]
+    if job_id is not None:
+        tokens.append(_job_id.set(job_id))
+    try:
+        yield request_id
+    finally:
+        for t in reversed(tokens):
+            t.var.reset(t)
+
+class _ContextFilter(logging.Filter):
+    # выполняется в потоке, который пишет лог (до очереди), поэтому видит его contextvars
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job_id = _job_id.get()
+        record.request_id = _request_id.get()
+        record.trace_id = current_trace_id()
+        return True
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В вызывающем потоке только подставляем аргументы и сериализуем исключение (его нельзя передать дальше
+        # по ссылке); само форматирование и запись в файл/консоль делает поток QueueListener.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, job_id/request_id/trace_id, исключение."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key in ("job_id", "request_id", "trace_id"):
+            val = getattr(record, key, None)
+            if val is not None:
+                out[key] = val
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ids = " ".join(
+            f"{k}={v}" for k in ("job_id", "request_id") if (v := getattr(record, k, None)) is not None
+        )
+        record.ids = f" [{ids}]" if ids else ""
+        return super().format(record)
 
 def setup_logging() -> None:
+    """
+    Корневой логгер пишет только в очередь (QueueHandler); файл и консоль обслуживает отдельный поток QueueListener,
+    так что логирование не добавляет дискового I/O потокам, которые делают работу. LOG_FORMAT=json — JSON-строки.
+    """
+    global _listener
     Path(LOG_DIR).mkdir(parents=True, exist_ok=True)
     log_file = Path(LOG_DIR) / "app.log"
+    s = get_settings()
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-
-    for h in list(logger.handlers):
-        logger.removeHandler(h)
-
-    fmt = logging.Formatter(
-        fmt="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    if s.observability.log_format == "json":
+        fmt: logging.Formatter = JsonFormatter()
+    else:
+        fmt = _TextFormatter(
+            fmt="%(asctime)s | %(levelname)s | %(name)s |%(ids)s %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
 
     file_handler = RotatingFileHandler(
         log_file, maxBytes=5_000_000, backupCount=5, encoding="utf-8"
@@ -31,5 +113,46 @@ def setup_logging() -> None:
     console_handler.setFormatter(fmt)
     console_handler.setLevel(logging.INFO)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    _stop_listener()
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+
+    # неограниченная очередь: put никогда не блокирует пишущий поток
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(q)
+    queue_handler.addFilter(_ContextFilter())
+    logger.addHandler(queue_handler)
+
+    _listener = QueueListener(q, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener() -> None:
+    # дописывает оставшиеся в очереди записи (при повторной настройке и при завершении процесса)
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(_stop_listener)
+
+class ProgressLog:
+    """
+    Прогресс длинного цикла (батчи эмбеддингов, map-чанки) не чаще раза в interval секунд;
+    первый и последний шаг (done >= total) пишутся всегда.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float | None = None):
+        self.logger = logger
+        self.interval = get_settings().observability.log_progress_interval_seconds if interval is None else interval
+        self._last = 0.0
+
+    def __call__(self, msg: str, done: int, total: int, *args) -> None:
+        now = time.monotonic()
+        if self._last and done < total and now - self._last < self.interval:
+            return
+        self._last = now
+        self.logger.info(msg, done, total, *args)
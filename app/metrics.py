@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм длительностей, секунды (от запроса к БД до долгого LLM-вызова)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_Labels = tuple[tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, _Labels], float] = defaultdict(float)
+_histograms: dict[tuple[str, _Labels], _Histogram] = {}
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+def _key(name: str, labels: dict[str, object]) -> tuple[str, _Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1.0, **labels: object) -> None:
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+def get(name: str, **labels: object) -> float:
+    """Значение счётчика; без labels — сумма по всем наборам меток."""
+    with _lock:
+        if labels:
+            return _counters.get(_key(name, labels), 0.0)
+        return sum(v for (n, _), v in _counters.items() if n == name)
+
+def observe(name: str, value: float, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels: object) -> None:
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = _Histogram(buckets)
+        h.observe(value)
+
+@contextmanager
+def timer(name: str, **labels: object) -> Iterator[None]:
+    """Записывает длительность блока в гистограмму name (секунды), в том числе при исключении."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        out: dict[str, float] = defaultdict(float)
+        for (name, _), v in _counters.items():
+            out[name] += v
+        for (name, _), h in _histograms.items():
+            out[f"{name}_count"] += h.count
+            out[f"{name}_sum"] += h.sum
+        return dict(out)
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(labels: _Labels, extra: _Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def render_prometheus() -> str:
+    """Все метрики процесса в текстовом формате Prometheus (exposition format 0.0.4)."""
+    lines: list[str] = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(
+            ((k, (h.buckets, list(h.counts), h.sum, h.count)) for k, h in _histograms.items()),
+            key=lambda it: it[0],
+        )
+
+    typed: set[str] = set()
+    for (name, labels), v in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_fmt_labels(labels)} {v}")
+
+    for (name, labels), (buckets, counts, total, count) in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for le, c in zip(buckets, counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', repr(le)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Отдаёт /metrics для Prometheus из фонового потока."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics endpoint: http://%s:%d/metrics", host, port)
+    return server
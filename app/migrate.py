@@ -1,16 +1,182 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from sqlalchemy import text
-from app.db import engine
+from sqlalchemy.engine import Connection
+from app.config import get_settings
+from app.db import get_engine
 from app.models import Base
+from app.partitions import (
+    add_months, copy_legacy_data, ensure_partitions, is_partitioned, list_partitions, month_start, months_between,
+    move_legacy_tables,
+)
+from app.stats import rebuild_table
 
 logger = logging.getLogger(__name__)
 
-def init_db() -> None:
-    with engine.connect() as conn:
+# Ключ pg_advisory_lock: UI, воркер и демон синхронизации не должны мигрировать одновременно
+_MIGRATION_LOCK_KEY = 7_310_034
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+    # True — миграция сама управляет транзакциями (CREATE INDEX CONCURRENTLY), выполняется в AUTOCOMMIT
+    concurrent: bool = False
+
+def _index_valid(conn: Connection, name: str) -> bool | None:
+    """True/False — индекс есть и валиден/невалиден, None — индекса нет."""
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relname = :name"
+    ), {"name": name}).scalar_one_or_none()
+
+def create_index_concurrently(conn: Connection, name: str, table: str, definition: str, where: str | None = None) -> None:
+    """
+    CREATE INDEX CONCURRENTLY без блокировки записи. Для секционированной таблицы Postgres этого не умеет,
+    поэтому: пустой индекс ON ONLY на родителе, CONCURRENTLY на каждой секции, затем ATTACH PARTITION —
+    после подключения всех секций родительский индекс становится валидным, а новые секции получают его автоматически.
+    Недостроенный (INVALID) индекс от прерванной попытки пересоздаётся.
+    """
+    suffix = f" WHERE {where}" if where else ""
+
+    def build(index: str, on: str) -> None:
+        if _index_valid(conn, index) is False:
+            logger.warning("Dropping invalid index %s left by an interrupted build", index)
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {on} {definition}{suffix}"))
+
+    if not is_partitioned(conn, table):
+        build(name, table)
+        return
+
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}{suffix}"))
+    for part in list_partitions(conn, table):
+        child = f"{part}_{name}"[:63]
+        build(child, part)
+        attached = conn.execute(text(
+            "SELECT 1 FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE p.relname = :parent AND c.relname = :child"
+        ), {"parent": name, "child": child}).scalar_one_or_none()
+        if attached is None:
+            conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+
+def _m0001_vector_hnsw(conn: Connection) -> None:
+    # колонка объявлена как vector без размерности, поэтому индекс — по выражению с приведением к vector(dim);
+    # запрос в app/qa.py использует то же выражение
+    dim = get_settings().embeddings.dim
+    create_index_concurrently(
+        conn, "ix_embeddings_hnsw_cos", "embeddings",
+        f"USING hnsw ((embedding::vector({dim})) vector_cosine_ops)",
+    )
+
+def _m0002_messages_fts(conn: Connection) -> None:
+    create_index_concurrently(conn, "ix_messages_text_fts", "messages", "USING gin (to_tsvector('simple', text))")
+
+def _m0003_messages_nonempty(conn: Connection) -> None:
+    # эмбеддинги строятся только для непустых сообщений — частичный индекс для поиска ещё не обработанных
+    create_index_concurrently(conn, "ix_messages_chat_dt_nonempty", "messages", "(chat_id, dt)", where="text <> ''")
+
+def _m0004_embedding_pending(conn: Connection) -> None:
+    # ADD COLUMN с константным DEFAULT не переписывает таблицу; затем по секциям отмечаем непустые сообщения
+    # без эмбеддинга. Всё в одной транзакции: прерванный backfill откатывается вместе с колонкой
+    conn.execute(text(
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS embedding_pending boolean NOT NULL DEFAULT false"
+    ))
+    for part in list_partitions(conn, "messages") or ["messages"]:
+        res = conn.execute(text(
+            f"UPDATE {part} m SET embedding_pending = true "
+            "WHERE m.text <> '' AND NOT m.embedding_pending "
+            "AND NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.message_id = m.id AND e.dt = m.dt)"
+        ))
+        logger.info("Backfilled embedding_pending in %s: %d rows", part, res.rowcount)
+
+def _m0005_messages_pending(conn: Connection) -> None:
+    # индекс содержит только ещё не заэмбедженные сообщения и остаётся маленьким при любом объёме архива
+    create_index_concurrently(
+        conn, "ix_messages_embedding_pending", "messages", "(chat_id, dt, id)", where="embedding_pending",
+    )
+
+def _m0006_daily_stats(conn: Connection) -> None:
+    # таблицу создаёт create_all; здесь заполняем агрегаты по уже собранным сообщениям (одной транзакцией)
+    for part in list_partitions(conn, "messages") or ["messages"]:
+        logger.info("Backfilled chat_daily_stats from %s: %d days", part, rebuild_table(conn, part))
+
+def _m0007_messages_reply(conn: Connection) -> None:
+    # поиск ответов на сообщение при расширении контекста QA (app/qa.py: expand_context)
+    create_index_concurrently(
+        conn, "ix_messages_chat_reply", "messages", "(chat_id, reply_to_tg_msg_id)",
+        where="reply_to_tg_msg_id IS NOT NULL",
+    )
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "embeddings HNSW cosine index", _m0001_vector_hnsw, concurrent=True),
+    Migration(2, "messages full-text GIN index", _m0002_messages_fts, concurrent=True),
+    Migration(3, "messages partial index on non-empty text", _m0003_messages_nonempty, concurrent=True),
+    Migration(4, "messages.embedding_pending flag with backfill", _m0004_embedding_pending),
+    Migration(5, "messages partial index on pending embeddings", _m0005_messages_pending, concurrent=True),
+    Migration(6, "chat_daily_stats backfill", _m0006_daily_stats),
+    Migration(7, "messages partial index on replies", _m0007_messages_reply, concurrent=True),
+]
+
+def _ensure_versions_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version integer PRIMARY KEY,"
+        " name text NOT NULL,"
+        " applied_at timestamptz NOT NULL DEFAULT now())"
+    ))
+
+def applied_versions(conn: Connection) -> set[int]:
+    _ensure_versions_table(conn)
+    return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+def run_migrations(target: int | None = None) -> list[int]:
+    """Применяет ещё не применённые миграции по порядку (до target включительно). Возвращает применённые версии."""
+    done: list[int] = []
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _MIGRATION_LOCK_KEY})
+        try:
+            applied = applied_versions(conn)
+            for m in sorted(MIGRATIONS, key=lambda m: m.version):
+                if m.version in applied or (target is not None and m.version > target):
+                    continue
+                logger.info("Applying migration %04d: %s", m.version, m.name)
+                if m.concurrent:
+                    m.apply(conn)
+                    conn.execute(text("INSERT INTO schema_migrations(version, name) VALUES (:v, :n)"), {"v": m.version, "n": m.name})
+                else:
+                    with get_engine().begin() as tx:
+                        m.apply(tx)
+                        tx.execute(text("INSERT INTO schema_migrations(version, name) VALUES (:v, :n)"), {"v": m.version, "n": m.name})
+                done.append(m.version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _MIGRATION_LOCK_KEY})
+    if done:
+        logger.info("Applied migrations: %s", done)
+    return done
+
+def init_db(migrate: bool | None = None) -> None:
+    s = get_settings()
+    with get_engine().begin() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-        conn.commit()
 
-    Base.metadata.create_all(bind=engine)
-    logger.info("DB schema ensured (tables + vector extension).")
+        # БД со схемой до секционирования: переносим старые таблицы, создаём новые и копируем данные
+        converted = move_legacy_tables(conn)
+        Base.metadata.create_all(bind=conn)
+        if converted:
+            copy_legacy_data(conn)
+
+        # текущий месяц + запас вперёд; прошлые месяцы создаются по мере сбора (insert_messages)
+        this_month = month_start(datetime.now(timezone.utc))
+        ensure_partitions(conn, months_between(this_month, add_months(this_month, s.db.partition_months_ahead)))
+
+    logger.info("DB schema ensured (tables + vector extension + partitions).")
+
+    if s.db.migrate_on_startup if migrate is None else migrate:
+        run_migrations()
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from typing import Any
 
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, JSON
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, ForeignKeyConstraint, Index, Integer, String, Text, UniqueConstraint, JSON
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 class Base(DeclarativeBase):
@@ -22,37 +22,53 @@ class Chat(Base):
 
     messages: Mapped[list["Message"]] = relationship(back_populates="chat")
 
+# messages и embeddings секционированы по месяцам (RANGE по dt, см. app/partitions.py),
+# поэтому dt входит в первичный ключ и во все уникальные ограничения.
 class Message(Base):
     __tablename__ = "messages"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     tg_msg_id: Mapped[int] = mapped_column(Integer, nullable=False)
-    dt: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    dt: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
     sender_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     sender_name: Mapped[str | None] = mapped_column(String(512), nullable=True)
     text: Mapped[str] = mapped_column(Text, nullable=False, default="")
     reply_to_tg_msg_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
     raw: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+    # True — непустое сообщение ещё без эмбеддинга; по нему частичный индекс (миграция 0005)
+    embedding_pending: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default="false")
 
     chat: Mapped["Chat"] = relationship(back_populates="messages")
     embedding: Mapped["Embedding | None"] = relationship(back_populates="message", uselist=False)
 
     __table_args__ = (
-        UniqueConstraint("chat_id", "tg_msg_id", name="uq_message_chat_msg"),
+        UniqueConstraint("chat_id", "tg_msg_id", "dt", name="uq_message_chat_msg"),
         Index("ix_messages_chat_dt", "chat_id", "dt"),
+        {"postgresql_partition_by": "RANGE (dt)"},
     )
 
 class Embedding(Base):
     __tablename__ = "embeddings"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    message_id: Mapped[int] = mapped_column(ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, unique=True)
+    message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # копия messages.dt: ключ секционирования, общий с messages
+    dt: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
     embedding: Mapped[list[float]] = mapped_column(Vector(), nullable=False)
     model_name: Mapped[str] = mapped_column(String(256), nullable=False)
 
     message: Mapped["Message"] = relationship(back_populates="embedding")
 
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["message_id", "dt"], ["messages.id", "messages.dt"],
+            ondelete="CASCADE", name="fk_embeddings_message",
+        ),
+        UniqueConstraint("message_id", "dt", name="uq_embeddings_message"),
+        {"postgresql_partition_by": "RANGE (dt)"},
+    )
+
 class Summary(Base):
     __tablename__ = "summaries"
 
@@ -70,3 +86,54 @@ class Summary(Base):
     __table_args__ = (
         Index("ix_summaries_key_period", "chat_ids_key", "date_from", "date_to"),
     )
+
+# Дневные агрегаты по чату (UTC-сутки), поддерживаются инкрементально в app/stats.py
+class ChatDailyStats(Base):
+    __tablename__ = "chat_daily_stats"
+
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    sender_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_chars: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    embedded_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # время последнего пересчёта по сообщениям (refresh_days); построение эмбеддингов его не меняет
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+# Сводка одного чата за UTC-сутки (app/daily_summaries.py); сводки за любые периоды собираются из них reduce'ом.
+# message_count/total_chars — состояние суток на момент построения: расхождение с chat_daily_stats значит, что сводка устарела.
+class ChatDailySummary(Base):
+    __tablename__ = "chat_daily_summaries"
+
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    model: Mapped[str] = mapped_column(String(128), nullable=False)
+    prompt_version: Mapped[str] = mapped_column(String(64), nullable=False)
+    summary_json: Mapped[dict] = mapped_column(JSON, nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    total_chars: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(64), nullable=False)  # ingest/embed/summary
+    params: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+    status: Mapped[str] = mapped_column(String(32), nullable=False, default="queued")  # queued/running/done/failed/cancelled
+    progress: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    message: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    checkpoint: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False, default=dict)
+    result: Mapped[dict[str, Any] | None] = mapped_column(JSON, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    worker_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_created", "status", "created_at"),
+    )
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+
+# Тексты для сверки с torch-моделью по умолчанию (scripts.export_onnx --texts — свои)
+PARITY_TEXTS = [
+    "Релиз переносим на следующую неделю, нужно проверить миграцию базы.",
+    "Кто дежурит в выходные?",
+    "Подготовьте, пожалуйста, смету до пятницы",
+    "ок",
+    "The index migration may block writes on the messages table.",
+    "Созвон в 15:00, ссылка в календаре. Повестка: бюджет, найм, сроки по второму этапу проекта.",
+    "https://example.com/docs/runbook#rollback",
+    "😂😂😂",
+]
+
+def model_dir(model_name: str | None = None) -> Path:
+    s = get_settings()
+    return Path(s.embeddings.onnx_dir) / (model_name or s.embeddings.model_name).replace("/", "__")
+
+class OnnxEncoder:
+    """
+    Замена SentenceTransformer.encode на ONNX Runtime без torch: токенизатор из tokenizer.json,
+    pooling по meta.json, который пишет export_model.
+    """
+
+    def __init__(self, path: Path, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.meta = json.loads((path.parent / META_FILE).read_text(encoding="utf-8"))
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = intra_op_threads
+        opts.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+
+        self.tokenizer = Tokenizer.from_file(str(path.parent / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.meta["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.meta["pad_token_id"], pad_token=self.meta["pad_token"])
+
+    def _pool(self, hidden, mask):
+        import numpy as np
+
+        if self.meta["pooling"] == "cls":
+            return hidden[:, 0]
+        m = mask[:, :, None].astype(np.float32)
+        return (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: list[str], batch_size: int = 32, normalize_embeddings: bool = True, show_progress_bar: bool = False):
+        import numpy as np
+
+        # как SentenceTransformer: батчи из текстов близкой длины — меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        out = np.zeros((len(texts), self.meta["dim"]), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer.encode_batch([texts[i] for i in idx])
+            mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in enc], dtype=np.int64),
+            }
+            hidden = self.session.run(["last_hidden_state"], {k: feeds[k] for k in self.meta["inputs"]})[0]
+            out[idx] = self._pool(hidden, mask)
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+def load_encoder() -> OnnxEncoder:
+    s = get_settings()
+    path = model_dir() / (INT8_FILE if s.embeddings.onnx_int8 else FP32_FILE)
+    if not path.exists():
+        raise RuntimeError(f"Нет ONNX-модели {path}: выполните python3 -m scripts.export_onnx")
+    logger.info("Loading ONNX embedding model: %s", path)
+    return OnnxEncoder(path, s.embeddings.onnx_intra_op_threads, s.embeddings.onnx_inter_op_threads)
+
+def export_model(model_name: str, out: Path, int8: bool = True) -> list[Path]:
+    """
+    Экспортирует трансформер SentenceTransformer-модели в ONNX (динамические batch/seq) и, если int8,
+    дополнительно квантует веса динамически в int8. Рядом кладёт tokenizer.json и meta.json (pooling, входы, размерность).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling = st[1].get_pooling_mode_str()
+    if pooling not in ("mean", "cls"):
+        raise RuntimeError(f"pooling {pooling} модели {model_name} не поддерживается ONNX-экспортом")
+    tok = st.tokenizer
+    inputs = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in tok.model_input_names]
+
+    class _LastHidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(inputs, args))).last_hidden_state
+
+    out.mkdir(parents=True, exist_ok=True)
+    sample = tok(["warm-up export"], return_tensors="pt")
+    fp32 = out / FP32_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHidden(st[0].auto_model.eval()),
+            tuple(sample[n] for n in inputs),
+            str(fp32),
+            input_names=inputs,
+            output_names=["last_hidden_state"],
+            dynamic_axes={n: {0: "batch", 1: "seq"} for n in [*inputs, "last_hidden_state"]},
+            opset_version=14,
+        )
+    tok.save_pretrained(str(out))
+    meta = {
+        "model_name": model_name,
+        "pooling": pooling,
+        "inputs": inputs,
+        "dim": st.get_sentence_embedding_dimension(),
+        "max_seq_length": st.max_seq_length,
+        "pad_token": tok.pad_token,
+        "pad_token_id": tok.pad_token_id,
+    }
+    (out / META_FILE).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    written = [fp32]
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(fp32), str(out / INT8_FILE), weight_type=QuantType.QInt8)
+        written.append(out / INT8_FILE)
+    return written
+
+def parity_check(model_name: str, path: Path, texts: list[str]) -> tuple[float, float]:
+    """Косинусная близость векторов ONNX-модели к векторам torch-модели на тех же текстах: (минимум, среднее)."""
+    from sentence_transformers import SentenceTransformer
+
+    ref = SentenceTransformer(model_name, device="cpu").encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    got = OnnxEncoder(path).encode(texts, normalize_embeddings=True)
+    cos = (ref * got).sum(axis=1)
+    return float(cos.min()), float(cos.mean())
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from collections.abc import Iterable
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, секционированные по месяцам по dt. Порядок важен: embeddings ссылается на messages.
+PARTITIONED_TABLES = ("messages", "embeddings")
+
+_known_months: set[date] = set()
+_known_lock = threading.Lock()
+
+# CREATE TABLE ... PARTITION OF берёт ACCESS EXCLUSIVE на родительскую таблицу: не ждём бесконечно чужие транзакции
+_DDL_LOCK_TIMEOUT = "10s"
+
+def month_start(dt: datetime | date) -> date:
+    return date(dt.year, dt.month, 1)
+
+def next_month(m: date) -> date:
+    return date(m.year + (m.month == 12), m.month % 12 + 1, 1)
+
+def add_months(m: date, n: int) -> date:
+    for _ in range(n):
+        m = next_month(m)
+    return m
+
+def months_between(start: datetime | date, end: datetime | date) -> list[date]:
+    m, last = month_start(start), month_start(end)
+    out = []
+    while m <= last:
+        out.append(m)
+        m = next_month(m)
+    return out
+
+def partition_name(table: str, m: date) -> str:
+    return f"{table}_y{m.year}m{m.month:02d}"
+
+def _bound(m: date) -> str:
+    return datetime(m.year, m.month, 1, tzinfo=timezone.utc).isoformat()
+
+def _create_partitions(conn: Connection, months: list[date]) -> None:
+    for m in months:
+        for table in PARTITIONED_TABLES:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(table, m)} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{_bound(m)}') TO ('{_bound(next_month(m))}')"
+            ))
+
+def ensure_partitions(conn: Connection | Session, months: Iterable[date]) -> int:
+    """
+    Создаёт недостающие месячные секции messages/embeddings. Уже созданные в этом процессе
+    месяцы пропускаются без обращения к БД. Возвращает число новых месяцев.
+    Для Session перед созданием секций фиксирует её текущую транзакцию.
+    """
+    with _known_lock:
+        todo = sorted(set(months) - _known_months)
+    if not todo:
+        return 0
+
+    if isinstance(conn, Session):
+        # DDL в отдельной короткой транзакции: секции не должны откатиться вместе с вызывающей транзакцией.
+        # Транзакцию сессии сначала фиксируем: прочитанные в ней messages/embeddings держат ACCESS SHARE,
+        # и DDL на другом соединении ждал бы сам себя.
+        conn.commit()
+        with conn.get_bind().begin() as c:
+            c.execute(text(f"SET LOCAL lock_timeout = '{_DDL_LOCK_TIMEOUT}'"))
+            _create_partitions(c, todo)
+    else:
+        _create_partitions(conn, todo)
+    with _known_lock:
+        _known_months.update(todo)
+    logger.info("Ensured partitions for months: %s", ", ".join(m.strftime("%Y-%m") for m in todo))
+    return len(todo)
+
+def ensure_partitions_for(conn: Connection | Session, dts: Iterable[datetime]) -> int:
+    return ensure_partitions(conn, {month_start(dt) for dt in dts})
+
+def list_partitions(conn: Connection | Session, table: str) -> list[str]:
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table ORDER BY c.relname"
+    ), {"table": table}).scalars().all()
+    return list(rows)
+
+def detach_month(conn: Connection | Session, m: date) -> None:
+    """
+    Отсоединяет месяц от messages/embeddings (данные остаются в отдельных таблицах, их можно
+    заархивировать или удалить DROP TABLE). Сначала embeddings: у отсоединённой секции снимаем FK,
+    иначе messages-секцию не отсоединить.
+    """
+    emb = partition_name("embeddings", m)
+    msg = partition_name("messages", m)
+    conn.execute(text(f"ALTER TABLE embeddings DETACH PARTITION {emb}"))
+    conn.execute(text(f"ALTER TABLE {emb} DROP CONSTRAINT IF EXISTS fk_embeddings_message"))
+    conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {msg}"))
+    # дневные агрегаты этого месяца больше не соответствуют данным в messages
+    conn.execute(
+        text("DELETE FROM chat_daily_stats WHERE day >= :lo AND day < :hi"),
+        {"lo": m, "hi": next_month(m)},
+    )
+    with _known_lock:
+        _known_months.discard(m)
+    logger.info("Detached partitions %s, %s", msg, emb)
+
+def is_partitioned(conn: Connection, table: str) -> bool | None:
+    """True — секционированная, False — обычная таблица, None — таблицы нет."""
+    kind = conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relname = :table"
+    ), {"table": table}).scalar_one_or_none()
+    if kind is None:
+        return None
+    return kind == "p"
+
+def move_legacy_tables(conn: Connection) -> bool:
+    """
+    Переносит несекционированные messages/embeddings (схема до секционирования) в схему legacy,
+    чтобы create_all создал на их месте секционированные таблицы. Данные затем копирует copy_legacy_data.
+    """
+    if is_partitioned(conn, "messages") is not False:
+        return False
+    logger.warning("Converting messages/embeddings to partitioned tables")
+    conn.execute(text("CREATE SCHEMA IF NOT EXISTS legacy"))
+    conn.execute(text("ALTER TABLE embeddings SET SCHEMA legacy"))
+    conn.execute(text("ALTER TABLE messages SET SCHEMA legacy"))
+    return True
+
+def copy_legacy_data(conn: Connection) -> None:
+    bounds = conn.execute(text("SELECT min(dt), max(dt) FROM legacy.messages")).one()
+    if bounds[0] is not None:
+        ensure_partitions(conn, months_between(bounds[0], bounds[1]))
+
+    conn.execute(text(
+        "INSERT INTO messages (id, chat_id, tg_msg_id, dt, sender_id, sender_name, text, reply_to_tg_msg_id, raw) "
+        "SELECT id, chat_id, tg_msg_id, dt, sender_id, sender_name, text, reply_to_tg_msg_id, raw FROM legacy.messages"
+    ))
+    conn.execute(text(
+        "INSERT INTO embeddings (id, message_id, dt, embedding, model_name) "
+        "SELECT e.id, e.message_id, m.dt, e.embedding, e.model_name "
+        "FROM legacy.embeddings e JOIN legacy.messages m ON m.id = e.message_id"
+    ))
+    for table in PARTITIONED_TABLES:
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"
+        ))
+    conn.execute(text("DROP SCHEMA legacy CASCADE"))
+    logger.warning("Legacy messages/embeddings copied into partitioned tables")
+
+class _Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, stmt):
+        self.statement = stmt
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+def scanned_partitions(db: Session, stmt) -> list[str]:
+    """
+    Имена таблиц/секций, которые планировщик реально будет читать для запроса (EXPLAIN).
+    Используется для проверки partition pruning.
+    """
+    plan = db.connection().execute(_Explain(stmt)).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    found: set[str] = set()
+
+    def walk(node: dict) -> None:
+        if "Relation Name" in node:
+            found.add(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return sorted(found)
+
+def pruning_report(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, dim: int) -> dict[str, list[str]]:
+    """Для каждого «горячего» запроса репозитория — список секций, которые он затронет за период."""
+    from app.qa import _retrieve_stmt
+    from app.repo import _count_stmt, _load_stmt, _missing_embeddings_stmt
+
+    stmts = {
+        "count_messages": _count_stmt(chat_ids, date_from, date_to),
+        "load_messages": _load_stmt(chat_ids, date_from, date_to),
+        "messages_missing_embeddings": _missing_embeddings_stmt(chat_ids, date_from, date_to, 1000),
+        "retrieve_top_messages": _retrieve_stmt(chat_ids, date_from, date_to, [0.0] * dim, dim, 10),
+    }
+    return {name: scanned_partitions(db, stmt) for name, stmt in stmts.items()}
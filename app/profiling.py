@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from app.config import LOG_DIR, get_settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = LOG_DIR / "profiles"
+PROFILE_KINDS = ("ingest", "embed", "summary", "qa")
+
+# Потоки, стоящие в этих функциях, простаивают (пул потоков ждёт задачу, сервер ждёт соединение) — в профиль не попадают.
+# Ожидание ответа БД/LLM простоем не считается: профиль по wall-clock, как у py-spy без --idle.
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever"),
+    ("base_events.py", "_run_once"),
+}
+
+@dataclass
+class _SqlStat:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+@dataclass
+class ProfileSession:
+    kind: str
+    label: str
+    interval: float
+    started: float = field(default_factory=time.perf_counter)
+    duration: float = 0.0
+    samples: int = 0
+    stacks: Counter = field(default_factory=Counter)
+    sql: dict[str, _SqlStat] = field(default_factory=dict)
+    path: Path | None = None
+
+    def add_sql(self, statement: str, seconds: float) -> None:
+        st = self.sql.get(statement)
+        if st is None:
+            st = self.sql[statement] = _SqlStat()
+        st.count += 1
+        st.seconds += seconds
+        st.max_seconds = max(st.max_seconds, seconds)
+
+    def summary(self) -> str:
+        queries = sum(s.count for s in self.sql.values())
+        sql_seconds = sum(s.seconds for s in self.sql.values())
+        return f"{self.duration:.2f}s, сэмплов: {self.samples}, SQL: {queries} запросов / {sql_seconds:.2f}s"
+
+_lock = threading.Lock()
+_sessions: list[ProfileSession] = []
+_sampler_threads: set[int] = set()
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+def _short_path(path: str) -> str:
+    # путь относительно проекта / site-packages, как у py-spy
+    for marker in ("site-packages" + os.sep, str(LOG_DIR.parent) + os.sep):
+        i = path.find(marker)
+        if i >= 0:
+            return path[i + len(marker):]
+    return os.path.basename(path)
+
+def _stack(frame) -> str | None:
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+        return None
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _sample_loop(session: ProfileSession, stop: threading.Event) -> None:
+    own = threading.get_ident()
+    with _lock:
+        _sampler_threads.add(own)
+    try:
+        while not stop.wait(session.interval):
+            with _lock:
+                skip = set(_sampler_threads)
+            for tid, frame in sys._current_frames().items():
+                if tid in skip:
+                    continue
+                stack = _stack(frame)
+                if stack is not None:
+                    session.stacks[stack] += 1
+            session.samples += 1
+    finally:
+        with _lock:
+            _sampler_threads.discard(own)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._profile_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    start = getattr(context, "_profile_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    key = " ".join(statement.split())[:500]
+    with _lock:
+        for s in _sessions:
+            s.add_sql(key, elapsed)
+
+def _set_sql_hooks(enabled: bool) -> None:
+    # слушатели висят на Engine только пока идёт профилирование — в обычном режиме накладных расходов нет
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    for name, fn in (("before_cursor_execute", _before_cursor_execute), ("after_cursor_execute", _after_cursor_execute)):
+        if enabled and not event.contains(Engine, name, fn):
+            event.listen(Engine, name, fn)
+        elif not enabled and event.contains(Engine, name, fn):
+            event.remove(Engine, name, fn)
+
+def _write(session: ProfileSession) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    base = PROFILE_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{session.kind}{'-' + session.label if session.label else ''}"
+
+    # folded stacks (формат py-spy/flamegraph.pl/speedscope): "frame;frame;frame count"
+    with open(f"{base}.folded", "w", encoding="utf-8") as f:
+        for stack, n in session.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, n in session.stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += n
+        for fr in set(frames):
+            total[fr] += n
+    sql = sorted(session.sql.items(), key=lambda it: it[1].seconds, reverse=True)
+    report = {
+        "kind": session.kind,
+        "label": session.label,
+        "duration_seconds": round(session.duration, 3),
+        "interval_ms": session.interval * 1000,
+        "samples": session.samples,
+        "top_self": [{"frame": fr, "samples": n} for fr, n in own.most_common(30)],
+        "top_total": [{"frame": fr, "samples": n} for fr, n in total.most_common(30)],
+        "sql_queries": sum(s.count for _, s in sql),
+        "sql_seconds": round(sum(s.seconds for _, s in sql), 4),
+        "sql": [
+            {"statement": stmt, "count": s.count, "seconds": round(s.seconds, 4), "max_ms": round(s.max_seconds * 1000, 2)}
+            for stmt, s in sql
+        ],
+    }
+    Path(f"{base}.json").write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return Path(f"{base}.folded")
+
+def profiling_enabled(kind: str) -> bool:
+    jobs = get_settings().observability.profile_jobs
+    return "all" in jobs or kind in jobs
+
+@contextmanager
+def profile(kind: str, label: str = "", enabled: bool | None = None) -> Iterator[ProfileSession | None]:
+    """
+    Профилирует один запуск (сбор, эмбеддинги, summary, QA): сэмплирующий профайлер по всем потокам процесса
+    и SQL-запросы через события SQLAlchemy. Пишет в logs/profiles/ файл .folded (flamegraph) и .json (топ функций, SQL).
+    enabled=None — по PROFILE_JOBS; выключенный профиль ничего не делает и отдаёт None.
+    Параллельные запросы в том же процессе тоже попадут в профиль.
+    """
+    if enabled is None:
+        enabled = profiling_enabled(kind)
+    if not enabled:
+        yield None
+        return
+
+    session = ProfileSession(kind=kind, label=label, interval=get_settings().observability.profile_interval_ms / 1000)
+    with _lock:
+        _sessions.append(session)
+        _set_sql_hooks(True)
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_loop, args=(session, stop), name=f"profiler-{kind}", daemon=True)
+    sampler.start()
+    try:
+        yield session
+    finally:
+        stop.set()
+        sampler.join()
+        session.duration = time.perf_counter() - session.started
+        with _lock:
+            _sessions.remove(session)
+            if not _sessions:
+                _set_sql_hooks(False)
+        try:
+            session.path = _write(session)
+            logger.info("Profile %s written to %s: %s", kind, session.path, session.summary())
+        except OSError:
+            logger.warning("Failed to write profile for %s", kind, exc_info=True)
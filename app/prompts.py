@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-PROMPT_VERSION = "v1.0"
+PROMPT_VERSION = "v1.1"
 
 MAP_SYSTEM = """Ты — аналитик, который делает доказуемую сводку по сообщениям из Telegram.
 Правила:
@@ -30,7 +30,9 @@ JSON-схема:
   "topics":[{{"topic":str,"summary":str,"message_refs":[int]}}]
 }}
 
-Сообщения (внутри каждое содержит tg_msg_id, dt, sender_name, text):
+Сообщения (внутри каждое содержит tg_msg_id, dt, sender_name, text).
+Если tg_msg_id — список, это несколько подряд идущих сообщений одного автора, склеенных через " / ";
+в message_refs указывай все id из списка, к которым относится пункт:
 {messages_block}
 """
 
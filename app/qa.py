@@ -1,17 +1,29 @@
 from __future__ import annotations
 
+import math
+import threading
+from collections.abc import Iterator
 from dataclasses import dataclass
 from typing import Any
 
-from sqlalchemy import select, bindparam
+from sqlalchemy import and_, bindparam, cast, or_, select, text, tuple_
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
 
 from pgvector.sqlalchemy import Vector
 
+from app.budget import count_tokens, dedupe_near, take_within_budget, truncate_to_tokens
+from app import metrics
 from app.config import get_settings
+from app.db import READ_REPLICA
 from app.embeddings import embed_texts
 from app.models import Message, Embedding, Chat
-from app.llm import chat_completion
+from app.llm import chat_completion, chat_completion_stream
+from app.rerank import rerank
+from app.stats import embedded_counts
+from app.tracing import span
+
+NO_EMBEDDINGS_ANSWER = "Нет сообщений с эмбеддингами за выбранный период"
 
 
 @dataclass
@@ -24,16 +36,86 @@ class QASource:
     score: float
 
 
+def _retrieve_stmt(chat_ids: list[int], date_from, date_to, qvec: list[float], dim: int, top_k: int):
+    # биндим параметр как Vector(dim)
+    qvec_param = bindparam("qvec", qvec, type_=Vector(dim))
+
+    # cosine_distance: чем меньше, тем ближе; приведение к vector(dim) совпадает с выражением HNSW-индекса
+    distance = cast(Embedding.embedding, Vector(dim)).cosine_distance(qvec_param).label("distance")
+
+    return (
+        select(
+            Message.id.label("message_id"),
+            Message.chat_id.label("chat_id"),
+            Message.tg_msg_id.label("tg_msg_id"),
+            Message.dt.label("dt"),
+            Message.sender_name.label("sender_name"),
+            Message.text.label("text"),
+            Message.reply_to_tg_msg_id.label("reply_to_tg_msg_id"),
+            distance,
+        )
+        .join(Embedding, and_(Embedding.message_id == Message.id, Embedding.dt == Message.dt))
+        .where(Message.chat_id.in_(chat_ids))
+        .where(Message.dt >= date_from)
+        .where(Message.dt <= date_to)
+        # диапазон по embeddings.dt отдельно — чтобы отсечь лишние секции embeddings
+        .where(Embedding.dt >= date_from)
+        .where(Embedding.dt <= date_to)
+        .order_by(distance.asc())
+        .limit(top_k)
+    )
+
+
+# ef_search по умолчанию в pgvector
+_HNSW_DEFAULT_EF = 40
+
+_iterative_scan: dict[str, bool] = {}
+_iterative_lock = threading.Lock()
+
+def vector_scan_settings(
+    top_k: int, embedded: int, total: int, iterative: bool, exact_max_rows: int, ef_max: int,
+) -> dict[str, str]:
+    """
+    Параметры планировщика для ORDER BY distance LIMIT top_k с фильтрами по чатам и периоду.
+    HNSW отдаёт ef_search ближайших по всей таблице, а фильтры применяются уже после индекса: при узком фильтре
+    строк остаётся меньше top_k. Поэтому небольшое подмножество перебираем точно (без индексного сканирования),
+    а для большого поднимаем ef_search пропорционально 1/доля (с запасом x2); pgvector >= 0.8 сам продолжает
+    сканирование (iterative_scan), пока не наберёт top_k.
+    """
+    if embedded <= exact_max_rows:
+        return {"enable_indexscan": "off"}
+    share = embedded / max(total, embedded)
+    ef = max(_HNSW_DEFAULT_EF, top_k, math.ceil(2 * top_k / share))
+    if iterative:
+        return {"hnsw.ef_search": str(min(ef, ef_max)), "hnsw.iterative_scan": "relaxed_order"}
+    if ef > ef_max:
+        return {"enable_indexscan": "off"}
+    return {"hnsw.ef_search": str(ef)}
+
+def _supports_iterative_scan(conn: Connection) -> bool:
+    key = str(conn.engine.url)
+    with _iterative_lock:
+        if key in _iterative_scan:
+            return _iterative_scan[key]
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar_one_or_none()
+    major_minor = tuple(int(x) for x in (version or "0.0").split(".")[:2])
+    with _iterative_lock:
+        _iterative_scan[key] = major_minor >= (0, 8)
+    return _iterative_scan[key]
+
+@span("qa.retrieve")
 def retrieve_top_messages(
     db: Session,
     chat_ids: list[int],
     date_from,
     date_to,
     question: str,
-    top_k: int = 18,
+    top_k: int = 30,
+    fresh: bool = False,
 ) -> list[dict[str, Any]]:
     """
     Возвращает top_k сообщений, наиболее близких к вопросу по эмбеддингам.
+    Читает из реплики, если она настроена (fresh=True — из primary).
     """
     s = get_settings()
 
@@ -43,49 +125,137 @@ def retrieve_top_messages(
     # гарантируем python list[float]
     qvec = [float(x) for x in qvec]
 
-    # 2) биндим параметр как Vector(dim)
-    qvec_param = bindparam("qvec", qvec, type_=Vector(s.embedding_dim))
+    stmt = _retrieve_stmt(chat_ids, date_from, date_to, qvec, s.embeddings.dim, top_k)
+    bind = {} if fresh else READ_REPLICA
+    embedded, total = embedded_counts(db, chat_ids, date_from, date_to, fresh=fresh)
+    conn = db.connection(bind_arguments=bind)
+    params = vector_scan_settings(
+        top_k, embedded, total, _supports_iterative_scan(conn),
+        s.embeddings.exact_search_max_rows, s.embeddings.hnsw_ef_search_max,
+    )
+    with span("repo.vector_query", top_k=top_k, embedded=embedded, **params), metrics.timer("vector_query_seconds"):
+        # параметры действуют только внутри savepoint: запрос read-only, откат не теряет данных
+        # и не оставляет enable_indexscan=off остальным запросам транзакции
+        savepoint = conn.begin_nested()
+        try:
+            for name, value in params.items():
+                conn.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+            rows = conn.execute(stmt).mappings().all()
+        finally:
+            savepoint.rollback()
+    # relaxed_order может слегка нарушить порядок
+    return sorted((dict(r) for r in rows), key=lambda r: r["distance"])
 
-    # 3) cosine_distance: чем меньше, тем ближе
-    distance = Embedding.embedding.cosine_distance(qvec_param).label("distance")
 
-    stmt = (
+def _expand_stmt(hits: list[dict[str, Any]], date_from, date_to, neighbours: int):
+    # одним запросом: родители найденных сообщений, ответы на них и соседние по tg_msg_id сообщения того же чата
+    keys = [(int(h["chat_id"]), int(h["tg_msg_id"])) for h in hits]
+    parents = [(int(h["chat_id"]), int(h["reply_to_tg_msg_id"])) for h in hits if h.get("reply_to_tg_msg_id")]
+    conds = [tuple_(Message.chat_id, Message.reply_to_tg_msg_id).in_(keys)]
+    if parents:
+        conds.append(tuple_(Message.chat_id, Message.tg_msg_id).in_(parents))
+    if neighbours:
+        conds += [
+            and_(Message.chat_id == cid, Message.tg_msg_id.between(mid - neighbours, mid + neighbours))
+            for cid, mid in keys
+        ]
+    return (
         select(
-            Message.id.label("message_id"),
-            Message.chat_id.label("chat_id"),
-            Message.tg_msg_id.label("tg_msg_id"),
-            Message.dt.label("dt"),
-            Message.sender_name.label("sender_name"),
-            Message.text.label("text"),
-            distance,
+            Message.chat_id, Message.tg_msg_id, Message.dt, Message.sender_name, Message.text, Message.reply_to_tg_msg_id,
         )
-        .join(Embedding, Embedding.message_id == Message.id)
-        .where(Message.chat_id.in_(chat_ids))
+        .where(Message.chat_id.in_({cid for cid, _ in keys}))
         .where(Message.dt >= date_from)
         .where(Message.dt <= date_to)
-        .order_by(distance.asc())
-        .limit(top_k)
+        .where(or_(*conds))
+        .where(Message.text != "")
     )
 
-    rows = db.execute(stmt).mappings().all()
-    return [dict(r) for r in rows]
+@span("qa.expand_context")
+def expand_context(db: Session, hits: list[dict[str, Any]], date_from, date_to, fresh: bool = False) -> dict[tuple[int, int], list[dict[str, Any]]]:
+    """
+    Окружение найденных сообщений в пределах периода: сообщение, на которое ответили, ответы на него и
+    qa_context_neighbours соседей с каждой стороны. Ключ — (chat_id, tg_msg_id) найденного сообщения.
+    """
+    if not hits:
+        return {}
+    s = get_settings()
+    stmt = _expand_stmt(hits, date_from, date_to, s.budget.qa_context_neighbours)
+    rows = [dict(r) for r in db.execute(stmt, bind_arguments={} if fresh else READ_REPLICA).mappings().all()]
+
+    n = s.budget.qa_context_neighbours
+    out: dict[tuple[int, int], list[dict[str, Any]]] = {}
+    for h in hits:
+        cid, mid, parent = int(h["chat_id"]), int(h["tg_msg_id"]), h.get("reply_to_tg_msg_id")
+        out[(cid, mid)] = [
+            r for r in rows
+            if r["chat_id"] == cid and r["tg_msg_id"] != mid and (
+                r["tg_msg_id"] == parent or r["reply_to_tg_msg_id"] == mid or abs(r["tg_msg_id"] - mid) <= n
+            )
+        ]
+    return out
 
+def _context_line(r: dict[str, Any], max_tokens: int, hit: bool = False) -> str:
+    who = f"{r['sender_name']}: " if r.get("sender_name") else ""
+    reply = f" (ответ на {r['reply_to_tg_msg_id']})" if r.get("reply_to_tg_msg_id") else ""
+    text = truncate_to_tokens((r["text"] or "").strip().replace("\n", " "), max_tokens)
+    return f"{'>' if hit else ' '} tg_msg_id={r['tg_msg_id']}{reply} {who}{text}"
 
-def answer_question(db: Session, chat_ids: list[int], date_from, date_to, question: str, top_k: int = 18) -> str:
+def _thread_snippet(hit: dict[str, Any], header: str, context: list[dict[str, Any]], seen: set[tuple[int, int]]) -> str:
     """
-    RAG: находим топ сообщений, собираем контекст, спрашиваем LLM, возвращаем ответ + источники.
+    Найденное сообщение (строка с «>») в окружении по порядку времени. Окружение добавляется по важности —
+    родитель, ответы, ближайшие соседи — пока фрагмент укладывается в qa_snippet_max_tokens; уже показанные
+    в других фрагментах сообщения не повторяются.
     """
-    rows = retrieve_top_messages(db, chat_ids, date_from, date_to, question, top_k=top_k)
+    s = get_settings()
+    max_tokens = s.budget.message_max_tokens
+    mid, parent = int(hit["tg_msg_id"]), hit.get("reply_to_tg_msg_id")
+
+    def rank(r: dict[str, Any]) -> tuple[int, int]:
+        if r["tg_msg_id"] == parent:
+            return 0, 0
+        if r["reply_to_tg_msg_id"] == mid:
+            return 1, abs(r["tg_msg_id"] - mid)
+        return 2, abs(r["tg_msg_id"] - mid)
+
+    used = count_tokens(header) + count_tokens(_context_line(hit, max_tokens, hit=True)) + 2
+    chosen = [hit]
+    for r in sorted(context, key=rank):
+        key = (int(r["chat_id"]), int(r["tg_msg_id"]))
+        if key in seen:
+            continue
+        line = _context_line(r, max_tokens)
+        cost = count_tokens(line) + 1
+        if used + cost > s.budget.qa_snippet_max_tokens:
+            continue
+        chosen.append(r)
+        seen.add(key)
+        used += cost
+    chosen.sort(key=lambda r: (r["dt"], r["tg_msg_id"]))
+    return header + "\n" + "\n".join(_context_line(r, max_tokens, hit=r is hit) for r in chosen)
+
+@span("qa.build_prompt")
+def _build_prompt(db: Session, chat_ids: list[int], date_from, date_to, question: str, top_k: int) -> tuple[str, str, list[QASource]] | None:
+    s = get_settings()
+    # с переранжированием берём больше кандидатов по эмбеддингам, а в контекст идут только top_n лучших
+    candidates = max(top_k, s.rerank.candidates) if s.rerank.enabled else top_k
+    rows = retrieve_top_messages(db, chat_ids, date_from, date_to, question, top_k=candidates)
 
     if not rows:
-        return "Нет сообщений с эмбеддингами за выбранный период"
+        return None
 
     # Подтянем названия чатов для источников
     chats = db.execute(select(Chat.id, Chat.title).where(Chat.id.in_(chat_ids))).all()
     chat_title_by_id = {int(c[0]): str(c[1]) for c in chats}
 
-    sources: list[QASource] = []
-    context_lines: list[str] = []
+    # почти одинаковые сообщения (пересылки, повторы) только съедают бюджет контекста
+    rows = dedupe_near(rows, lambda r: r["text"] or "", s.budget.qa_dedupe_threshold)
+    if s.rerank.enabled:
+        rows = rerank(question, rows, min(s.rerank.top_n, top_k))
+    context = expand_context(db, rows, date_from, date_to) if s.budget.qa_expand_context else {}
+    # сами найденные сообщения не дублируем в окружении других
+    seen = {(int(r["chat_id"]), int(r["tg_msg_id"])) for r in rows}
+
+    items: list[tuple[QASource, str]] = []
 
     for r in rows:
         chat_title = chat_title_by_id.get(int(r["chat_id"]), f"chat_id={r['chat_id']}")
@@ -98,22 +268,28 @@ def answer_question(db: Session, chat_ids: list[int], date_from, date_to, questi
         # dist: меньше = ближе, а score - наоборот
         score = 1.0 - dist
 
-        sources.append(
-            QASource(
-                chat_title=chat_title,
-                tg_msg_id=tg_msg_id,
-                dt_iso=dt_iso,
-                sender_name=str(sender_name) if sender_name else None,
-                text=text,
-                score=score,
-            )
+        src = QASource(
+            chat_title=chat_title,
+            tg_msg_id=tg_msg_id,
+            dt_iso=dt_iso,
+            sender_name=str(sender_name) if sender_name else None,
+            text=text,
+            score=score,
         )
 
         # Контекст для LLM
-        who = f"{sources[-1].sender_name}: " if sources[-1].sender_name else ""
-        context_lines.append(
-            f"[{chat_title} | tg_msg_id={tg_msg_id} | {dt_iso}] {who}{text}"
-        )
+        around = context.get((int(r["chat_id"]), tg_msg_id))
+        if around:
+            items.append((src, _thread_snippet(r, f"[{chat_title} | {dt_iso}]", around, seen)))
+            continue
+        who = f"{src.sender_name}: " if src.sender_name else ""
+        snippet = truncate_to_tokens(text.replace("\n", " "), s.budget.message_max_tokens)
+        items.append((src, f"[{chat_title} | tg_msg_id={tg_msg_id} | {dt_iso}] {who}{snippet}"))
+
+    # строки уже отсортированы по близости — берём лучшие, пока укладываемся в бюджет
+    items = take_within_budget(items, lambda it: count_tokens(it[1]) + 1, s.budget.qa_context_max_tokens)
+    sources = [src for src, _ in items]
+    context_lines = [line for _, line in items]
 
     system = (
         "Ты — помощник, ТОЛЬКО анализирующий историю чатов в Telegram и отвечающий на различные вопросы, связанные с историей чатов.\n"
@@ -125,12 +301,43 @@ def answer_question(db: Session, chat_ids: list[int], date_from, date_to, questi
         "Контекст:\n"
         + "\n".join(context_lines)
     )
+    return system, user, sources
 
-    answer = chat_completion(system=system, user=user)
 
-    # Источники
+def _format_sources(sources: list[QASource]) -> str:
     src_lines = []
     for s in sources[: min(len(sources), 5)]:
         src_lines.append(f"- {s.chat_title}: tg_msg_id={s.tg_msg_id} (score={s.score:.3f})")
-    answer += "\n\nИсточники:\n" + "\n".join(src_lines)
-    return answer
+    return "\n\nИсточники:\n" + "\n".join(src_lines)
+
+
+@span("qa.answer")
+def answer_question(db: Session, chat_ids: list[int], date_from, date_to, question: str, top_k: int = 30) -> str:
+    """
+    RAG: находим топ сообщений, собираем контекст, спрашиваем LLM, возвращаем ответ + источники.
+    """
+    prompt = _build_prompt(db, chat_ids, date_from, date_to, question, top_k)
+    if prompt is None:
+        return NO_EMBEDDINGS_ANSWER
+    system, user, sources = prompt
+
+    answer = chat_completion(system=system, user=user, site="qa")
+    return answer + _format_sources(sources)
+
+
+def answer_question_stream(db: Session, chat_ids: list[int], date_from, date_to, question: str, top_k: int = 30) -> Iterator[str]:
+    """
+    То же, что answer_question, но отдаёт накопленный текст ответа по мере генерации (для стриминга в UI).
+    """
+    with span("qa.answer"):
+        prompt = _build_prompt(db, chat_ids, date_from, date_to, question, top_k)
+        if prompt is None:
+            yield NO_EMBEDDINGS_ANSWER
+            return
+        system, user, sources = prompt
+
+        answer = ""
+        for delta in chat_completion_stream(system=system, user=user, site="qa"):
+            answer += delta
+            yield answer
+        yield answer + _format_sources(sources)
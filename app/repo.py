@@ -2,10 +2,16 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
-from app.models import Chat, Message, Summary, Embedding
+from app import metrics
+from app.db import READ_REPLICA, is_psycopg3
+from app.models import Chat, ChatDailyStats, Message, Summary, Embedding
+from app.partitions import ensure_partitions_for
+from app.tracing import span
+from app.stats import add_embedded, count_messages_fast, refresh_days, utc_day
 
 def upsert_chats(db: Session, dialogs: list[dict]) -> int:
     count = 0
@@ -38,85 +44,160 @@ def get_chat_by_id(db: Session, chat_id: int) -> Chat:
     chat = db.execute(select(Chat).where(Chat.id == chat_id)).scalar_one()
     return chat
 
+_INSERT_BATCH_ROWS = 1000
+
+@metrics.timer("db_write_batch_seconds", op="insert_messages")
+@span("repo.insert_messages")
 def insert_messages(db: Session, chat_id: int, messages: list[dict]) -> tuple[int, int]:
-    inserted = 0
-    skipped = 0
-    for m in messages:
-        exists = db.execute(
-            select(Message.id).where(and_(Message.chat_id == chat_id, Message.tg_msg_id == m["tg_msg_id"]))
-        ).scalar_one_or_none()
-        if exists is not None:
-            skipped += 1
-            continue
-
-        db.add(
-            Message(
-                chat_id=chat_id,
-                tg_msg_id=m["tg_msg_id"],
-                dt=m["dt"],
-                sender_id=m["sender_id"],
-                sender_name=m["sender_name"],
-                text=m["text"],
-                reply_to_tg_msg_id=m["reply_to_tg_msg_id"],
-                raw=m["raw"],
-            )
+    if not messages:
+        return 0, 0
+    ensure_partitions_for(db, [m["dt"] for m in messages])
+
+    # Уникальность в секционированной таблице — по (chat_id, tg_msg_id, dt): дата сообщения в Telegram не меняется,
+    # поэтому повторы (в том числе одновременная загрузка из UI, воркера и sync-демона) отсекает ON CONFLICT
+    rows = {
+        (m["tg_msg_id"], m["dt"]): dict(
+            chat_id=chat_id,
+            tg_msg_id=m["tg_msg_id"],
+            dt=m["dt"],
+            sender_id=m["sender_id"],
+            sender_name=m["sender_name"],
+            text=m["text"],
+            reply_to_tg_msg_id=m["reply_to_tg_msg_id"],
+            raw=m["raw"],
+            embedding_pending=m["text"] != "",
         )
-        inserted += 1
+        for m in messages
+    }
+    values = list(rows.values())
+    new_dts: list[datetime] = []
+    # пачками: у psycopg 3 не больше 65535 параметров на запрос
+    for i in range(0, len(values), _INSERT_BATCH_ROWS):
+        new_dts += db.execute(
+            insert(Message)
+            .values(values[i:i + _INSERT_BATCH_ROWS])
+            .on_conflict_do_nothing(index_elements=["chat_id", "tg_msg_id", "dt"])
+            .returning(Message.dt)
+        ).scalars().all()
+    inserted = len(new_dts)
+    skipped = len(messages) - inserted
 
+    if new_dts:
+        refresh_days(db, chat_id, {utc_day(dt) for dt in new_dts})
     db.commit()
+    metrics.inc("db_rows_written_total", inserted, op="insert_messages")
     return inserted, skipped
 
-def count_messages(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> int:
-    q = db.execute(
-        select(func.count(Message.id)).where(
-            and_(
-                Message.chat_id.in_(chat_ids),
-                Message.dt >= date_from,
-                Message.dt <= date_to,
-            )
-        )
-    ).scalar_one()
+# Все запросы по периоду фильтруют по dt — это ключ секционирования messages/embeddings,
+# так что планировщик читает только секции нужных месяцев (проверка: scripts/partitions.py check).
+def _period_filter(chat_ids: list[int], date_from: datetime, date_to: datetime):
+    return and_(
+        Message.chat_id.in_(chat_ids),
+        Message.dt >= date_from,
+        Message.dt <= date_to,
+    )
+
+def _count_stmt(chat_ids: list[int], date_from: datetime, date_to: datetime):
+    return select(func.count(Message.id)).where(_period_filter(chat_ids, date_from, date_to))
+
+def _load_stmt(chat_ids: list[int], date_from: datetime, date_to: datetime):
+    return select(Message).where(_period_filter(chat_ids, date_from, date_to)).order_by(Message.dt.asc())
+
+def _missing_embeddings_stmt(
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    limit: int,
+    after: tuple[datetime, int] | None = None,
+):
+    # частичный индекс (chat_id, dt, id) WHERE embedding_pending содержит только необработанные сообщения,
+    # а keyset по (dt, id) продолжает с места предыдущего батча — стоимость O(batch), а не O(архив)
+    cond = and_(_period_filter(chat_ids, date_from, date_to), Message.embedding_pending.is_(True))
+    if after is not None:
+        cond = and_(cond, tuple_(Message.dt, Message.id) > tuple_(*after))
+    return select(Message).where(cond).order_by(Message.dt.asc(), Message.id.asc()).limit(limit)
+
+# Чтения ниже (count/load/get_latest_summary) уходят в реплику, если она настроена (app/db.py);
+# fresh=True — принудительно читать из primary.
+def _read(fresh: bool) -> dict:
+    return {} if fresh else READ_REPLICA
+
+@span("repo.count_messages")
+def count_messages(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, fresh: bool = False) -> int:
+    if not fresh:
+        # полные сутки периода берутся из дневных агрегатов (app/stats.py)
+        return count_messages_fast(db, chat_ids, date_from, date_to)
+    q = db.execute(_count_stmt(chat_ids, date_from, date_to)).scalar_one()
     return int(q)
 
-def load_messages(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> list[Message]:
-    rows = db.execute(
-        select(Message)
-        .where(
-            and_(
-                Message.chat_id.in_(chat_ids),
-                Message.dt >= date_from,
-                Message.dt <= date_to,
-            )
-        )
-        .order_by(Message.dt.asc())
-    ).scalars().all()
+def latest_message_dt(db: Session, chat_id: int) -> datetime | None:
+    return db.execute(select(func.max(Message.dt)).where(Message.chat_id == chat_id)).scalar_one_or_none()
+
+@span("repo.load_messages")
+def load_messages(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, fresh: bool = False) -> list[Message]:
+    rows = db.execute(_load_stmt(chat_ids, date_from, date_to), bind_arguments=_read(fresh)).scalars().all()
     return list(rows)
 
-def messages_missing_embeddings(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, limit: int = 5000) -> list[Message]:
-    rows = db.execute(
-        select(Message)
-        .outerjoin(Embedding, Embedding.message_id == Message.id)
-        .where(
-            and_(
-                Message.chat_id.in_(chat_ids),
-                Message.dt >= date_from,
-                Message.dt <= date_to,
-                Embedding.id.is_(None),
-                Message.text != "",
-            )
-        )
-        .order_by(Message.dt.asc())
-        .limit(limit)
-    ).scalars().all()
+@span("repo.messages_missing_embeddings")
+def messages_missing_embeddings(
+    db: Session,
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    limit: int = 5000,
+    after: tuple[datetime, int] | None = None,
+) -> list[Message]:
+    """Следующий батч сообщений без эмбеддингов после ключа after = (dt, id) последнего обработанного."""
+    rows = db.execute(_missing_embeddings_stmt(chat_ids, date_from, date_to, limit, after)).scalars().all()
     return list(rows)
 
-def save_embedding(db: Session, message_id: int, vector: list[float], model_name: str) -> None:
-    db.add(Embedding(message_id=message_id, embedding=vector, model_name=model_name))
+def count_missing_embeddings(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> int:
+    q = db.execute(
+        select(func.count()).where(and_(_period_filter(chat_ids, date_from, date_to), Message.embedding_pending.is_(True)))
+    ).scalar_one()
+    return int(q)
+
+def _copy_embeddings(db: Session, items: list[tuple[Message, list[float]]], model_name: str) -> None:
+    """Драйвер psycopg (v3): вставка батча одним COPY ... FORMAT BINARY в текущей транзакции сессии."""
+    import numpy as np
+    from pgvector.psycopg import register_vector
+
+    conn = db.connection()
+    raw = conn.connection.driver_connection
+    if not conn.info.get("pgvector_registered"):
+        register_vector(raw)
+        conn.info["pgvector_registered"] = True
+
+    with raw.cursor() as cur:
+        with cur.copy("COPY embeddings (message_id, dt, embedding, model_name) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(["int4", "timestamptz", "vector", "varchar"])
+            for m, v in items:
+                copy.write_row((m.id, m.dt, np.asarray(v, dtype=np.float32), model_name))
+
+@metrics.timer("db_write_batch_seconds", op="save_embeddings")
+@span("repo.save_embeddings")
+def save_embeddings(db: Session, items: list[tuple[Message, list[float]]], model_name: str) -> None:
+    """Сохраняет эмбеддинги батча и снимает с сообщений флаг embedding_pending одной транзакцией."""
+    if not items:
+        return
+    if is_psycopg3(db.get_bind()):
+        _copy_embeddings(db, items, model_name)
+    else:
+        db.add_all([Embedding(message_id=m.id, dt=m.dt, embedding=v, model_name=model_name) for m, v in items])
+    db.execute(
+        update(Message)
+        .where(tuple_(Message.id, Message.dt).in_([(m.id, m.dt) for m, _ in items]))
+        .values(embedding_pending=False)
+        .execution_options(synchronize_session=False)
+    )
+    add_embedded(db, [m for m, _ in items])
     db.commit()
+    metrics.inc("db_rows_written_total", len(items), op="save_embeddings")
 
 def _chat_ids_key(chat_ids: list[int]) -> str:
     return ",".join(str(x) for x in sorted(chat_ids))
 
+@span("repo.upsert_summary")
 def upsert_summary(
     db: Session,
     chat_ids: list[int],
@@ -167,11 +248,47 @@ def upsert_summary(
     db.refresh(existing)
     return existing
 
-def get_latest_summary(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> Summary | None:
+@span("repo.find_covering_summary")
+def find_covering_summary(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, model: str, prompt_version: str,
+) -> Summary | None:
+    """
+    Самая длинная сохранённая сводка тех же чатов (та же модель и версия промптов) за подпериод [date_from, date_to].
+    Сводка не подходит, если после её построения менялись сообщения в её днях (chat_daily_stats.updated_at).
+    """
+    candidates = db.execute(
+        select(Summary)
+        .where(and_(
+            Summary.chat_ids_key == _chat_ids_key(chat_ids),
+            Summary.date_from >= date_from,
+            Summary.date_to <= date_to,
+            Summary.model == model,
+            Summary.prompt_version == prompt_version,
+        ))
+        .order_by((Summary.date_to - Summary.date_from).desc(), Summary.created_at.desc())
+    ).scalars().all()
+    for c in candidates:
+        changed = db.execute(
+            select(ChatDailyStats.day)
+            .where(and_(
+                ChatDailyStats.chat_id.in_(chat_ids),
+                ChatDailyStats.day >= utc_day(c.date_from),
+                ChatDailyStats.day <= utc_day(c.date_to),
+                ChatDailyStats.updated_at > c.created_at,
+            ))
+            .limit(1)
+        ).first()
+        if changed is None:
+            return c
+    return None
+
+@span("repo.get_latest_summary")
+def get_latest_summary(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, fresh: bool = False) -> Summary | None:
     key = _chat_ids_key(chat_ids)
     return db.execute(
         select(Summary)
         .where(and_(Summary.chat_ids_key == key, Summary.date_from == date_from, Summary.date_to == date_to))
         .order_by(Summary.created_at.desc())
-        .limit(1)
+        .limit(1),
+        bind_arguments=_read(fresh),
     ).scalar_one_or_none()
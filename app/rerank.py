@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import logging
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
+
+from app import metrics
+from app.config import get_settings
+from app.tracing import span
+
+# как и в app/embeddings.py: sentence_transformers/torch грузятся только при первом переранжировании
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def _model() -> CrossEncoder:
+    from sentence_transformers import CrossEncoder
+
+    s = get_settings()
+    logger.info("Loading rerank model: %s", s.rerank.model_name)
+    return CrossEncoder(s.rerank.model_name, max_length=s.rerank.max_length, device="cpu")
+
+def rerank(question: str, rows: list[dict[str, Any]], top_n: int) -> list[dict[str, Any]]:
+    """
+    Оценивает пары (вопрос, текст сообщения) cross-encoder'ом за один батчевый прогон и возвращает top_n строк
+    по убыванию оценки; оценка кладётся в row["rerank_score"].
+    """
+    if not rows:
+        return []
+    s = get_settings()
+    m = _model()
+    pairs = [(question, (r["text"] or "").strip()) for r in rows]
+    with span("qa.rerank", candidates=len(rows)), metrics.timer("rerank_batch_seconds"):
+        scores = m.predict(pairs, batch_size=s.rerank.batch_size, show_progress_bar=False)
+    metrics.inc("rerank_pairs_total", len(pairs))
+    for r, score in zip(rows, scores):
+        r["rerank_score"] = float(score)
+    return sorted(rows, key=lambda r: r["rerank_score"], reverse=True)[:top_n]
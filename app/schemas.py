@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import re
+
 from pydantic import BaseModel, Field
 from typing import Literal
 
@@ -47,3 +49,75 @@ class SummaryJSON(BaseModel):
     action_items: list[ActionItem] = Field(default_factory=list)
     notable_facts: list[NotableFact] = Field(default_factory=list)
     topics: list[Topic] = Field(default_factory=list)
+
+# Поле-"заголовок" и допустимые значения enum-полей для каждого раздела SummaryJSON
+_SECTIONS: dict[str, tuple[str, dict[str, tuple[tuple[str, ...], str]]]] = {
+    "decisions": ("text", {}),
+    "risks": ("text", {
+        "severity": (("low", "medium", "high"), "medium"),
+        "status": (("open", "mitigating", "closed", "unknown"), "unknown"),
+    }),
+    "open_questions": ("text", {}),
+    "action_items": ("task", {"status": (("todo", "doing", "done", "unknown"), "unknown")}),
+    "notable_facts": ("text", {}),
+    "topics": ("topic", {}),
+}
+_OPTIONAL_STR = ("who", "when", "owner", "deadline")
+
+def _coerce_refs(val) -> list[int]:
+    if val is None:
+        return []
+    if not isinstance(val, list):
+        val = [val]
+    refs = []
+    for v in val:
+        if isinstance(v, bool):
+            continue
+        if isinstance(v, int):
+            refs.append(v)
+        elif isinstance(v, (float, str)):
+            m = re.search(r"\d+", str(v))
+            if m:
+                refs.append(int(m.group(0)))
+    return refs
+
+def coerce_summary(data) -> dict:
+    """
+    Приводит "почти правильный" JSON от LLM к схеме SummaryJSON: неизвестные enum-значения
+    заменяются на значения по умолчанию, message_refs приводятся к int, пустые пункты отбрасываются.
+    """
+    if not isinstance(data, dict):
+        data = {}
+    out: dict[str, list] = {}
+    for section, (title_key, enums) in _SECTIONS.items():
+        items = data.get(section) or []
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            items = []
+
+        res = []
+        for it in items:
+            if isinstance(it, str):
+                it = {title_key: it}
+            if not isinstance(it, dict):
+                continue
+            it = dict(it)
+            title = it.get(title_key)
+            if not isinstance(title, str) or not title.strip():
+                continue
+            for field, (allowed, default) in enums.items():
+                v = str(it.get(field) or "").strip().lower()
+                it[field] = v if v in allowed else default
+            for field in _OPTIONAL_STR:
+                if it.get(field) is not None and not isinstance(it[field], str):
+                    it[field] = str(it[field])
+            it["message_refs"] = _coerce_refs(it.get("message_refs"))
+            if "snippets" in it:
+                snippets = it["snippets"] if isinstance(it["snippets"], list) else [it["snippets"]]
+                it["snippets"] = [str(x) for x in snippets if x is not None]
+            if section == "topics" and not isinstance(it.get("summary"), str):
+                it["summary"] = str(it.get("summary") or "")
+            res.append(it)
+        out[section] = res
+    return out
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import logging
+from collections import Counter
+from collections.abc import Iterable
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import and_, func, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.db import READ_REPLICA
+from app.models import Chat, ChatDailyStats, Message
+
+logger = logging.getLogger(__name__)
+
+# Пересчёт агрегатов за сутки целиком: число различных авторов нельзя поддерживать простым прибавлением.
+# Диапазон по dt нужен для прунинга секций и индекса (chat_id, dt), фильтр по дням — чтобы не трогать соседние.
+_REFRESH_SQL = """
+INSERT INTO chat_daily_stats (chat_id, day, message_count, sender_count, total_chars, embedded_count, updated_at)
+SELECT m.chat_id, (m.dt AT TIME ZONE 'UTC')::date AS day,
+       count(*), count(DISTINCT m.sender_id), coalesce(sum(length(m.text)), 0),
+       count(*) FILTER (WHERE m.text <> '' AND NOT m.embedding_pending), now()
+FROM {table} m
+WHERE {where}
+GROUP BY m.chat_id, day
+ON CONFLICT (chat_id, day) DO UPDATE SET
+    message_count = EXCLUDED.message_count,
+    sender_count = EXCLUDED.sender_count,
+    total_chars = EXCLUDED.total_chars,
+    embedded_count = EXCLUDED.embedded_count,
+    updated_at = EXCLUDED.updated_at
+"""
+
+def _utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def day_start(d: date) -> datetime:
+    return datetime.combine(d, time.min, tzinfo=timezone.utc)
+
+def utc_day(dt: datetime) -> date:
+    return _utc(dt).date()
+
+def refresh_days(db: Session | Connection, chat_id: int, days: Iterable[date]) -> None:
+    """Пересчитывает агрегаты чата за указанные сутки (в текущей транзакции вызывающего)."""
+    days = sorted(set(days))
+    if not days:
+        return
+    db.execute(
+        text(_REFRESH_SQL.format(
+            table="messages",
+            where="m.chat_id = :chat_id AND m.dt >= :lo AND m.dt < :hi AND (m.dt AT TIME ZONE 'UTC')::date = ANY(:days)",
+        )),
+        {"chat_id": chat_id, "lo": day_start(days[0]), "hi": day_start(days[-1] + timedelta(days=1)), "days": days},
+    )
+
+def add_embedded(db: Session, messages: Iterable[Message]) -> None:
+    """
+    Увеличивает embedded_count для суток, в которых только что появились эмбеддинги. updated_at не трогает:
+    он отмечает изменение сообщений суток, и по нему find_covering_summary отбрасывает устаревшие сводки.
+    """
+    counts = Counter((m.chat_id, utc_day(m.dt)) for m in messages)
+    if not counts:
+        return
+    db.execute(
+        text(
+            "UPDATE chat_daily_stats SET embedded_count = embedded_count + :n "
+            "WHERE chat_id = :chat_id AND day = :day"
+        ),
+        [{"chat_id": c, "day": d, "n": n} for (c, d), n in counts.items()],
+    )
+
+def rebuild_table(conn: Connection, table: str) -> int:
+    """Полный пересчёт по одной таблице/секции messages (миграция, восстановление после ручных правок)."""
+    res = conn.execute(text(_REFRESH_SQL.format(table=table, where="TRUE")))
+    return int(res.rowcount or 0)
+
+def full_days(date_from: datetime, date_to: datetime) -> tuple[date, date]:
+    """Первые и последние сутки, целиком попадающие в [date_from, date_to]."""
+    f, t = _utc(date_from), _utc(date_to)
+    first = f.date() if f == day_start(f.date()) else f.date() + timedelta(days=1)
+    last = t.date() if t >= day_start(t.date() + timedelta(days=1)) - timedelta(seconds=1) else t.date() - timedelta(days=1)
+    return first, last
+
+def _live_count(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> int:
+    return int(db.execute(
+        select(func.count(Message.id)).where(and_(
+            Message.chat_id.in_(chat_ids), Message.dt >= date_from, Message.dt <= date_to,
+        )),
+        bind_arguments=READ_REPLICA,
+    ).scalar_one())
+
+def count_messages_fast(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> int:
+    """
+    Число сообщений за период: полные сутки — из chat_daily_stats, неполные сутки по краям периода
+    (если период начинается/заканчивается не на границе суток) — обычным COUNT.
+    """
+    first, last = full_days(date_from, date_to)
+    if first > last:
+        return _live_count(db, chat_ids, date_from, date_to)
+
+    n = int(db.execute(
+        select(func.coalesce(func.sum(ChatDailyStats.message_count), 0)).where(and_(
+            ChatDailyStats.chat_id.in_(chat_ids), ChatDailyStats.day >= first, ChatDailyStats.day <= last,
+        )),
+        bind_arguments=READ_REPLICA,
+    ).scalar_one())
+
+    head_end = day_start(first) - timedelta(microseconds=1)
+    if _utc(date_from) <= head_end:
+        n += _live_count(db, chat_ids, date_from, head_end)
+    tail_start = day_start(last + timedelta(days=1))
+    if _utc(date_to) >= tail_start:
+        n += _live_count(db, chat_ids, tail_start, date_to)
+    return n
+
+def embedded_counts(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, fresh: bool = False,
+) -> tuple[int, int]:
+    """Оценка по chat_daily_stats: (эмбеддингов у чатов за сутки периода, эмбеддингов всего)."""
+    in_period = and_(
+        ChatDailyStats.chat_id.in_(chat_ids),
+        ChatDailyStats.day >= utc_day(date_from),
+        ChatDailyStats.day <= utc_day(date_to),
+    )
+    row = db.execute(
+        select(
+            func.coalesce(func.sum(ChatDailyStats.embedded_count).filter(in_period), 0),
+            func.coalesce(func.sum(ChatDailyStats.embedded_count), 0),
+        ),
+        bind_arguments={} if fresh else READ_REPLICA,
+    ).one()
+    return int(row[0]), int(row[1])
+
+def daily_activity(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> list[dict[str, Any]]:
+    """Посуточная активность по чатам за период (по суткам, в которые попадает период)."""
+    rows = db.execute(
+        select(
+            ChatDailyStats.day,
+            Chat.title,
+            ChatDailyStats.message_count,
+            ChatDailyStats.sender_count,
+            ChatDailyStats.total_chars,
+            ChatDailyStats.embedded_count,
+        )
+        .join(Chat, Chat.id == ChatDailyStats.chat_id)
+        .where(and_(
+            ChatDailyStats.chat_id.in_(chat_ids),
+            ChatDailyStats.day >= utc_day(date_from),
+            ChatDailyStats.day <= utc_day(date_to),
+        ))
+        .order_by(ChatDailyStats.day.asc(), Chat.title.asc()),
+        bind_arguments=READ_REPLICA,
+    ).all()
+    return [{
+        "day": r.day,
+        "chat": r.title,
+        "messages": r.message_count,
+        "senders": r.sender_count,
+        "chars": r.total_chars,
+        "embedded": r.embedded_count,
+    } for r in rows]
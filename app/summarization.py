@@ -1,45 +1,40 @@
 from __future__ import annotations
 
+import json
 import logging
-from datetime import datetime
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta
+from typing import Any
 
 from sqlalchemy.orm import Session
 
-from app.llm import chat_completion, parse_json_strict
+from app.budget import PackedMessage, count_tokens, merge_adjacent, pack, truncate_to_tokens
+from app.llm import chat_completion, chat_completion_stream, parse_json_strict
 from app.prompts import MAP_SYSTEM, MAP_USER, REDUCE_SYSTEM, REDUCE_USER, PROMPT_VERSION
-from app.repo import load_messages, upsert_summary
-from app.schemas import SummaryJSON
+from app.repo import find_covering_summary, load_messages, upsert_summary
+from app.schemas import SummaryJSON, coerce_summary
 from app.config import get_settings
-from app.models import Chat
+from app.logging_setup import ProgressLog
+from app.tracing import span
+from app.models import Chat, Message, Summary
 
 logger = logging.getLogger(__name__)
 
-def _format_messages_block(messages) -> str:
-    lines = []
-    for m in messages:
-        sender = m.sender_name or ""
-        txt = (m.text or "").replace("\n", " ").strip()
-        if len(txt) > 700:
-            txt = txt[:700] + "…"
-        lines.append(f'- {{"tg_msg_id":{m.tg_msg_id},"dt":"{m.dt.isoformat()}","sender_name":"{sender}","text":"{txt}"}}')
-    return "\n".join(lines)
-
-def _chunk_messages_by_chars(messages, max_chars: int) -> list[list]:
-    chunks = []
-    current = []
-    cur_len = 0
-    for m in messages:
-        t = (m.text or "")
-        add = len(t) + 120
-        if current and (cur_len + add) > max_chars:
-            chunks.append(current)
-            current = []
-            cur_len = 0
-        current.append(m)
-        cur_len += add
-    if current:
-        chunks.append(current)
-    return chunks
+def _format_message_line(m: PackedMessage, max_tokens: int) -> str:
+    sender = m.sender_name or ""
+    txt = truncate_to_tokens(m.text, max_tokens)
+    ids = m.tg_msg_ids[0] if len(m.tg_msg_ids) == 1 else json.dumps(m.tg_msg_ids)
+    return f'- {{"tg_msg_id":{ids},"dt":"{m.dt.isoformat()}","sender_name":"{sender}","text":"{txt}"}}'
+
+def _chunk_messages_by_tokens(messages, settings) -> list[list[str]]:
+    """
+    Склеивает подряд идущие короткие сообщения одного автора и раскладывает строки по чанкам
+    в пределах map_chunk_max_tokens.
+    """
+    packed = merge_adjacent(messages, settings.budget.merge_short_message_tokens, settings.budget.merge_max_gap_seconds)
+    lines = [_format_message_line(m, settings.budget.message_max_tokens) for m in packed]
+    # +1 токен на перевод строки между строками блока
+    return pack(lines, lambda line: count_tokens(line) + 1, settings.budget.map_chunk_max_tokens)
 
 def _dedupe_list(items: list[dict], text_key: str, max_items: int) -> list[dict]:
     seen = set()
@@ -104,42 +99,74 @@ def _render_markdown(chats: list[Chat], date_from: datetime, date_to: datetime,
 
     return "\n".join(md).strip() + "\n"
 
-def generate_summary(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime) -> tuple[dict, str]:
-    settings = get_settings()
-    messages = load_messages(db, chat_ids, date_from, date_to)
-    logger.info("Summarization loaded %d messages", len(messages))
-
-    chunks = _chunk_messages_by_chars(messages, settings.map_chunk_max_chars)
+def _map_stage(messages, settings, skip: int = 0) -> Iterator[tuple[int, int, dict]]:
+    """skip — сколько первых чанков уже обработано (продолжение по checkpoint)."""
+    chunks = _chunk_messages_by_tokens(messages, settings)
     logger.info("Chunked into %d chunks", len(chunks))
+    progress_log = ProgressLog(logger)
 
-    map_results: list[dict] = []
     for idx, ch in enumerate(chunks, start=1):
-        block = _format_messages_block(ch)
-        user = MAP_USER.format(messages_block=block)
-        raw = chat_completion(MAP_SYSTEM, user)
-        parsed = parse_json_strict(raw)
-        # pydantic validation
-        sj = SummaryJSON.model_validate(parsed)
-        map_results.append(sj.model_dump())
+        if idx <= skip:
+            continue
+        with span("summary.map_chunk", chunk=idx, chunks=len(chunks)):
+            block = "\n".join(ch)
+            user = MAP_USER.format(messages_block=block)
+            raw = chat_completion(MAP_SYSTEM, user, json_mode=True, site="map")
+            parsed = coerce_summary(parse_json_strict(raw))
+            # pydantic validation
+            sj = SummaryJSON.model_validate(parsed)
 
-        logger.info("Map chunk %d/%d done", idx, len(chunks))
+        progress_log("Map chunks done: %d/%d", idx, len(chunks))
+        yield idx, len(chunks), sj.model_dump()
 
-    reduce_user = REDUCE_USER.format(
+def _reduce_user(map_results: list[dict], settings) -> str:
+    return REDUCE_USER.format(
         chunk_results=str(map_results),
-        max_items=settings.reduce_max_items,
+        max_items=settings.budget.reduce_max_items,
     )
-    reduce_raw = chat_completion(REDUCE_SYSTEM, reduce_user)
-    reduce_parsed = parse_json_strict(reduce_raw)
+
+def _merge_result(reduce_raw: str, settings) -> SummaryJSON:
+    reduce_parsed = coerce_summary(parse_json_strict(reduce_raw))
 
     # hard dedupe & limits
-    reduce_parsed["decisions"] = _dedupe_list(reduce_parsed.get("decisions", []), "text", settings.reduce_max_items)
-    reduce_parsed["risks"] = _dedupe_list(reduce_parsed.get("risks", []), "text", settings.reduce_max_items)
-    reduce_parsed["open_questions"] = _dedupe_list(reduce_parsed.get("open_questions", []), "text", settings.reduce_max_items)
-    reduce_parsed["action_items"] = _dedupe_list(reduce_parsed.get("action_items", []), "task", settings.reduce_max_items)
-    reduce_parsed["notable_facts"] = _dedupe_list(reduce_parsed.get("notable_facts", []), "text", settings.reduce_max_items)
-    reduce_parsed["topics"] = _dedupe_list(reduce_parsed.get("topics", []), "topic", settings.reduce_max_items)
+    reduce_parsed["decisions"] = _dedupe_list(reduce_parsed.get("decisions", []), "text", settings.budget.reduce_max_items)
+    reduce_parsed["risks"] = _dedupe_list(reduce_parsed.get("risks", []), "text", settings.budget.reduce_max_items)
+    reduce_parsed["open_questions"] = _dedupe_list(reduce_parsed.get("open_questions", []), "text", settings.budget.reduce_max_items)
+    reduce_parsed["action_items"] = _dedupe_list(reduce_parsed.get("action_items", []), "task", settings.budget.reduce_max_items)
+    reduce_parsed["notable_facts"] = _dedupe_list(reduce_parsed.get("notable_facts", []), "text", settings.budget.reduce_max_items)
+    reduce_parsed["topics"] = _dedupe_list(reduce_parsed.get("topics", []), "topic", settings.budget.reduce_max_items)
+
+    return SummaryJSON.model_validate(reduce_parsed)
 
-    final = SummaryJSON.model_validate(reduce_parsed)
+def reduce_summaries(items: list[dict]) -> dict:
+    """Объединяет сводки (результаты map-чанков, прежние или дневные сводки — всё SummaryJSON) одним вызовом reduce."""
+    settings = get_settings()
+    raw = chat_completion(REDUCE_SYSTEM, _reduce_user(items, settings), json_mode=True, site="reduce")
+    return _merge_result(raw, settings).model_dump()
+
+def reduce_summaries_stream(items: list[dict]) -> Iterator[tuple[str, Any]]:
+    """Потоковый reduce_summaries: ("reduce", raw_json_so_far) по мере генерации, затем ("done", summary_json)."""
+    settings = get_settings()
+    reduce_raw = ""
+    for delta in chat_completion_stream(REDUCE_SYSTEM, _reduce_user(items, settings), json_mode=True, site="reduce"):
+        reduce_raw += delta
+        yield "reduce", reduce_raw
+    yield "done", _merge_result(reduce_raw, settings).model_dump()
+
+def summarize_messages(messages: list[Message]) -> dict:
+    """Сводка по сообщениям без сохранения: map по чанкам, несколько чанков сводятся одним reduce. Без сообщений — пустая сводка."""
+    results = [res for _, _, res in _map_stage(messages, get_settings())]
+    if not results:
+        return SummaryJSON().model_dump()
+    if len(results) == 1:
+        return results[0]
+    return reduce_summaries(results)
+
+@span("summary.finalize")
+def save_summary(db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, summary_json: dict) -> tuple[dict, str]:
+    """Рендерит markdown и сохраняет сводку за период (upsert_summary). Возвращает (summary_json, markdown)."""
+    settings = get_settings()
+    final = SummaryJSON.model_validate(summary_json)
 
     chats = [db.get(Chat, cid) for cid in chat_ids]
     chats = [c for c in chats if c is not None]
@@ -151,9 +178,119 @@ def generate_summary(db: Session, chat_ids: list[int], date_from: datetime, date
         date_from=date_from,
         date_to=date_to,
         provider="huggingface_router",
-        model=settings.chat_model,
+        model=settings.llm.chat_model,
         prompt_version=PROMPT_VERSION,
         summary_json=final.model_dump(),
         summary_md=md,
     )
     return final.model_dump(), md
+
+def _load_delta(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, base: Summary | None,
+) -> list[Message]:
+    """Сообщения периода, не покрытые сводкой base: [date_from, base.date_from) и (base.date_to, date_to]."""
+    if base is None:
+        return load_messages(db, chat_ids, date_from, date_to)
+    eps = timedelta(microseconds=1)
+    messages: list[Message] = []
+    if base.date_from > date_from:
+        messages += load_messages(db, chat_ids, date_from, base.date_from - eps)
+    if base.date_to < date_to:
+        messages += load_messages(db, chat_ids, base.date_to + eps, date_to)
+    return messages
+
+def _find_base(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, settings, incremental: bool, checkpoint: dict,
+) -> Summary | None:
+    # при продолжении по checkpoint база должна быть той же, что при первом запуске (map_results считались от неё)
+    if "map_results" in checkpoint:
+        base_id = checkpoint.get("base_summary_id")
+        base = db.get(Summary, base_id) if base_id else None
+        if base_id and base is None:
+            logger.warning("Base summary %s of the checkpoint is gone, summarizing from scratch", base_id)
+            checkpoint.clear()
+        return base
+    if not incremental:
+        return None
+    return find_covering_summary(db, chat_ids, date_from, date_to, settings.llm.chat_model, PROMPT_VERSION)
+
+def _load_for_summary(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, settings, incremental: bool, checkpoint: dict,
+) -> tuple[Summary | None, list[Message]]:
+    base = _find_base(db, chat_ids, date_from, date_to, settings, incremental, checkpoint)
+    messages = _load_delta(db, chat_ids, date_from, date_to, base)
+    if base is not None:
+        logger.info(
+            "Incremental summary: reusing summary %d (%s..%s), %d new messages",
+            base.id, base.date_from.isoformat(), base.date_to.isoformat(), len(messages),
+        )
+    else:
+        logger.info("Summarization loaded %d messages", len(messages))
+    return base, messages
+
+def _reduce_inputs(base: Summary | None, map_results: list[dict]) -> list[dict]:
+    # предыдущая сводка — такой же SummaryJSON, как результат map-чанка, поэтому reduce объединяет её с новыми чанками
+    return ([base.summary_json] if base is not None else []) + map_results
+
+@span("summary.generate")
+def generate_summary(
+    db: Session,
+    chat_ids: list[int],
+    date_from: datetime,
+    date_to: datetime,
+    progress: Callable[[int, int, dict], None] | None = None,
+    checkpoint: dict | None = None,
+    incremental: bool = True,
+) -> tuple[dict, str]:
+    """
+    progress(done, total, checkpoint) вызывается после каждого map-чанка (total включает reduce-шаг);
+    checkpoint {"map_results": [...]} позволяет продолжить с первого необработанного чанка.
+    incremental=True — если есть сохранённая сводка за подпериод (find_covering_summary), map выполняется
+    только для сообщений вне него, а reduce объединяет прежний summary_json с новыми чанками.
+    """
+    settings = get_settings()
+    checkpoint = dict(checkpoint or {})
+    base, messages = _load_for_summary(db, chat_ids, date_from, date_to, settings, incremental, checkpoint)
+
+    map_results: list[dict] = list(checkpoint.get("map_results", []))
+    for idx, total, res in _map_stage(messages, settings, skip=len(map_results)):
+        map_results.append(res)
+        if progress is not None:
+            progress(idx, total + 1, {"map_results": map_results, "base_summary_id": base.id if base else None})
+
+    if base is not None and not map_results:
+        # новых сообщений нет — та же сводка под новый период, без вызовов LLM
+        return save_summary(db, chat_ids, date_from, date_to, base.summary_json)
+    with span("summary.reduce", chunks=len(map_results), incremental=base is not None):
+        summary_json = reduce_summaries(_reduce_inputs(base, map_results))
+    return save_summary(db, chat_ids, date_from, date_to, summary_json)
+
+def generate_summary_stream(
+    db: Session, chat_ids: list[int], date_from: datetime, date_to: datetime, incremental: bool = True,
+) -> Iterator[tuple[str, Any]]:
+    """
+    Потоковый вариант generate_summary. Отдаёт события (stage, payload):
+    ("map", "i/n") — прогресс map-стадии, ("reduce", raw_json_so_far) — токены reduce по мере генерации,
+    ("done", (summary_json, summary_md)) — итог.
+    """
+    with span("summary.generate"):
+        settings = get_settings()
+        base, messages = _load_for_summary(db, chat_ids, date_from, date_to, settings, incremental, {})
+
+        map_results: list[dict] = []
+        for idx, total, res in _map_stage(messages, settings):
+            map_results.append(res)
+            yield "map", f"{idx}/{total}"
+
+        if base is not None and not map_results:
+            yield "done", save_summary(db, chat_ids, date_from, date_to, base.summary_json)
+            return
+
+        with span("summary.reduce", chunks=len(map_results), incremental=base is not None):
+            for stage, payload in reduce_summaries_stream(_reduce_inputs(base, map_results)):
+                if stage == "reduce":
+                    yield stage, payload
+                else:
+                    summary_json = payload
+
+        yield "done", save_summary(db, chat_ids, date_from, date_to, summary_json)
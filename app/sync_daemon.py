@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from app.build_embeddings import build_embeddings_for_period
+from app.db import SessionLocal
+from app.models import Chat
+from app.repo import insert_messages, latest_message_dt
+from app.telegram_client import fetch_messages, make_client
+
+logger = logging.getLogger(__name__)
+
+async def sync_chat_once(client, db: Session, chat: Chat, initial_lookback: timedelta, embed_batch_size: int) -> dict:
+    """
+    Догружает сообщения чата начиная с последнего сохранённого (дубликаты отсекает insert_messages)
+    и сразу строит эмбеддинги для новых сообщений.
+    """
+    now = datetime.now(timezone.utc)
+    since = await asyncio.to_thread(latest_message_dt, db, chat.id)
+    if since is None:
+        since = now - initial_lookback
+
+    msgs = await fetch_messages(chat.tg_peer_id, since, now, client=client)
+    inserted, skipped = await asyncio.to_thread(insert_messages, db, chat.id, msgs)
+
+    embedded = 0
+    if inserted:
+        res = await asyncio.to_thread(
+            build_embeddings_for_period, db, [chat.id], since, now, embed_batch_size
+        )
+        embedded = res["embedded"]
+
+    return {"chat": chat.title, "fetched": len(msgs), "inserted": inserted, "skipped": skipped, "embedded": embedded}
+
+async def run_sync_daemon(chat_ids: list[int], interval_seconds: int, initial_lookback_days: int, embed_batch_size: int) -> None:
+    """
+    Держит выбранные чаты актуальными: периодически опрашивает Telegram через один постоянно
+    подключённый клиент и эмбеддит новые сообщения небольшими батчами.
+    """
+    if not chat_ids:
+        raise RuntimeError("Не заданы чаты для синхронизации (SYNC_CHAT_IDS или --chat-ids).")
+
+    initial_lookback = timedelta(days=initial_lookback_days)
+    client = make_client()
+    async with client:
+        logger.info("Sync daemon started for chats %s, interval=%ds", chat_ids, interval_seconds)
+        while True:
+            db = SessionLocal()
+            try:
+                chats = await asyncio.to_thread(lambda: [db.get(Chat, cid) for cid in chat_ids])
+                for chat in chats:
+                    if chat is None:
+                        continue
+                    try:
+                        res = await sync_chat_once(client, db, chat, initial_lookback, embed_batch_size)
+                        if res["inserted"]:
+                            logger.info("Sync %s: %s", chat.title, res)
+                    except Exception:
+                        db.rollback()
+                        logger.exception("Sync failed for chat_id=%s", chat.id)
+            finally:
+                db.close()
+            await asyncio.sleep(interval_seconds)
@@ -1,25 +1,33 @@
 from __future__ import annotations
 import json
 import logging
+import time
 from datetime import datetime, timezone
+from typing import TYPE_CHECKING
 
-from telethon import TelegramClient
-from telethon.tl.types import Channel, Chat, User
-
+from app import metrics
 from app.config import get_settings
 
+# telethon импортируется при первом обращении к Telegram, а не при импорте модуля (быстрый старт UI)
+if TYPE_CHECKING:
+    from telethon import TelegramClient
+
 logger = logging.getLogger(__name__)
 
 def make_client() -> TelegramClient:
+    from telethon import TelegramClient
+
     s = get_settings()
     client = TelegramClient(
-        s.telethon_session_path,
-        s.telegram_api_id,
-        s.telegram_api_hash,
+        s.telegram.session_path,
+        s.telegram.api_id,
+        s.telegram.api_hash,
     )
     return client
 
 def _peer_type(entity) -> str:
+    from telethon.tl.types import Channel, Chat, User
+
     if isinstance(entity, User):
         return "user"
     if isinstance(entity, Chat):
@@ -51,9 +59,10 @@ async def resolve_entity(peer_id: int):
         entity = await client.get_entity(peer_id)
         return entity
 
-async def fetch_messages(peer_id: int, date_from: datetime, date_to: datetime) -> list[dict]:
+async def fetch_messages(peer_id: int, date_from: datetime, date_to: datetime, client: TelegramClient | None = None) -> list[dict]:
     """
     Возвращает сообщения в диапазоне [date_from, date_to] (включительно).
+    client — уже подключённый клиент; если не передан, создаётся и закрывается на время вызова.
 
     Надёжная стратегия:
     - iter_messages(..., reverse=True) идёт от старых к новым
@@ -63,63 +72,73 @@ async def fetch_messages(peer_id: int, date_from: datetime, date_to: datetime) -
     if date_from.tzinfo is None or date_to.tzinfo is None:
         raise ValueError("date_from/date_to должны быть timezone-aware (UTC или др).")
 
-    client = make_client()
-    async with client:
-        entity = await client.get_entity(peer_id)
-
-        msgs: list[dict] = []
-        async for m in client.iter_messages(entity, offset_date=date_from, reverse=True):
-            if m is None or m.date is None:
-                continue
-
-            dt = m.date
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-
-            # пропускаем то, что строго раньше начала периода
-            if dt < date_from: continue
-
-            # как только вышли за конец периода — стоп (дальше только новее)
-            if dt > date_to: break
-
-            text = m.message or ""
-
-            sender_id = None
-            sender_name = None
-            try:
-                sender = await m.get_sender()
-            except Exception:
-                sender = None
-
-            if sender is not None:
-                sender_id = getattr(sender, "id", None)
-                if getattr(sender, "username", None):
-                    sender_name = "@" + str(sender.username)
-                else:
-                    fn = getattr(sender, "first_name", "") or ""
-                    ln = getattr(sender, "last_name", "") or ""
-                    full = (fn + " " + ln).strip()
-                    sender_name = full if full else None
-
-            reply_to = None
-            if getattr(m, "reply_to", None) and getattr(m.reply_to, "reply_to_msg_id", None):
-                reply_to = int(m.reply_to.reply_to_msg_id)
-            
-            raw = m.to_dict()
-            raw = json.loads(json.dumps(raw, default=str))
-
-            msgs.append(
-                {
-                    "tg_msg_id": int(m.id),
-                    "dt": dt,
-                    "sender_id": int(sender_id) if sender_id is not None else None,
-                    "sender_name": sender_name,
-                    "text": text,
-                    "reply_to_tg_msg_id": reply_to,
-                    "raw": raw,
-                }
-            )
-
-        msgs.sort(key=lambda x: x["dt"])
-        logger.info("Fetched %d messages for peer_id=%s", len(msgs), peer_id)
-        return msgs
+    if client is None:
+        client = make_client()
+        async with client:
+            return await _fetch_messages(client, peer_id, date_from, date_to)
+    # уже подключённый долгоживущий клиент (демон синхронизации)
+    return await _fetch_messages(client, peer_id, date_from, date_to)
+
+async def _fetch_messages(client: TelegramClient, peer_id: int, date_from: datetime, date_to: datetime) -> list[dict]:
+    start = time.perf_counter()
+    entity = await client.get_entity(peer_id)
+
+    msgs: list[dict] = []
+    async for m in client.iter_messages(entity, offset_date=date_from, reverse=True):
+        if m is None or m.date is None:
+            continue
+
+        dt = m.date
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+
+        # пропускаем то, что строго раньше начала периода
+        if dt < date_from: continue
+
+        # как только вышли за конец периода — стоп (дальше только новее)
+        if dt > date_to: break
+
+        text = m.message or ""
+
+        sender_id = None
+        sender_name = None
+        try:
+            sender = await m.get_sender()
+        except Exception:
+            sender = None
+
+        if sender is not None:
+            sender_id = getattr(sender, "id", None)
+            if getattr(sender, "username", None):
+                sender_name = "@" + str(sender.username)
+            else:
+                fn = getattr(sender, "first_name", "") or ""
+                ln = getattr(sender, "last_name", "") or ""
+                full = (fn + " " + ln).strip()
+                sender_name = full if full else None
+
+        reply_to = None
+        if getattr(m, "reply_to", None) and getattr(m.reply_to, "reply_to_msg_id", None):
+            reply_to = int(m.reply_to.reply_to_msg_id)
+        
+        raw = m.to_dict()
+        raw = json.loads(json.dumps(raw, default=str))
+
+        msgs.append(
+            {
+                "tg_msg_id": int(m.id),
+                "dt": dt,
+                "sender_id": int(sender_id) if sender_id is not None else None,
+                "sender_name": sender_name,
+                "text": text,
+                "reply_to_tg_msg_id": reply_to,
+                "raw": raw,
+            }
+        )
+
+    msgs.sort(key=lambda x: x["dt"])
+    # скорость выгрузки по чату: rate(telegram_messages_fetched_total) / telegram_fetch_seconds
+    metrics.observe("telegram_fetch_seconds", time.perf_counter() - start, chat=peer_id)
+    metrics.inc("telegram_messages_fetched_total", len(msgs), chat=peer_id)
+    logger.info("Fetched %d messages for peer_id=%s", len(msgs), peer_id)
+    return msgs
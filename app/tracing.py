@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SpanRecord:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict[str, Any]:
+        """Span в JSON-представлении OTLP (как в opentelemetry-proto), одна строка файла — один span."""
+        out: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        return out
+
+def _otlp_value(v: Any) -> dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+_current: ContextVar[SpanRecord | None] = ContextVar("current_span", default=None)
+# список, в который собираются завершённые span'ы текущего запроса (для разбивки по времени в UI)
+_collector: ContextVar[list[SpanRecord] | None] = ContextVar("span_collector", default=None)
+
+_export_lock = threading.Lock()
+# Как логи в app/logging_setup.py: span'ы кладутся в очередь, в файл (с ротацией) их пишет поток QueueListener.
+# Логгер не регистрируется в logging.getLogger(), поэтому setup_logging и корневые обработчики его не трогают.
+_exporter: logging.Logger | None = None
+_listener: QueueListener | None = None
+
+def _get_exporter() -> logging.Logger | None:
+    global _exporter, _listener
+    path = get_settings().observability.trace_file
+    if not path:
+        return None
+    with _export_lock:
+        if _exporter is None:
+            try:
+                handler = RotatingFileHandler(path, maxBytes=5_000_000, backupCount=5, encoding="utf-8", delay=True)
+            except OSError:
+                logger.warning("Failed to open trace file %s", path, exc_info=True)
+                return None
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            q: queue.SimpleQueue = queue.SimpleQueue()
+            exporter = logging.Logger("tg-chat-analyzer.traces", logging.INFO)
+            exporter.propagate = False
+            exporter.addHandler(QueueHandler(q))
+            _listener = QueueListener(q, handler)
+            _listener.start()
+            _exporter = exporter
+    return _exporter
+
+def _export(rec: SpanRecord) -> None:
+    exporter = _get_exporter()
+    if exporter is None:
+        return
+    exporter.info("%s", json.dumps({"service": "tg-chat-analyzer", "span": rec.to_otlp()}, ensure_ascii=False, default=str))
+
+def _stop_exporter() -> None:
+    # дописывает оставшиеся в очереди span'ы при завершении процесса
+    global _exporter, _listener
+    with _export_lock:
+        if _listener is not None:
+            _listener.stop()
+        _exporter = _listener = None
+
+atexit.register(_stop_exporter)
+
+def current_trace_id() -> str | None:
+    cur = _current.get()
+    return cur.trace_id if cur else None
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[SpanRecord]:
+    """
+    Span вокруг блока кода; вложенные span'ы (в том же контексте) становятся дочерними.
+    Можно использовать и как декоратор обычной функции.
+    """
+    parent = _current.get()
+    rec = SpanRecord(
+        name=name,
+        trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+        span_id=os.urandom(8).hex(),
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns(),
+        attributes=dict(attributes),
+    )
+    token = _current.set(rec)
+    try:
+        yield rec
+    except BaseException as e:
+        rec.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        rec.end_ns = time.time_ns()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # генератор закрыт из другого контекста (например, сборщиком мусора после отключения клиента)
+            pass
+        spans = _collector.get()
+        if spans is not None:
+            spans.append(rec)
+        _export(rec)
+
+@contextmanager
+def collect(name: str, **attributes: Any) -> Iterator[list[SpanRecord]]:
+    """Корневой span запроса; в возвращаемый список попадают все завершённые span'ы трассы (после выхода из блока)."""
+    spans: list[SpanRecord] = []
+    token = _collector.set(spans)
+    try:
+        with span(name, **attributes):
+            yield spans
+    finally:
+        _collector.reset(token)
+
+def format_breakdown(spans: list[SpanRecord]) -> str:
+    """Сворачиваемая (HTML details) разбивка времени по span'ам — для Markdown в Gradio."""
+    if not spans:
+        return ""
+    children: dict[str | None, list[SpanRecord]] = {}
+    for s in spans:
+        children.setdefault(s.parent_id, []).append(s)
+    ids = {s.span_id for s in spans}
+    roots = [s for s in spans if s.parent_id not in ids]
+
+    lines: list[str] = []
+
+    def walk(s: SpanRecord, depth: int) -> None:
+        attrs = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+        mark = " !" if s.error else ""
+        lines.append(f"{'  ' * depth}{s.name:<{max(40 - 2 * depth, 10)}} {s.duration_ms:9.1f} ms{mark}  {attrs}".rstrip())
+        for c in sorted(children.get(s.span_id, []), key=lambda c: c.start_ns):
+            walk(c, depth + 1)
+
+    for r in sorted(roots, key=lambda r: r.start_ns):
+        walk(r, 0)
+    total = max(r.duration_ms for r in roots) / 1000
+    return (
+        f"\n\n<details><summary>Тайминги: {total:.2f} s (trace {roots[0].trace_id})</summary>\n\n"
+        "```\n" + "\n".join(lines) + "\n```\n</details>"
+    )
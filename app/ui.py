@@ -1,26 +1,39 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import json
 import logging
+from collections.abc import AsyncIterator, Iterator
 from datetime import datetime, timezone
+from functools import partial
+from typing import TypeVar
 
 import gradio as gr
 import pandas as pd
 from sqlalchemy.orm import Session
 
-from app.logging_setup import setup_logging
+from app.config import get_settings
+from app.logging_setup import log_context, setup_logging
 from app.migrate import init_db
 from app.db import SessionLocal
 from app.repo import list_chats, count_messages
 from app.ingestion import sync_chats, ingest_period
 from app.build_embeddings import build_embeddings_for_period
-from app.summarization import generate_summary
-from app.qa import answer_question
+from app.summarization import generate_summary_stream
+from app.daily_summaries import generate_summary_by_days_stream
+from app.qa import answer_question_stream
+from app.jobs import get_job, list_jobs, request_cancel, submit_job
+from app.profiling import ProfileSession, profile
+from app.stats import daily_activity
+from app.tracing import collect, format_breakdown
 
 import traceback
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 def _utc_dt(date_str: str, end: bool = False) -> datetime:
     # date_str: "YYYY-MM-DD"
     dt = datetime.fromisoformat(date_str)
@@ -34,36 +47,66 @@ def _chat_choices(db: Session) -> list[tuple[str, int]]:
     chats = list_chats(db)
     return [(f"{c.title} ({c.chat_type})", c.id) for c in chats]
 
-def _sync_chats_ui() -> tuple[pd.DataFrame, str]:
+async def _iterate_in_thread(gen: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Прокручивает блокирующий генератор в пуле потоков, не занимая общий event loop.
+    Все шаги выполняются в одном contextvars-контексте, чтобы span'ы трассировки, открытые в генераторе,
+    переживали yield.
+    """
+    done = object()
+    ctx = contextvars.copy_context()
+    while True:
+        item = await asyncio.to_thread(ctx.run, next, gen, done)
+        if item is done:
+            return
+        yield item
+
+def _with_trace(name: str, gen: Iterator[T]) -> Iterator[tuple[T | None, str | None]]:
+    """Прогоняет генератор внутри корневого span; элементы отдаются как (item, None), в конце — (None, разбивка времени)."""
+    with collect(name) as spans:
+        for item in gen:
+            yield item, None
+    yield None, format_breakdown(spans)
+
+def _profile_note(prof: ProfileSession | None) -> str:
+    if prof is None or prof.path is None:
+        return ""
+    return f"\n\nПрофиль: {prof.path} ({prof.summary()})"
+
+def _chats_df(db: Session) -> pd.DataFrame:
+    chats = list_chats(db)
+    return pd.DataFrame([{
+        "id": c.id,
+        "title": c.title,
+        "type": c.chat_type,
+        "username": c.username,
+        "tg_peer_id": c.tg_peer_id,
+        "updated_at": c.updated_at.isoformat(),
+    } for c in chats])
+
+async def _sync_chats_ui() -> tuple[pd.DataFrame, str]:
     db = SessionLocal()
     try:
-        added = asyncio.run(sync_chats(db))
-        chats = list_chats(db)
-        df = pd.DataFrame([{
-            "id": c.id,
-            "title": c.title,
-            "type": c.chat_type,
-            "username": c.username,
-            "tg_peer_id": c.tg_peer_id,
-            "updated_at": c.updated_at.isoformat(),
-        } for c in chats])
-        return df, f"Синхронизация завершена. Новых чатов: {added}. Всего в базе: {len(chats)}."
+        added = await sync_chats(db)
+        df = await asyncio.to_thread(_chats_df, db)
+        return df, f"Синхронизация завершена. Новых чатов: {added}. Всего в базе: {len(df)}."
     finally:
         db.close()
 
-def _ingest_ui(chat_ids: list[int], date_from: str, date_to: str) -> str:
+async def _ingest_ui(chat_ids: list[int], date_from: str, date_to: str, profile_on: bool = False) -> str:
     db = SessionLocal()
     try:
         df = _utc_dt(date_from, end=False)
         dt = _utc_dt(date_to, end=True)
-        res = asyncio.run(ingest_period(db, chat_ids, df, dt))
+        with log_context(), profile("ingest", enabled=profile_on or None) as prof:
+            res = await ingest_period(db, chat_ids, df, dt)
         lines = [
             f"Итог: inserted={res['total_inserted']} skipped={res['total_skipped']}",
             "",
         ]
         for b in res["by_chat"]:
             lines.append(f"- {b['chat']}: fetched={b['fetched']} inserted={b['inserted']} skipped={b['skipped']}")
-        return "\n".join(lines)
+        return "\n".join(lines) + _profile_note(prof)
     except Exception:
         logger.exception("Ошибка при сборе сообщений")
         return "Ошибка при сборе сообщений:\n\n" + traceback.format_exc()
@@ -71,13 +114,15 @@ def _ingest_ui(chat_ids: list[int], date_from: str, date_to: str) -> str:
         db.close()
 
 
-def _embed_ui(chat_ids: list[int], date_from: str, date_to: str) -> str:
+def _embed_ui(chat_ids: list[int], date_from: str, date_to: str, profile_on: bool = False) -> str:
+    # синхронный обработчик: Gradio сам выполняет его в пуле потоков
     db = SessionLocal()
     try:
         df = _utc_dt(date_from, end=False)
         dt = _utc_dt(date_to, end=True)
-        res = build_embeddings_for_period(db, chat_ids, df, dt, batch_size=128)
-        return f"Построено новых эмбеддингов: {res['embedded']}."
+        with log_context(), profile("embed", enabled=profile_on or None) as prof:
+            res = build_embeddings_for_period(db, chat_ids, df, dt)
+        return f"Построено новых эмбеддингов: {res['embedded']}." + _profile_note(prof)
     except Exception:
         logger.exception("Ошибка при построении эмбеддингов")
         return "Ошибка при построении эмбеддингов:\n\n" + traceback.format_exc()
@@ -94,17 +139,56 @@ def _count_ui(chat_ids: list[int], date_from: str, date_to: str) -> str:
     finally:
         db.close()
 
-def _summary_ui(chat_ids: list[int], date_from: str, date_to: str) -> tuple[str, str]:
+def _activity_ui(chat_ids: list[int], date_from: str, date_to: str) -> tuple[pd.DataFrame, pd.DataFrame, str]:
+    db = SessionLocal()
+    try:
+        rows = daily_activity(db, chat_ids, _utc_dt(date_from, end=False), _utc_dt(date_to, end=True))
+    finally:
+        db.close()
+    df = pd.DataFrame(rows, columns=["day", "chat", "messages", "senders", "chars", "embedded"])
+    if df.empty:
+        return df, df, "Нет данных за период."
+    df["day"] = pd.to_datetime(df["day"])
+    df["coverage"] = (df["embedded"] / df["messages"].where(df["messages"] > 0)).fillna(0).round(2)
+    total, embedded = int(df["messages"].sum()), int(df["embedded"].sum())
+    info = f"Сообщений: {total}, с эмбеддингами: {embedded}, дней с активностью: {df['day'].nunique()}."
+    return df, df[["day", "chat", "messages"]], info
+
+async def _summary_ui(
+    chat_ids: list[int], date_from: str, date_to: str, profile_on: bool = False, incremental: bool = True, by_days: bool = False,
+):
     db = SessionLocal()
     try:
         df = _utc_dt(date_from, end=False)
         dt = _utc_dt(date_to, end=True)
-        js, md = generate_summary(db, chat_ids, df, dt)
-        return md, str(js)
+        md, js = "", ""
+        with profile("summary", enabled=profile_on or None) as prof:
+            if by_days:
+                events = generate_summary_by_days_stream(db, chat_ids, df, dt)
+            else:
+                events = generate_summary_stream(db, chat_ids, df, dt, incremental=incremental)
+            stream = _with_trace("ui.summary", events)
+            async for event, timings in _iterate_in_thread(stream):
+                if timings is not None:
+                    md += timings
+                    yield md, js
+                    continue
+                stage, payload = event
+                if stage == "map":
+                    what = "суток по чатам" if by_days else "чанков"
+                    yield f"_Map-стадия: обработано {what} {payload}…_", ""
+                elif stage == "reduce":
+                    yield "_Reduce-стадия: формируется итоговая сводка…_", payload
+                else:
+                    js_obj, md = payload
+                    js = str(js_obj)
+                    yield md, js
+        if prof is not None:
+            yield md + _profile_note(prof), js
     finally:
         db.close()
 
-def _qa_respond(chat_ids: list[int], date_from: str, date_to: str, history: list[tuple[str, str]], question: str,):
+async def _qa_respond(chat_ids: list[int], date_from: str, date_to: str, history: list[tuple[str, str]], question: str, profile_on: bool = False):
     db = SessionLocal()
     try:
         if history is None:
@@ -113,43 +197,127 @@ def _qa_respond(chat_ids: list[int], date_from: str, date_to: str, history: list
         df = _utc_dt(date_from, end=False)
         dt = _utc_dt(date_to, end=True)
 
-        ans = answer_question(db, chat_ids, df, dt, question)
-
-        # ans может быть str или (answer, sources) — делаем устойчиво
-        if isinstance(ans, tuple) and len(ans) == 2:
-            answer_text, sources_text = ans
-            answer_text = str(answer_text)
-            sources_text = str(sources_text).strip()
-            if sources_text:
-                answer_text += "\n\nИсточники:\n" + sources_text
-        else:
-            answer_text = str(ans)
-
-        history = history + [(question, answer_text)]
-        return history, ""
+        answer_text = ""
+        with profile("qa", enabled=profile_on or None) as prof:
+            stream = _with_trace("ui.qa", answer_question_stream(db, chat_ids, df, dt, question))
+            async for item, timings in _iterate_in_thread(stream):
+                if timings is not None:
+                    answer_text += timings
+                else:
+                    answer_text = item
+                yield history + [(question, answer_text)], ""
+        if prof is not None:
+            yield history + [(question, answer_text + _profile_note(prof))], ""
 
     except Exception:
         logger.exception("Ошибка в QA/Вопросы")
         err = "Ошибка в QA:\n\n" + traceback.format_exc()
         history = (history or []) + [(question, err)]
-        return history, ""
+        yield history, ""
 
     finally:
         db.close()
 
 
-def build_app() -> gr.Blocks:
+def _submit_job_ui(
+    kind: str, chat_ids: list[int], date_from: str, date_to: str, profile_on: bool = False, incremental: bool = True,
+    by_days: bool = False,
+) -> str:
+    if not chat_ids:
+        return "Выберите хотя бы один чат."
+    db = SessionLocal()
+    try:
+        params = {
+            "chat_ids": list(chat_ids),
+            "date_from": _utc_dt(date_from, end=False).isoformat(),
+            "date_to": _utc_dt(date_to, end=True).isoformat(),
+        }
+        if profile_on:
+            params["profile"] = True
+        if kind == "summary":
+            params["incremental"] = incremental
+            params["by_days"] = by_days
+        job = submit_job(db, kind, params)
+        return f"Задача #{job.id} ({kind}) поставлена в очередь. Статус — на вкладке 'Задачи'."
+    finally:
+        db.close()
+
+def _jobs_ui() -> pd.DataFrame:
+    db = SessionLocal()
+    try:
+        return pd.DataFrame([{
+            "id": j.id,
+            "kind": j.kind,
+            "status": j.status,
+            "progress": f"{j.progress}/{j.total}" if j.total else "",
+            "created_at": j.created_at.isoformat(timespec="seconds"),
+            "finished_at": j.finished_at.isoformat(timespec="seconds") if j.finished_at else "",
+            "error": j.error or "",
+        } for j in list_jobs(db)])
+    finally:
+        db.close()
+
+def _cancel_job_ui(job_id: float | None) -> str:
+    if not job_id:
+        return "Укажите id задачи."
+    db = SessionLocal()
+    try:
+        ok = request_cancel(db, int(job_id))
+        return f"Отмена задачи #{int(job_id)} запрошена." if ok else f"Задача #{int(job_id)} не найдена или уже завершена."
+    finally:
+        db.close()
+
+def _job_result_ui(job_id: float | None) -> str:
+    if not job_id:
+        return "Укажите id задачи."
+    db = SessionLocal()
+    try:
+        job = get_job(db, int(job_id))
+        if job is None:
+            return f"Задача #{int(job_id)} не найдена."
+        if job.status != "done":
+            return f"Задача #{job.id}: {job.status} ({job.progress}/{job.total}). {job.error or ''}"
+        res = job.result or {}
+        if "summary_md" in res:
+            return res["summary_md"]
+        return "```\n" + json.dumps(res, ensure_ascii=False, indent=2, default=str) + "\n```"
+    finally:
+        db.close()
+
+def build_app(
+    qa_concurrency: int | None = None,
+    summary_concurrency: int | None = None,
+    ingest_concurrency: int | None = None,
+    embed_concurrency: int | None = None,
+) -> gr.Blocks:
+    """
+    Лимиты одновременных запросов по типам обработчиков (по умолчанию — из Settings).
+    Синхронизация чатов и сбор сообщений делят одну очередь: оба работают с одним файлом сессии Telethon.
+    """
     setup_logging()
     init_db()
 
+    s = get_settings()
+    qa_concurrency = qa_concurrency or s.ui.qa_concurrency
+    summary_concurrency = summary_concurrency or s.ui.summary_concurrency
+    ingest_concurrency = ingest_concurrency or s.ui.ingest_concurrency
+    embed_concurrency = embed_concurrency or s.ui.embed_concurrency
+
     with gr.Blocks(title="Telegram Chat Analyzer") as demo:
         gr.Markdown("# Анализ чатов в Telegram\nОбновление чатов -> Сбор -> Эмбеддинги -> Summary -> Questions & Answering\n")
+        profile_on = gr.Checkbox(
+            label="Профилировать запуски (сбор, эмбеддинги, summary, QA, фоновые задачи): flamegraph и SQL в logs/profiles/",
+            value=False,
+        )
 
         with gr.Tab("Чаты"):
             btn_sync = gr.Button("Синхронизировать список чатов из Telegram")
             out_df = gr.Dataframe(interactive=False, wrap=True)
             out_msg = gr.Textbox(label="Статус", lines=3)
-            btn_sync.click(fn=_sync_chats_ui, inputs=[], outputs=[out_df, out_msg])
+            btn_sync.click(
+                fn=_sync_chats_ui, inputs=[], outputs=[out_df, out_msg],
+                concurrency_limit=ingest_concurrency, concurrency_id="telegram",
+            )
 
         with gr.Tab("Сбор данных"):
             gr.Markdown("Выбери чаты и период. Необходима синхронизация чатов на вкладке 'Чаты'.")
@@ -161,6 +329,7 @@ def build_app() -> gr.Blocks:
             btn_refresh = gr.Button("Обновить список чатов в выпадающем списке")
             btn_count = gr.Button("Посчитать сообщения за период (если данные есть в БД)")
             btn_ingest = gr.Button("Собрать сообщения из Telegram за период (Добавитьв БД)")
+            btn_ingest_job = gr.Button("Собрать в фоне (задача)")
 
             out_count = gr.Textbox(label="Кол-во", lines=2)
             out_ingest = gr.Textbox(label="Логи сбора", lines=12)
@@ -174,7 +343,11 @@ def build_app() -> gr.Blocks:
 
             btn_refresh.click(fn=_refresh_choices, inputs=[], outputs=[chat_sel])
             btn_count.click(fn=_count_ui, inputs=[chat_sel, date_from, date_to], outputs=[out_count])
-            btn_ingest.click(fn=_ingest_ui, inputs=[chat_sel, date_from, date_to], outputs=[out_ingest])
+            btn_ingest.click(
+                fn=_ingest_ui, inputs=[chat_sel, date_from, date_to, profile_on], outputs=[out_ingest],
+                concurrency_limit=ingest_concurrency, concurrency_id="telegram",
+            )
+            btn_ingest_job.click(fn=partial(_submit_job_ui, "ingest"), inputs=[chat_sel, date_from, date_to, profile_on], outputs=[out_ingest])
 
         with gr.Tab("Эмбеддинги"):
             gr.Markdown("Построение эмбеддингов, чтобы работал поиск и Question Answering (QA).")
@@ -184,10 +357,15 @@ def build_app() -> gr.Blocks:
                 date_to_e = gr.Textbox(label="Дата конца (YYYY-MM-DD)", value="2025-12-24")
             btn_refresh_e = gr.Button("Обновить список чатов")
             btn_embed = gr.Button("Построить эмбеддинги")
+            btn_embed_job = gr.Button("Построить в фоне (задача)")
             out_embed = gr.Textbox(label="Статус", lines=4)
 
             btn_refresh_e.click(fn=_refresh_choices, inputs=[], outputs=[chat_sel_e])
-            btn_embed.click(fn=_embed_ui, inputs=[chat_sel_e, date_from_e, date_to_e], outputs=[out_embed])
+            btn_embed.click(
+                fn=_embed_ui, inputs=[chat_sel_e, date_from_e, date_to_e, profile_on], outputs=[out_embed],
+                concurrency_limit=embed_concurrency,
+            )
+            btn_embed_job.click(fn=partial(_submit_job_ui, "embed"), inputs=[chat_sel_e, date_from_e, date_to_e, profile_on], outputs=[out_embed])
 
         with gr.Tab("Summary"):
             gr.Markdown("Саммаризация с ссылками на message_id.")
@@ -195,14 +373,27 @@ def build_app() -> gr.Blocks:
                 chat_sel_s = gr.Dropdown(choices=[], multiselect=True, label="Чаты")
                 date_from_s = gr.Textbox(label="Дата начала (YYYY-MM-DD)", value="2025-12-01")
                 date_to_s = gr.Textbox(label="Дата конца (YYYY-MM-DD)", value="2025-12-24")
+            incremental_s = gr.Checkbox(
+                label="Инкрементально: взять сохранённую сводку за часть периода и обработать только новые сообщения",
+                value=True,
+            )
+            by_days_s = gr.Checkbox(
+                label="Из дневных сводок: посуточные сводки по каждому чату строятся один раз и объединяются для любого периода",
+                value=False,
+            )
             btn_refresh_s = gr.Button("Обновить список чатов")
             btn_sum = gr.Button("Summarization")
+            btn_sum_job = gr.Button("Summarization в фоне (задача)")
 
             out_md = gr.Markdown()
             out_json = gr.Textbox(label="Summary (JSON file)", lines=18)
 
             btn_refresh_s.click(fn=_refresh_choices, inputs=[], outputs=[chat_sel_s])
-            btn_sum.click(fn=_summary_ui, inputs=[chat_sel_s, date_from_s, date_to_s], outputs=[out_md, out_json])
+            btn_sum.click(
+                fn=_summary_ui, inputs=[chat_sel_s, date_from_s, date_to_s, profile_on, incremental_s, by_days_s], outputs=[out_md, out_json],
+                concurrency_limit=summary_concurrency,
+            )
+            btn_sum_job.click(fn=partial(_submit_job_ui, "summary"), inputs=[chat_sel_s, date_from_s, date_to_s, profile_on, incremental_s, by_days_s], outputs=[out_md])
 
         with gr.Tab("Вопросы"):
             gr.Markdown("Блок 'Вопрос - Ответ'.")
@@ -217,6 +408,43 @@ def build_app() -> gr.Blocks:
             send = gr.Button("Отправить")
 
             btn_refresh_q.click(fn=_refresh_choices, inputs=[], outputs=[chat_sel_q])
-            send.click(fn=_qa_respond, inputs=[chat_sel_q, date_from_q, date_to_q, chatbot, question], outputs=[chatbot, question])
+            send.click(
+                fn=_qa_respond, inputs=[chat_sel_q, date_from_q, date_to_q, chatbot, question, profile_on], outputs=[chatbot, question],
+                concurrency_limit=qa_concurrency,
+            )
 
+        with gr.Tab("Активность"):
+            gr.Markdown("Посуточная статистика по чатам (из агрегатов `chat_daily_stats`, без сканирования сообщений).")
+            with gr.Row():
+                chat_sel_a = gr.Dropdown(choices=[], multiselect=True, label="Чаты")
+                date_from_a = gr.Textbox(label="Дата начала (YYYY-MM-DD)", value="2025-12-01")
+                date_to_a = gr.Textbox(label="Дата конца (YYYY-MM-DD)", value="2025-12-24")
+            btn_refresh_a = gr.Button("Обновить список чатов")
+            btn_activity = gr.Button("Показать активность")
+            out_activity_info = gr.Markdown()
+            activity_plot = gr.LinePlot(x="day", y="messages", color="chat", title="Сообщений в день")
+            activity_df = gr.Dataframe(interactive=False, wrap=True)
+
+            btn_refresh_a.click(fn=_refresh_choices, inputs=[], outputs=[chat_sel_a])
+            btn_activity.click(
+                fn=_activity_ui, inputs=[chat_sel_a, date_from_a, date_to_a],
+                outputs=[activity_df, activity_plot, out_activity_info],
+            )
+
+        with gr.Tab("Задачи"):
+            gr.Markdown("Фоновые задачи выполняет `python3 -m scripts.run_worker`. Таблица обновляется автоматически.")
+            jobs_df = gr.Dataframe(interactive=False, wrap=True)
+            with gr.Row():
+                job_id = gr.Number(label="id задачи", precision=0)
+                btn_job_result = gr.Button("Показать результат")
+                btn_job_cancel = gr.Button("Отменить")
+            out_job = gr.Markdown()
+
+            jobs_timer = gr.Timer(5)
+            jobs_timer.tick(fn=_jobs_ui, inputs=[], outputs=[jobs_df])
+            demo.load(fn=_jobs_ui, inputs=[], outputs=[jobs_df])
+            btn_job_result.click(fn=_job_result_ui, inputs=[job_id], outputs=[out_job])
+            btn_job_cancel.click(fn=_cancel_job_ui, inputs=[job_id], outputs=[out_job])
+
+    demo.queue(max_size=s.ui.max_queue_size, default_concurrency_limit=qa_concurrency)
     return demo
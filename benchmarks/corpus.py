@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+# Словарь синтетических «рабочих» сообщений: темы дают эмбеддингам и QA осмысленные кластеры
+_TOPICS = {
+    "релиз": ["релиз", "сборка", "деплой", "откат", "прод", "стейджинг", "версия", "changelog"],
+    "база": ["postgres", "индекс", "миграция", "запрос", "реплика", "вакуум", "секция", "бэкап"],
+    "бюджет": ["бюджет", "счёт", "оплата", "квартал", "договор", "смета", "лимит", "закупка"],
+    "найм": ["кандидат", "собеседование", "оффер", "вакансия", "резюме", "тестовое", "онбординг"],
+    "инцидент": ["алерт", "таймаут", "ошибка", "латентность", "дежурство", "постмортем", "рестарт"],
+}
+_FILLER = ["надо", "сегодня", "завтра", "кто", "берёт", "посмотрю", "уже", "готово", "после", "обеда", "ок", "согласен"]
+_OPENERS = ["Коллеги,", "Напоминаю:", "Вопрос:", "Кстати,", "Итого:", ""]
+
+QUESTIONS = [
+    "Что решили по релизу?",
+    "Какие проблемы были с базой данных?",
+    "Кто отвечает за бюджет в этом квартале?",
+    "Сколько кандидатов прошло собеседование?",
+    "Что случилось во время последнего инцидента?",
+]
+
+@dataclass(frozen=True)
+class CorpusSpec:
+    chats: int = 3
+    messages_per_chat: int = 2000
+    senders_per_chat: int = 8
+    # длина сообщения в словах: логнормальное распределение (много коротких, хвост длинных)
+    mean_words: int = 14
+    max_words: int = 300
+    # доля точных повторов (пересылки, «+1») и пустых сообщений (стикеры, медиа без подписи)
+    duplicate_ratio: float = 0.05
+    empty_ratio: float = 0.03
+    reply_ratio: float = 0.2
+    days: int = 14
+    seed: int = 42
+
+@dataclass
+class FakeMessage:
+    id: int
+    date: datetime
+    message: str
+    sender_id: int
+    sender_name: str
+    reply_to_msg_id: int | None
+
+def _sentence(rng: random.Random, spec: CorpusSpec) -> str:
+    words = max(1, min(spec.max_words, int(rng.lognormvariate(0, 0.8) * spec.mean_words / 1.4)))
+    vocab = _TOPICS[rng.choice(list(_TOPICS))]
+    out = [rng.choice(_OPENERS)]
+    for _ in range(words):
+        out.append(rng.choice(vocab) if rng.random() < 0.4 else rng.choice(_FILLER))
+    return " ".join(w for w in out if w)
+
+def generate_chat(spec: CorpusSpec, chat_no: int, end: datetime | None = None) -> list[FakeMessage]:
+    """Сообщения одного чата в порядке времени за последние spec.days дней до end. Детерминировано по seed и chat_no."""
+    rng = random.Random(spec.seed * 1000 + chat_no)
+    end = end or datetime.now(timezone.utc).replace(microsecond=0)
+    start = end - timedelta(days=spec.days)
+    step = (end - start).total_seconds() / max(spec.messages_per_chat, 1)
+
+    senders = [(chat_no * 1000 + i, f"user{chat_no}_{i}") for i in range(spec.senders_per_chat)]
+    msgs: list[FakeMessage] = []
+    t = start
+    for i in range(1, spec.messages_per_chat + 1):
+        t += timedelta(seconds=rng.expovariate(1 / step))
+        sender_id, sender_name = rng.choice(senders)
+        r = rng.random()
+        if r < spec.empty_ratio:
+            text = ""
+        elif r < spec.empty_ratio + spec.duplicate_ratio and msgs:
+            text = rng.choice(msgs[-50:]).message
+        else:
+            text = _sentence(rng, spec)
+        reply_to = rng.randint(max(1, i - 30), i - 1) if i > 1 and rng.random() < spec.reply_ratio else None
+        msgs.append(FakeMessage(id=i, date=min(t, end), message=text, sender_id=sender_id, sender_name=sender_name, reply_to_msg_id=reply_to))
+    return msgs
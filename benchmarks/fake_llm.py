@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+_MSG_ID_RE = re.compile(r'"tg_msg_id":\[?(\d+)')
+
+class FakeLLMConfig:
+    def __init__(self, latency_ms: float = 300.0, tokens_per_second: float = 200.0, stream_chunk_chars: int = 16):
+        # latency_ms — время до первого токена, tokens_per_second — скорость генерации (≈4 символа на токен)
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.stream_chunk_chars = stream_chunk_chars
+
+def _summary_json(user: str) -> str:
+    refs = [int(x) for x in _MSG_ID_RE.findall(user)][:5]
+    return json.dumps({
+        "decisions": [{"text": "Релиз переносится на следующую неделю", "who": "user0_1", "message_refs": refs[:2]}],
+        "risks": [{"text": "Миграция индекса может заблокировать запись", "severity": "medium", "status": "open", "message_refs": refs[2:3]}],
+        "open_questions": [{"text": "Кто дежурит в выходные?", "message_refs": refs[3:4]}],
+        "action_items": [{"task": "Подготовить смету", "owner": "user1_2", "status": "todo", "message_refs": refs[4:5]}],
+        "notable_facts": [],
+        "topics": [{"topic": "релиз", "summary": "Обсуждали сроки и откат", "message_refs": refs}],
+    }, ensure_ascii=False)
+
+def _answer(user: str) -> str:
+    return "По данным чата: " + " ".join(["решили", "перенести", "релиз", "и", "проверить", "миграцию", "базы."] * 6)
+
+class _Handler(BaseHTTPRequestHandler):
+    config: FakeLLMConfig
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        messages = body.get("messages") or []
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        wants_json = body.get("response_format", {}).get("type") == "json_object" or "JSON" in system
+        content = _summary_json(user) if wants_json else _answer(user)
+        prompt_tokens = (len(system) + len(user)) // 4
+        completion_tokens = max(1, len(content) // 4)
+        model = body.get("model", "fake")
+
+        time.sleep(self.config.latency_ms / 1000)
+        if body.get("stream"):
+            self._stream(content, model, prompt_tokens, completion_tokens)
+            return
+        time.sleep(completion_tokens / self.config.tokens_per_second)
+        self._send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _stream(self, content: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        cid = f"chatcmpl-{uuid.uuid4().hex}"
+        step = self.config.stream_chunk_chars
+        delay = step / 4 / self.config.tokens_per_second
+
+        def send(choices: list, usage: dict | None = None) -> None:
+            chunk = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i in range(0, len(content), step):
+            send([{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}])
+            time.sleep(delay)
+        send(
+            [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        )
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+def start_server(config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    OpenAI-совместимый /v1/chat/completions с заданной задержкой (обычный и stream-ответ).
+    На JSON-запросы (map/reduce/repair) отвечает валидным SummaryJSON, на остальные — текстом. port=0 — свободный порт.
+    """
+    handler = type("FakeLLMHandler", (_Handler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    logger.info("Fake LLM server: http://%s:%d/v1", host, server.server_port)
+    return server
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого LLM-сервера для бенчмарков и ручных проверок")
+    p.add_argument("--port", type=int, default=8089)
+    p.add_argument("--latency-ms", type=float, default=300.0)
+    p.add_argument("--tokens-per-second", type=float, default=200.0)
+    args = p.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    srv = start_server(FakeLLMConfig(args.latency_ms, args.tokens_per_second), port=args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
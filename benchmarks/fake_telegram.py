@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from datetime import datetime
+from types import SimpleNamespace
+
+from benchmarks.corpus import FakeMessage
+
+class _TLMessage:
+    """Минимум интерфейса telethon Message, который читает app.telegram_client._fetch_messages."""
+
+    def __init__(self, m: FakeMessage):
+        self._m = m
+        self.id = m.id
+        self.date = m.date
+        self.message = m.message
+        self.reply_to = SimpleNamespace(reply_to_msg_id=m.reply_to_msg_id) if m.reply_to_msg_id else None
+
+    async def get_sender(self):
+        return SimpleNamespace(id=self._m.sender_id, username=None, first_name=self._m.sender_name, last_name="")
+
+    def to_dict(self) -> dict:
+        return {"_": "Message", "id": self.id, "date": self.date, "message": self.message, "from_id": self._m.sender_id}
+
+class FakeTelegramClient:
+    """
+    Заглушка подключённого TelegramClient поверх синтетического корпуса: передаётся в
+    app.telegram_client.fetch_messages(client=...), поэтому сетевой слой не нужен, а разбор сообщений — настоящий.
+    """
+
+    def __init__(self, chats: dict[int, list[FakeMessage]]):
+        self._chats = chats
+
+    async def get_entity(self, peer_id: int):
+        if peer_id not in self._chats:
+            raise ValueError(f"Unknown peer_id: {peer_id}")
+        return SimpleNamespace(id=peer_id)
+
+    async def iter_messages(self, entity, offset_date: datetime | None = None, reverse: bool = False):
+        msgs = self._chats[entity.id]
+        if not reverse:
+            msgs = list(reversed(msgs))
+        for m in msgs:
+            if offset_date is not None and reverse and m.date < offset_date:
+                continue
+            yield _TLMessage(m)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Модули, которые не должны загружаться при импорте UI: их подгружает первый запрос или фоновый warm-up
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "telethon", "openai")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.ui
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_seconds": elapsed, "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+def measure(runs: int) -> dict:
+    """Время импорта app.ui в чистом интерпретаторе (минимум из runs запусков) и список тяжёлых модулей."""
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE % (HEAVY_MODULES,)],
+            check=True, capture_output=True, text=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "import_seconds": min(r["import_seconds"] for r in results),
+        "heavy": sorted({m for r in results for m in r["heavy"]}),
+    }
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Проверка времени старта UI: импорт app.ui без тяжёлых зависимостей")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--max-seconds", type=float, default=5.0, help="порог времени импорта app.ui")
+    args = p.parse_args()
+
+    res = measure(args.runs)
+    print(json.dumps(res, ensure_ascii=False))
+    failed = False
+    if res["heavy"]:
+        print(f"FAIL: при импорте app.ui загружены {', '.join(res['heavy'])}")
+        failed = True
+    if res["import_seconds"] > args.max_seconds:
+        print(f"FAIL: импорт app.ui занял {res['import_seconds']:.2f}s > {args.max_seconds:.2f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
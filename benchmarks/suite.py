@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+from collections.abc import Callable
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks.corpus import QUESTIONS, CorpusSpec, generate_chat
+from benchmarks.fake_llm import FakeLLMConfig, start_server
+from benchmarks.fake_telegram import FakeTelegramClient
+
+logger = logging.getLogger("benchmarks")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Синтетические чаты заводятся с такими tg_peer_id и удаляются перед каждым прогоном (каскадно с сообщениями)
+_PEER_BASE = 9_100_000_000_000
+
+class _HashEncoder:
+    """
+    Детерминированная замена SentenceTransformer для работы без модели и сети: bag-of-words,
+    слова хэшируются в dim измерений. Сообщения на одну тему оказываются близки, как и у настоящей модели.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def encode(self, texts: list[str], normalize_embeddings: bool = True, show_progress_bar: bool = False):
+        import numpy as np
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for w in t.lower().split():
+                out[i, zlib.crc32(w.encode("utf-8")) % self.dim] += 1.0
+            out[i, 0] += 1e-3
+        if normalize_embeddings:
+            out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out
+
+def _stats(samples: list[float], items: int) -> dict:
+    """samples — длительности вызовов (секунды), items — сколько объектов обработано за все вызовы."""
+    if not samples:
+        return {"calls": 0}
+    s = sorted(samples)
+
+    def pct(p: float) -> float:
+        return s[min(len(s) - 1, max(0, round(p / 100 * len(s)) - 1))] * 1000
+
+    total = sum(s)
+    return {
+        "calls": len(s),
+        "items": items,
+        "seconds_total": round(total, 4),
+        "throughput_per_s": round(items / total, 2) if total > 0 else None,
+        "p50_ms": round(pct(50), 2),
+        "p95_ms": round(pct(95), 2),
+        "max_ms": round(s[-1] * 1000, 2),
+    }
+
+def _timed(samples: list[float], fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    res = fn(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return res
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _configure_env(llm_url: str) -> None:
+    # до первого get_settings(): LLM — заглушка, кэш ответов выключен (иначе меряем SQLite, а не пайплайн)
+    os.environ["OPENAI_BASE_URL"] = llm_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["CHAT_MODEL"] = "bench-model"
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ.setdefault("TRACE_FILE", "")
+    os.environ.setdefault("EMBEDDING_WARM_UP", "0")
+
+def _reset_bench_chats(db, chats: int) -> list[int]:
+    from sqlalchemy import delete, select
+
+    from app.models import Chat, Summary
+    from app.repo import upsert_chats
+
+    peers = [_PEER_BASE + i for i in range(chats)]
+    old_ids = db.execute(select(Chat.id).where(Chat.tg_peer_id >= _PEER_BASE)).scalars().all()
+    if old_ids:
+        old = {str(x) for x in old_ids}
+        stale = [sid for sid, key in db.execute(select(Summary.id, Summary.chat_ids_key)) if old & set(key.split(","))]
+        db.execute(delete(Summary).where(Summary.id.in_(stale)))
+        db.execute(delete(Chat).where(Chat.id.in_(old_ids)))
+        db.commit()
+    now = datetime.now(timezone.utc)
+    upsert_chats(db, [
+        {"tg_peer_id": p, "title": f"bench-{i}", "username": None, "chat_type": "group", "updated_at": now}
+        for i, p in enumerate(peers)
+    ])
+    return list(db.execute(select(Chat.id).where(Chat.tg_peer_id.in_(peers)).order_by(Chat.tg_peer_id)).scalars().all())
+
+def run(args: argparse.Namespace) -> dict:
+    spec = CorpusSpec(
+        chats=args.chats, messages_per_chat=args.messages, senders_per_chat=args.senders,
+        mean_words=args.mean_words, duplicate_ratio=args.duplicates, days=args.days, seed=args.seed,
+    )
+    llm_config = FakeLLMConfig(args.llm_latency_ms, args.llm_tokens_per_second)
+    server = start_server(llm_config)
+    _configure_env(f"http://127.0.0.1:{server.server_port}/v1")
+
+    from app import embeddings, metrics
+    from app.build_embeddings import build_embeddings_for_period
+    from app.config import get_settings
+    from app.db import SessionLocal
+    from app.migrate import init_db
+    from app.qa import answer_question, retrieve_top_messages
+    from app.repo import insert_messages
+    from app.stats import embedded_counts
+    from app.summarization import generate_summary
+    from app.telegram_client import fetch_messages
+
+    if args.embedder == "hash":
+        encoder = _HashEncoder(get_settings().embeddings.dim)
+        embeddings._model = lambda: encoder
+
+    init_db()
+    end = datetime.now(timezone.utc).replace(microsecond=0)
+    date_from, date_to = end - timedelta(days=spec.days, hours=1), end
+    corpus = {_PEER_BASE + i: generate_chat(spec, i, end) for i in range(spec.chats)}
+    client = FakeTelegramClient(corpus)
+
+    samples: dict[str, list[float]] = {k: [] for k in (
+        "fetch_messages", "insert_messages", "build_embeddings_for_period",
+        "retrieve_top_messages", "retrieve_top_messages_filtered", "generate_summary", "answer_question",
+    )}
+    items: dict[str, int] = dict.fromkeys(samples, 0)
+
+    db = SessionLocal()
+    try:
+        chat_ids = _reset_bench_chats(db, spec.chats)
+
+        logger.info("Ingest: %d chats x %d messages", spec.chats, spec.messages_per_chat)
+        for peer, cid in zip(corpus, chat_ids):
+            msgs = _timed(samples["fetch_messages"], asyncio.run, fetch_messages(peer, date_from, date_to, client=client))
+            items["fetch_messages"] += len(msgs)
+            for i in range(0, len(msgs), args.insert_batch):
+                batch = msgs[i:i + args.insert_batch]
+                _timed(samples["insert_messages"], insert_messages, db, cid, batch)
+                items["insert_messages"] += len(batch)
+
+        logger.info("Embeddings (%s)", args.embedder)
+        if args.embedder == "model":
+            embeddings.embed_texts(["warm-up"])  # загрузка модели не входит в замер
+        for cid in chat_ids:
+            res = _timed(samples["build_embeddings_for_period"], build_embeddings_for_period, db, [cid], date_from, date_to)
+            items["build_embeddings_for_period"] += res["embedded"]
+
+        logger.info("Retrieval: %d queries", args.queries)
+        for i in range(args.queries):
+            rows = _timed(
+                samples["retrieve_top_messages"], retrieve_top_messages,
+                db, chat_ids, date_from, date_to, QUESTIONS[i % len(QUESTIONS)], top_k=30, fresh=True,
+            )
+            items["retrieve_top_messages"] += len(rows)
+
+        # узкий фильтр (один чат, одни сутки): HNSW без поправки ef_search отдавал здесь меньше top_k строк
+        day_from = (end - timedelta(days=2)).replace(hour=0, minute=0, second=0)
+        day_to = day_from + timedelta(days=1) - timedelta(microseconds=1)
+        short_results = 0
+        for i in range(args.queries):
+            cid = chat_ids[i % len(chat_ids)]
+            rows = _timed(
+                samples["retrieve_top_messages_filtered"], retrieve_top_messages,
+                db, [cid], day_from, day_to, QUESTIONS[i % len(QUESTIONS)], top_k=30, fresh=True,
+            )
+            items["retrieve_top_messages_filtered"] += len(rows)
+            if len(rows) < min(30, embedded_counts(db, [cid], day_from, day_to, fresh=True)[0]):
+                short_results += 1
+        if short_results:
+            logger.error("Filtered retrieval returned fewer than top_k rows in %d of %d queries", short_results, args.queries)
+
+        logger.info("QA: %d questions", args.qa_runs)
+        for i in range(args.qa_runs):
+            _timed(samples["answer_question"], answer_question, db, chat_ids, date_from, date_to, QUESTIONS[i % len(QUESTIONS)])
+            items["answer_question"] += 1
+
+        logger.info("Summary: %d runs", args.summary_runs)
+        for _ in range(args.summary_runs):
+            _timed(samples["generate_summary"], generate_summary, db, chat_ids, date_from, date_to)
+            items["generate_summary"] += spec.chats * spec.messages_per_chat
+    finally:
+        db.close()
+        server.shutdown()
+
+    return {
+        "meta": {
+            "started_at": end.isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedder": args.embedder,
+            "insert_batch": args.insert_batch,
+            "corpus": asdict(spec),
+            "llm": vars(llm_config),
+        },
+        "results": {name: _stats(s, items[name]) for name, s in samples.items()},
+        "checks": {"filtered_retrieval_short_results": short_results},
+        "metrics": metrics.snapshot(),
+    }
+
+def compare(current: dict, baseline: dict) -> str:
+    """Таблица изменений p50/p95/пропускной способности относительно прошлого прогона."""
+    lines = [f"{'operation':<30} {'p50 ms':>18} {'p95 ms':>18} {'items/s':>18}"]
+
+    def cell(cur, base) -> str:
+        if cur is None or not base:
+            return f"{cur if cur is not None else '-':>18}"
+        return f"{cur:>9} ({(cur - base) / base:+6.1%})"
+
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name, {})
+        lines.append(
+            f"{name:<30} {cell(cur.get('p50_ms'), base.get('p50_ms'))} {cell(cur.get('p95_ms'), base.get('p95_ms'))} "
+            f"{cell(cur.get('throughput_per_s'), base.get('throughput_per_s'))}"
+        )
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(
+        description="Офлайн-бенчмарк пайплайна (сбор, эмбеддинги, поиск, summary, QA) на синтетическом корпусе "
+                    "с заглушками Telegram и LLM. Нужна только БД из docker-compose."
+    )
+    p.add_argument("--chats", type=int, default=3)
+    p.add_argument("--messages", type=int, default=2000, help="сообщений на чат")
+    p.add_argument("--senders", type=int, default=8, help="участников на чат")
+    p.add_argument("--mean-words", type=int, default=14, help="средняя длина сообщения в словах")
+    p.add_argument("--duplicates", type=float, default=0.05, help="доля повторяющихся сообщений")
+    p.add_argument("--days", type=int, default=14, help="за сколько дней генерировать сообщения")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--insert-batch", type=int, default=500, help="сообщений на вызов insert_messages")
+    p.add_argument("--queries", type=int, default=50, help="запросов retrieve_top_messages")
+    p.add_argument("--qa-runs", type=int, default=10)
+    p.add_argument("--summary-runs", type=int, default=3)
+    p.add_argument("--llm-latency-ms", type=float, default=300.0, help="задержка заглушки LLM до первого токена")
+    p.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    p.add_argument(
+        "--embedder", choices=("hash", "model"), default="hash",
+        help="hash — детерминированные эмбеддинги без модели (офлайн), model — настоящая EMBEDDING_MODEL_NAME",
+    )
+    p.add_argument("--out", type=Path, default=None, help="файл результата (по умолчанию benchmarks/results/<время>.json)")
+    p.add_argument("--compare", type=Path, default=None, help="JSON прошлого прогона для сравнения")
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # подробные логи пайплайна (каждый чанк/батч) искажают замеры
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    result = run(args)
+    out = args.out or RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    for name, r in result["results"].items():
+        print(f"{name:<30} {json.dumps(r)}")
+    print(f"Saved: {out}")
+    if args.compare is not None:
+        print(compare(result, json.loads(args.compare.read_text(encoding="utf-8"))))
+    if result["checks"]["filtered_retrieval_short_results"]:
+        sys.exit(1)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from app.config import get_settings
+from app.logging_setup import setup_logging
+from app.onnx_embeddings import FP32_FILE, INT8_FILE, PARITY_TEXTS, export_model, model_dir, parity_check
+
+if __name__ == "__main__":
+    s = get_settings()
+    p = argparse.ArgumentParser(
+        description="Экспорт модели эмбеддингов в ONNX (и int8) для EMBEDDING_BACKEND=onnx со сверкой векторов с torch-моделью"
+    )
+    p.add_argument("--model", default=s.embeddings.model_name, help="по умолчанию EMBEDDING_MODEL_NAME")
+    p.add_argument("--out", type=Path, default=None, help="по умолчанию EMBEDDING_ONNX_DIR/<модель>")
+    p.add_argument("--no-int8", action="store_true", help="не квантовать в int8")
+    p.add_argument("--check-only", action="store_true", help="только сверить уже экспортированные модели")
+    p.add_argument("--texts", type=Path, default=None, help="файл с текстами для сверки, по строке на текст")
+    p.add_argument("--min-cosine", type=float, default=0.98, help="минимальная допустимая косинусная близость к torch")
+    args = p.parse_args()
+
+    setup_logging()
+    out = args.out or model_dir(args.model)
+    if args.check_only:
+        paths = [f for f in (out / FP32_FILE, out / INT8_FILE) if f.exists()]
+        if not paths:
+            sys.exit(f"В {out} нет экспортированных моделей")
+    else:
+        paths = export_model(args.model, out, int8=not args.no_int8)
+
+    texts = PARITY_TEXTS
+    if args.texts is not None:
+        texts = [t for t in args.texts.read_text(encoding="utf-8").splitlines() if t.strip()]
+
+    failed = False
+    for path in paths:
+        lo, mean = parity_check(args.model, path, texts)
+        ok = lo >= args.min_cosine
+        failed |= not ok
+        print(f"{path}: cosine min={lo:.4f} mean={mean:.4f} {'OK' if ok else 'НИЖЕ ПОРОГА'}")
+    sys.exit(1 if failed else 0)
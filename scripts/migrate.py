@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import argparse
+
+from app.db import get_engine
+from app.logging_setup import setup_logging
+from app.migrate import MIGRATIONS, applied_versions, init_db, run_migrations
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Миграции схемы БД")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="список миграций и их статус")
+    p_up = sub.add_parser("up", help="применить непримененные миграции")
+    p_up.add_argument("--to", type=int, default=None, help="до версии включительно")
+    args = p.parse_args()
+
+    setup_logging()
+    if args.cmd == "status":
+        with get_engine().connect() as conn:
+            applied = applied_versions(conn)
+            conn.commit()
+        for m in MIGRATIONS:
+            mark = "x" if m.version in applied else " "
+            print(f"[{mark}] {m.version:04d} {m.name}")
+    else:
+        init_db(migrate=False)
+        done = run_migrations(target=args.to)
+        print(f"Применено: {done or 'нечего применять'}")
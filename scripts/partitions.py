@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import argparse
+from datetime import datetime, timezone
+
+from app.config import get_settings
+from app.db import SessionLocal, get_engine
+from app.logging_setup import setup_logging
+from app.partitions import add_months, detach_month, ensure_partitions, list_partitions, month_start, months_between, pruning_report
+
+def _month(s: str):
+    return month_start(datetime.strptime(s, "%Y-%m"))
+
+def _day(s: str, end: bool = False) -> datetime:
+    dt = datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+    return dt.replace(hour=23, minute=59, second=59) if end else dt
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Управление месячными секциями messages/embeddings")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    p_ensure = sub.add_parser("ensure", help="создать секции с FROM по текущий месяц + --ahead")
+    p_ensure.add_argument("--from", dest="from_month", type=_month, default=None, help="YYYY-MM")
+    p_ensure.add_argument("--ahead", type=int, default=None)
+
+    sub.add_parser("list", help="показать секции")
+
+    p_detach = sub.add_parser("detach", help="отсоединить месяц (данные остаются в отдельных таблицах)")
+    p_detach.add_argument("month", type=_month, help="YYYY-MM")
+
+    p_check = sub.add_parser("check", help="какие секции читает каждый запрос репозитория за период")
+    p_check.add_argument("--chat-ids", type=int, nargs="+", required=True)
+    p_check.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD")
+    p_check.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD")
+
+    args = p.parse_args()
+    setup_logging()
+    s = get_settings()
+
+    if args.cmd == "ensure":
+        this_month = month_start(datetime.now(timezone.utc))
+        last = add_months(this_month, s.db.partition_months_ahead if args.ahead is None else args.ahead)
+        with get_engine().begin() as conn:
+            n = ensure_partitions(conn, months_between(args.from_month or this_month, last))
+        print(f"Новых месяцев: {n}")
+
+    elif args.cmd == "list":
+        with get_engine().connect() as conn:
+            for table in ("messages", "embeddings"):
+                print(f"{table}: {', '.join(list_partitions(conn, table))}")
+
+    elif args.cmd == "detach":
+        with get_engine().begin() as conn:
+            detach_month(conn, args.month)
+        print(f"Месяц {args.month:%Y-%m} отсоединён.")
+
+    elif args.cmd == "check":
+        db = SessionLocal()
+        try:
+            report = pruning_report(db, args.chat_ids, _day(args.date_from), _day(args.date_to, end=True), s.embeddings.dim)
+        finally:
+            db.close()
+        expected = set(months_between(_day(args.date_from), _day(args.date_to)))
+        for name, rels in report.items():
+            parts = [r for r in rels if r.startswith(("messages_", "embeddings_"))]
+            print(f"{name}: {', '.join(parts) or '-'}")
+        print(f"Ожидаемые месяцы: {', '.join(m.strftime('%Y-%m') for m in sorted(expected))}")
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+
+from app.config import get_settings
+from app.logging_setup import setup_logging
+from app.metrics import start_http_server
+from app.migrate import init_db
+from app.sync_daemon import run_sync_daemon
+
+if __name__ == "__main__":
+    s = get_settings()
+    p = argparse.ArgumentParser(description="Непрерывная синхронизация выбранных чатов (сбор + эмбеддинги)")
+    p.add_argument("--chat-ids", type=int, nargs="*", default=list(s.sync.chat_ids), help="id чатов из таблицы chats (SYNC_CHAT_IDS)")
+    p.add_argument("--interval", type=int, default=s.sync.interval_seconds, help="пауза между опросами, сек")
+    p.add_argument("--initial-lookback-days", type=int, default=s.sync.initial_lookback_days, help="глубина первой загрузки для пустого чата")
+    p.add_argument("--embed-batch-size", type=int, default=s.sync.embed_batch_size)
+    p.add_argument("--metrics-port", type=int, default=s.observability.metrics_port, help="порт /metrics (0 — выкл.)")
+    args = p.parse_args()
+
+    setup_logging()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    init_db()
+    asyncio.run(run_sync_daemon(args.chat_ids, args.interval, args.initial_lookback_days, args.embed_batch_size))
@@ -1,7 +1,36 @@
 from __future__ import annotations
 
+import argparse
+
+from app.config import get_settings
+from app.metrics import start_http_server
+from app.embeddings import start_warm_up
 from app.ui import build_app
 
+def _parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Telegram Chat Analyzer UI")
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=7860)
+    p.add_argument("--qa-concurrency", type=int, default=None, help="одновременных QA-запросов (UI_QA_CONCURRENCY)")
+    p.add_argument("--summary-concurrency", type=int, default=None, help="одновременных саммаризаций (UI_SUMMARY_CONCURRENCY)")
+    p.add_argument("--ingest-concurrency", type=int, default=None, help="одновременных сборов из Telegram (UI_INGEST_CONCURRENCY)")
+    p.add_argument("--embed-concurrency", type=int, default=None, help="одновременных построений эмбеддингов (UI_EMBED_CONCURRENCY)")
+    p.add_argument("--metrics-port", type=int, default=None, help="порт /metrics для Prometheus (METRICS_PORT, 0 — выкл.)")
+    return p.parse_args()
+
 if __name__ == "__main__":
-    app = build_app()
-    app.launch(server_name="0.0.0.0", server_port=7860)
+    args = _parse_args()
+    metrics_port = get_settings().observability.metrics_port if args.metrics_port is None else args.metrics_port
+    if metrics_port:
+        start_http_server(metrics_port)
+    app = build_app(
+        qa_concurrency=args.qa_concurrency,
+        summary_concurrency=args.summary_concurrency,
+        ingest_concurrency=args.ingest_concurrency,
+        embed_concurrency=args.embed_concurrency,
+    )
+    app.launch(server_name=args.host, server_port=args.port, prevent_thread_lock=True)
+    # сервер уже принимает запросы; модель эмбеддингов грузится в фоне
+    if get_settings().embeddings.warm_up:
+        start_warm_up()
+    app.block_thread()
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import argparse
+
+from app.config import get_settings
+from app.jobs import run_worker
+from app.metrics import start_http_server
+from app.logging_setup import setup_logging
+from app.migrate import init_db
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Фоновый обработчик задач (сбор, эмбеддинги, summary)")
+    p.add_argument("--poll-interval", type=float, default=2.0)
+    p.add_argument("--stale-after", type=int, default=600, help="через сколько секунд без heartbeat задача считается брошенной")
+    p.add_argument("--once", action="store_true", help="обработать очередь и выйти")
+    p.add_argument("--metrics-port", type=int, default=get_settings().observability.metrics_port, help="порт /metrics (0 — выкл.)")
+    args = p.parse_args()
+
+    setup_logging()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    init_db()
+    run_worker(poll_interval=args.poll_interval, stale_after_seconds=args.stale_after, once=args.once)
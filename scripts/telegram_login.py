@@ -16,15 +16,15 @@ async def main():
     setup_logging()
     s = get_settings()
 
-    client = TelegramClient(s.telethon_session_path, s.telegram_api_id, s.telegram_api_hash)
+    client = TelegramClient(s.telegram.session_path, s.telegram.api_id, s.telegram.api_hash)
     await client.connect()
 
     if not await client.is_user_authorized():
-        logger.info("Не авторизован. Отправляю код на телефон %s", s.telegram_phone)
-        await client.send_code_request(s.telegram_phone)
+        logger.info("Не авторизован. Отправляю код на телефон %s", s.telegram.phone)
+        await client.send_code_request(s.telegram.phone)
         code = input("Введи код из Telegram: ").strip()
         try:
-            await client.sign_in(s.telegram_phone, code)
+            await client.sign_in(s.telegram.phone, code)
         except SessionPasswordNeededError:
             pwd = getpass.getpass("Включена 2FA. Введи пароль: ")
             await client.sign_in(password=pwd)
@@ -0,0 +1,4 @@
+import os
+
+# Тесты не должны зависеть от локального .env: бюджеты считаются оценкой по символам, без HF-токенизатора
+os.environ["TOKENIZER_NAME"] = ""
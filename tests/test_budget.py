@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.budget import count_tokens, dedupe_near, merge_adjacent, pack, take_within_budget, truncate_to_tokens
+
+T0 = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _msg(tg_msg_id, text, seconds=0, sender_id=1, sender_name="Анна", chat_id=1):
+    return SimpleNamespace(
+        tg_msg_id=tg_msg_id, chat_id=chat_id, dt=T0 + timedelta(seconds=seconds),
+        sender_id=sender_id, sender_name=sender_name, text=text,
+    )
+
+
+def test_count_tokens_char_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("abc") == 1
+    assert count_tokens("abcd") == 2
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("abcdef", 2) == "abcdef"
+    assert truncate_to_tokens("abcdefg", 2) == "abcdef…"
+
+
+def test_pack_fills_chunk_exactly_to_budget():
+    assert pack([2, 3, 5, 1], lambda x: x, 5) == [[2, 3], [5], [1]]
+
+
+def test_pack_item_over_budget_gets_own_chunk():
+    assert pack([1, 10, 1], lambda x: x, 5) == [[1], [10], [1]]
+    assert pack([], lambda x: x, 5) == []
+
+
+def test_take_within_budget_boundary():
+    assert take_within_budget([2, 3, 1], lambda x: x, 5) == [2, 3]
+    assert take_within_budget([2, 3, 1], lambda x: x, 4) == [2]
+    # первый элемент берётся, даже если сам не укладывается
+    assert take_within_budget([10, 1], lambda x: x, 5) == [10]
+
+
+def test_merge_adjacent_short_messages_of_one_author():
+    out = merge_adjacent([_msg(1, "ок"), _msg(2, "да", 30), _msg(3, "завтра", 60)], short_tokens=5, max_gap_seconds=300)
+    assert len(out) == 1
+    assert out[0].tg_msg_ids == [1, 2, 3]
+    assert out[0].text == "ок / да / завтра"
+    assert out[0].dt == T0
+
+
+def test_merge_adjacent_splits_on_author_and_chat():
+    out = merge_adjacent(
+        [_msg(1, "ок"), _msg(2, "да", 10, sender_id=2, sender_name="Борис"), _msg(3, "ага", 20, sender_id=2, sender_name="Борис", chat_id=2)],
+        short_tokens=5, max_gap_seconds=300,
+    )
+    assert [m.tg_msg_ids for m in out] == [[1], [2], [3]]
+
+
+def test_merge_adjacent_time_gap_boundary():
+    # разрыв считается от последнего склеенного сообщения; ровно max_gap_seconds ещё склеивается
+    out = merge_adjacent([_msg(1, "ок"), _msg(2, "да", 300), _msg(3, "нет", 601)], short_tokens=5, max_gap_seconds=300)
+    assert [m.tg_msg_ids for m in out] == [[1, 2], [3]]
+
+
+def test_merge_adjacent_keeps_long_messages_apart():
+    long_text = "x" * 30  # 10 токенов
+    out = merge_adjacent([_msg(1, "ок"), _msg(2, long_text, 10)], short_tokens=5, max_gap_seconds=300)
+    assert [m.tg_msg_ids for m in out] == [[1], [2]]
+
+
+def test_merge_adjacent_group_limit():
+    # группа не больше 2 * short_tokens
+    out = merge_adjacent([_msg(i, "abcdef", i) for i in range(4)], short_tokens=2, max_gap_seconds=300)
+    assert [m.tg_msg_ids for m in out] == [[0, 1], [2, 3]]
+
+
+def test_dedupe_near_identical_and_reordered_words():
+    items = ["Релиз переносим на пятницу", "релиз ПЕРЕНОСИМ на пятницу!", "на пятницу переносим релиз", "другое"]
+    assert dedupe_near(items, lambda t: t, 0.85) == ["Релиз переносим на пятницу", "другое"]
+
+
+def test_dedupe_near_threshold_edges():
+    a, b = "a b c d", "a b c e"  # Jaccard = 3/5
+    assert dedupe_near([a, b], lambda t: t, 0.6) == [a]
+    assert dedupe_near([a, b], lambda t: t, 0.61) == [a, b]
+    assert dedupe_near([a, b], lambda t: t, 1.0) == [a, b]
+
+
+def test_dedupe_near_empty_text():
+    # пустые тексты одинаковы между собой, но не совпадают с непустыми
+    assert dedupe_near(["", "", "слово"], lambda t: t, 0.85) == ["", "слово"]
+    assert dedupe_near(["слово", "..."], lambda t: t, 0.85) == ["слово", "..."]
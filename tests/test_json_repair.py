@@ -0,0 +1,48 @@
+import pytest
+
+from app.json_repair import extract_json
+
+
+def test_valid_json_as_is():
+    assert extract_json('{"a": 1, "b": [1, 2]}') == {"a": 1, "b": [1, 2]}
+
+
+def test_fenced_json_with_text_around():
+    assert extract_json('Вот результат:\n```json\n{"a": 1}\n```\nГотово.') == {"a": 1}
+
+
+def test_unclosed_fence_and_truncated_array():
+    assert extract_json('```json\n{"a": [1, 2') == {"a": [1, 2]}
+
+
+def test_truncated_inside_string():
+    assert extract_json('{"decisions": [{"text": "Релиз перенос') == {"decisions": [{"text": "Релиз перенос"}]}
+
+
+def test_truncated_after_key():
+    assert extract_json('{"a": 1, "b":') == {"a": 1, "b": None}
+
+
+def test_trailing_commas():
+    assert extract_json('{"a": [1, 2,], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_single_quotes_and_python_literals():
+    assert extract_json("{'a': 'it\\'s', 'b': None, 'c': True, 'd': False}") == {"a": "it's", "b": None, "c": True, "d": False}
+
+
+def test_double_quote_inside_single_quoted_string():
+    assert extract_json("{'a': 'он сказал \"да\"'}") == {"a": 'он сказал "да"'}
+
+
+def test_missing_comma_between_items():
+    assert extract_json('{"a": [{"x": 1} {"x": 2}]}') == {"a": [{"x": 1}, {"x": 2}]}
+
+
+def test_comments_and_trailing_text():
+    assert extract_json('{"a": 1 // комментарий\n} и ещё текст') == {"a": 1}
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        extract_json("данных нет")
@@ -0,0 +1,33 @@
+from app import metrics
+
+# Состояние метрик глобальное для процесса — у каждого теста свои имена метрик
+
+
+def _lines(name):
+    return [line for line in metrics.render_prometheus().splitlines() if name in line]
+
+
+def test_counter_labels_are_sorted_and_quoted():
+    metrics.inc("test_render_counter_total", 2, stage="map", chat=7)
+    assert _lines("test_render_counter_total") == [
+        "# TYPE test_render_counter_total counter",
+        'test_render_counter_total{chat="7",stage="map"} 2.0',
+    ]
+
+
+def test_label_values_are_escaped():
+    metrics.inc("test_escape_total", error='say "hi"\\ok\nnext')
+    assert _lines("test_escape_total")[1] == 'test_escape_total{error="say \\"hi\\"\\\\ok\\nnext"} 1.0'
+
+
+def test_histogram_buckets_are_cumulative():
+    for v in (0.1, 0.7, 5.0):
+        metrics.observe("test_hist_seconds", v, buckets=(0.5, 1.0), op='a"b')
+    assert _lines("test_hist_seconds") == [
+        "# TYPE test_hist_seconds histogram",
+        'test_hist_seconds_bucket{op="a\\"b",le="0.5"} 1',
+        'test_hist_seconds_bucket{op="a\\"b",le="1.0"} 2',
+        'test_hist_seconds_bucket{op="a\\"b",le="+Inf"} 3',
+        'test_hist_seconds_sum{op="a\\"b"} 5.8',
+        'test_hist_seconds_count{op="a\\"b"} 3',
+    ]
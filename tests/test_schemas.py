@@ -0,0 +1,55 @@
+from app.schemas import SummaryJSON, coerce_summary
+
+
+def test_not_a_dict_gives_empty_summary():
+    for data in (None, [], "текст", 42):
+        out = coerce_summary(data)
+        assert out == SummaryJSON().model_dump()
+
+
+def test_missing_sections_default_to_empty_lists():
+    out = coerce_summary({"decisions": [{"text": "Переносим релиз"}]})
+    assert set(out) == set(SummaryJSON.model_fields)
+    assert out["risks"] == [] and out["topics"] == []
+    SummaryJSON.model_validate(out)
+
+
+def test_wrong_section_types():
+    out = coerce_summary({
+        "decisions": {"text": "одиночный объект вместо списка"},
+        "risks": "строка вместо списка",
+        "open_questions": ["Кто дежурит?", 42, None],
+    })
+    assert [d["text"] for d in out["decisions"]] == ["одиночный объект вместо списка"]
+    assert out["risks"] == []
+    assert [q["text"] for q in out["open_questions"]] == ["Кто дежурит?"]
+
+
+def test_items_without_title_are_dropped():
+    out = coerce_summary({"decisions": [{"text": ""}, {"text": "   "}, {"who": "Анна"}, {"text": 5}]})
+    assert out["decisions"] == []
+
+
+def test_unknown_enum_values_replaced_with_defaults():
+    out = coerce_summary({
+        "risks": [{"text": "Сбой", "severity": "Critical", "status": None}, {"text": "Ок", "severity": " HIGH "}],
+        "action_items": [{"task": "Смета", "status": "in progress"}],
+    })
+    assert [(r["severity"], r["status"]) for r in out["risks"]] == [("medium", "unknown"), ("high", "unknown")]
+    assert out["action_items"][0]["status"] == "unknown"
+    SummaryJSON.model_validate(out)
+
+
+def test_message_refs_and_optional_fields_coerced():
+    out = coerce_summary({
+        "decisions": [{"text": "Решение", "who": 123, "when": None, "message_refs": ["#12", 7, 3.0, True, "нет", None]}],
+        "notable_facts": [{"text": "Факт", "message_refs": "45", "snippets": "цитата"}],
+        "topics": [{"topic": "релиз", "summary": None}],
+    })
+    d = out["decisions"][0]
+    assert d["who"] == "123" and d["when"] is None
+    assert d["message_refs"] == [12, 7, 3]
+    assert out["notable_facts"][0]["message_refs"] == [45]
+    assert out["notable_facts"][0]["snippets"] == ["цитата"]
+    assert out["topics"][0]["summary"] == ""
+    SummaryJSON.model_validate(out)
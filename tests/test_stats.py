@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta, timezone
+
+from app.stats import full_days
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_full_days_exact_day_bounds():
+    assert full_days(_utc(2024, 1, 1), _utc(2024, 1, 3, 23, 59, 59)) == (date(2024, 1, 1), date(2024, 1, 3))
+
+
+def test_full_days_end_at_next_midnight_excludes_that_day():
+    assert full_days(_utc(2024, 1, 1), _utc(2024, 1, 4)) == (date(2024, 1, 1), date(2024, 1, 3))
+
+
+def test_full_days_partial_edges_are_excluded():
+    assert full_days(_utc(2024, 1, 1, 10), _utc(2024, 1, 3, 12)) == (date(2024, 1, 2), date(2024, 1, 2))
+
+
+def test_full_days_without_full_day_is_empty():
+    first, last = full_days(_utc(2024, 1, 1, 10), _utc(2024, 1, 2, 12))
+    assert first > last
+
+
+def test_full_days_converts_to_utc():
+    msk = timezone(timedelta(hours=3))
+    # 2024-01-01 03:00 MSK = 2024-01-01 00:00 UTC
+    assert full_days(datetime(2024, 1, 1, 3, tzinfo=msk), datetime(2024, 1, 3, 2, 59, 59, tzinfo=msk)) == (
+        date(2024, 1, 1), date(2024, 1, 2),
+    )
+
+
+def test_full_days_naive_datetimes_are_utc():
+    assert full_days(datetime(2024, 1, 1), datetime(2024, 1, 1, 23, 59, 59)) == (date(2024, 1, 1), date(2024, 1, 1))
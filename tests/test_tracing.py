@@ -0,0 +1,35 @@
+import json
+
+from app import tracing
+from app.config import get_settings
+
+
+def test_spans_are_exported_as_otlp_lines(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("TRACE_FILE", str(path))
+    get_settings.cache_clear()
+    tracing._stop_exporter()
+    try:
+        with tracing.span("outer", chats=2):
+            with tracing.span("inner"):
+                pass
+        tracing._stop_exporter()  # дожидаемся потока записи
+    finally:
+        get_settings.cache_clear()
+
+    inner, outer = [json.loads(line)["span"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert (inner["name"], outer["name"]) == ("inner", "outer")
+    assert inner["parentSpanId"] == outer["spanId"] and inner["traceId"] == outer["traceId"]
+    assert outer["attributes"] == [{"key": "chats", "value": {"intValue": "2"}}]
+
+
+def test_empty_trace_file_disables_export(monkeypatch):
+    monkeypatch.setenv("TRACE_FILE", "")
+    get_settings.cache_clear()
+    tracing._stop_exporter()
+    try:
+        with tracing.span("noop"):
+            pass
+        assert tracing._exporter is None
+    finally:
+        get_settings.cache_clear()
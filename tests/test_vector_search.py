@@ -0,0 +1,41 @@
+from app.qa import vector_scan_settings
+
+
+EXACT = {"enable_indexscan": "off"}
+
+
+def _settings(top_k=30, embedded=100_000, total=100_000, iterative=False, exact_max_rows=20_000, ef_max=1000):
+    return vector_scan_settings(top_k, embedded, total, iterative, exact_max_rows, ef_max)
+
+
+def test_small_filtered_subset_is_scanned_exactly():
+    assert _settings(embedded=500, total=1_000_000) == EXACT
+    assert _settings(embedded=20_000, total=1_000_000) == EXACT
+
+
+def test_unfiltered_keeps_default_ef_search():
+    assert _settings(top_k=10) == {"hnsw.ef_search": "40"}
+
+
+def test_ef_search_not_below_top_k():
+    assert _settings(top_k=100) == {"hnsw.ef_search": "200"}
+
+
+def test_ef_search_scales_with_selectivity():
+    # доля 1/10 -> 2 * 30 * 10
+    assert _settings(embedded=100_000, total=1_000_000) == {"hnsw.ef_search": "600"}
+
+
+def test_too_selective_falls_back_to_exact_scan():
+    assert _settings(embedded=25_000, total=1_000_000) == EXACT
+
+
+def test_iterative_scan_caps_ef_search():
+    assert _settings(embedded=25_000, total=1_000_000, iterative=True) == {
+        "hnsw.ef_search": "1000", "hnsw.iterative_scan": "relaxed_order",
+    }
+
+
+def test_stale_total_does_not_shrink_ef_search():
+    # total из chat_daily_stats может отставать от отфильтрованного подмножества
+    assert _settings(embedded=30_000, total=10_000) == {"hnsw.ef_search": "60"}